@@ -1,22 +1,104 @@
-from fastapi import Depends
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import Depends, HTTPException, Path, Request
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
 from sqlmodel import Session
 from typing import Annotated
 
-from backend.app.core.database import engine
-from backend.app.models import User
+from backend.app.core.sites import sites, SITE_ID_PATTERN
+from backend.app.core.security import Principal, authenticator
+from backend.app.models import DEFAULT_SITE
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/token")
+import uuid
 
-def get_session():
-    with Session(engine) as session:
+# auto_error is off so requests without credentials still reach the check below,
+# which lets everything through while AUTH_ENABLED is off
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/token", auto_error=False)
+api_key_scheme = APIKeyHeader(name="X-API-Key", auto_error=False)
+
+def site_path(site_id: Annotated[str, Path(pattern=SITE_ID_PATTERN)]) -> str:
+    """
+        Declares the {site_id} prefix of site scoped routes and rejects unknown sites
+    """
+    if not sites.exists(site_id):
+        raise HTTPException(status_code=404, detail="Site not found")
+
+    return site_id
+
+def get_site(request: Request) -> str:
+    return request.path_params.get("site_id", DEFAULT_SITE)
+
+siteDep = Annotated[str, Depends(get_site)]
+
+def get_session(site: siteDep):
+    """
+        Session on the primary database, for routes that write
+    """
+    with Session(sites.engine(site)) as session:
         yield session
 
-sessionDep = Annotated[Session, Depends(get_session)]
+def get_read_session(site: siteDep):
+    """
+        Session on the read engine (replica or read-only pool), for query routes
+    """
+    with Session(sites.read_engine(site)) as session:
+        yield session
+
+writeSessionDep = Annotated[Session, Depends(get_session)]
+readSessionDep = Annotated[Session, Depends(get_read_session)]
+
+tokenDep = Annotated[str | None, Depends(oauth2_scheme)]
+apiKeyDep = Annotated[str | None, Depends(api_key_scheme)]
+
+def _unauthorized() -> HTTPException:
+    return HTTPException(
+        status_code=401,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def get_current_user(token: tokenDep) -> Principal:
+    """
+        User of the bearer token, verified from memory (no database query)
+    """
+    principal = authenticator.authenticate(token=token)
+
+    # API keys of devices and gateways never open user routes
+    if principal is None or not principal.is_user:
+        raise _unauthorized()
+
+    return principal
+
+CurrentUser = Annotated[Principal, Depends(get_current_user)]
+
+def get_device_or_user(device_id: uuid.UUID, token: tokenDep, api_key: apiKeyDep) -> Principal:
+    """
+        Device calling with its own API key (X-API-Key), or a user token.
+        Used on the ingestion path, so it never queries the database.
+    """
+    principal = authenticator.authenticate(token=token, api_key=api_key)
+
+    if principal is None:
+        raise _unauthorized()
+
+    if principal.is_gateway or (principal.is_device and principal.subject != device_id):
+        raise HTTPException(status_code=403, detail="API key belongs to another device")
+
+    return principal
+
+DeviceOrUser = Annotated[Principal, Depends(get_device_or_user)]
+
+def get_gateway_or_user(site: siteDep, token: tokenDep, api_key: apiKeyDep) -> Principal:
+    """
+        Edge gateway calling with its site's gateway key (X-API-Key), or a user token.
+        Device keys cannot forward batches for other devices.
+    """
+    principal = authenticator.authenticate(token=token, api_key=api_key)
+
+    if principal is None:
+        raise _unauthorized()
 
-tokenDep = Annotated[str, Depends(oauth2_scheme)]
+    if principal.is_device or (principal.is_gateway and principal.site != site):
+        raise HTTPException(status_code=403, detail="API key cannot forward readings to this site")
 
-# TODO: create Security stuff(follow: https://fastapi.tiangolo.com/tutorial/security/simple-oauth2/)
-# def get_current_user(session: sessionDep, token: tokenDep) -> User:
+    return principal
 
-# CurrentUser = Annotated[User, Depends(get_current_user)]
\ No newline at end of file
+GatewayOrUser = Annotated[Principal, Depends(get_gateway_or_user)]
@@ -1,9 +1,28 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-from backend.app.api.routes import devices, events
+from backend.app.api.deps import get_current_user, site_path
+from backend.app.api.routes import devices, events, rules, users
 from backend.app.core import websocket
 
 api_router = APIRouter()
 
-api_router.include_router(devices.router)
-api_router.include_router(events.router)
\ No newline at end of file
+# Devices authenticate the ingestion routes themselves (API key or user token),
+# everything else needs a user token
+authenticated = [Depends(get_current_user)]
+
+api_router.include_router(users.router)
+api_router.include_router(devices.ingest_router)
+api_router.include_router(devices.router, dependencies=authenticated)
+api_router.include_router(events.router, dependencies=authenticated)
+api_router.include_router(rules.router, dependencies=authenticated)
+
+# The same routes scoped to one site (building), each site has its own database.
+# Routes without the prefix serve the default site.
+site_router = APIRouter(prefix="/sites/{site_id}", dependencies=[Depends(site_path)])
+
+site_router.include_router(devices.ingest_router)
+site_router.include_router(devices.router, dependencies=authenticated)
+site_router.include_router(events.router, dependencies=authenticated)
+site_router.include_router(rules.router, dependencies=authenticated)
+
+api_router.include_router(site_router)
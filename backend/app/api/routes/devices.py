@@ -1,33 +1,72 @@
-from fastapi import APIRouter, HTTPException
-from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from datetime import datetime, timedelta
 
 from backend.app import crud
-from backend.app.api.deps import sessionDep
+from backend.app.api.deps import readSessionDep, writeSessionDep, siteDep, DeviceOrUser, GatewayOrUser
 from backend.app.core.websocket import manager
-from backend.app.core.config import logger
+from backend.app.core.changes import etag_matches, validators
+from backend.app.core.config import logger, settings, SAMPLED
+from backend.app.core.ingest import Admission, ingest_guard
+from backend.app.core.formats import (
+    BodyTooLarge, ExportFormat, MEDIA_TYPES, FastJSONResponse, encode_chunks,
+    format_from_content_type, iter_records, read_body
+)
+from backend.app.core.metrics import INGEST_BATCH_READINGS, TimedRoute
+from backend.app.core.profiling import phase
+from backend.app.core.sites import sites
 from backend.app.models import (
     DevicePublic, DeviceCreate, DeviceUpdate, DeviceStatus,
-    EventCreate, EventType, EventPublic
+    DeviceSummaryPublic, DeviceKeyPublic, GatewayKeyPublic, DeviceStatePublic, DeviceStatusTime,
+    BatteryForecast, BatteryReading, DeviceReadingBatch, EventCreate, EventType, EventPublic
 )
 
+import logging
+import math
 import uuid
 
 
-router = APIRouter(prefix="/devices", tags=["devices"])
+router = APIRouter(prefix="/devices", tags=["devices"], route_class=TimedRoute)
+# Routes called by the devices themselves, authenticated with device API keys
+ingest_router = APIRouter(prefix="/devices", tags=["devices"], route_class=TimedRoute)
 
 
 @router.get("", response_model=list[DevicePublic])
-async def get_all_devices(session: sessionDep):
+async def get_all_devices(request: Request, site: siteDep, session: readSessionDep, since_version: int | None = None):
     """
-        Get a list of all devices
+        Get a list of all devices.
+        Answers 304 when If-None-Match has the current ETag, without querying the database.
+        With since_version only devices changed after that version are listed,
+        deleted ones are in the X-Deleted-Devices header. X-Full-Snapshot is set
+        when the version is too old to compute changes and every device is listed.
     """
-    logger.info("Request to list all devices is received")
+    logger.info("Request to list all devices is received", extra=SAMPLED)
+
+    device_changes = sites.state(site).device_changes
+
+    # Read before querying, a write racing with the query only makes the ETag older
+    headers = validators(device_changes.version, device_changes.modified)
+
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
 
     try:
-        devices = crud.get_devices(session=session)
-        logger.debug(f"Retrieved {len(devices)} devices from database")
+        changes = device_changes.changed_since(since_version) if since_version is not None else None
+
+        if changes is None:
+            devices = crud.get_device_rows(session=session)
+            if since_version is not None:
+                headers["X-Full-Snapshot"] = "1"
+        else:
+            changed, deleted = changes
+            devices = crud.get_device_rows(session=session, device_ids=changed)
+            headers["X-Deleted-Devices"] = ",".join(str(device_id) for device_id in deleted)
+
+        logger.debug("Retrieved %d devices from database", len(devices))
         
-        return devices
+        with phase("serialization"):
+            return FastJSONResponse(devices, headers=headers)
     
     except Exception:
         logger.exception("Error retrieving device list")
@@ -37,21 +76,22 @@ async def get_all_devices(session: sessionDep):
 #TODO: Create test for this
 #==========================================
 @router.post("", response_model=DevicePublic)
-async def create_device(device_in: DeviceCreate, session: sessionDep):
+async def create_device(device_in: DeviceCreate, site: siteDep, session: writeSessionDep):
     """
         Create new device
     """
-    logger.info(f"Device creation request received: {device_in.model_dump(mode="json")}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Device creation request received: %s", device_in.model_dump(mode="json"))
 
     try:
         device = crud.create_device(session=session, device=device_in)
         device_data = DevicePublic.model_validate(device).model_dump(mode="json")
-        logger.info(f"New device creation posted with data: {device_data}")
+        logger.info("New device creation posted with data: %s", device_data)
 
         await manager.broadcast({
             "type": "device_added",
             "device": device_data
-        })
+        }, site=site)
 
         return device
     
@@ -61,120 +101,467 @@ async def create_device(device_in: DeviceCreate, session: sessionDep):
 
 
 #==========================================
+@router.post("/import", response_model=dict)
+async def import_devices(request: Request, site: siteDep, session: writeSessionDep, format: ExportFormat | None = None):
+    """
+        Bulk create devices from a CSV (with header) or NDJSON body.
+        The body is parsed as it arrives and inserted in chunks, each chunk in its own transaction.
+        Clients get one "devices_imported" message instead of one per device.
+    """
+    fmt = format or format_from_content_type(request.headers.get("content-type"))
+    logger.info("Device import requested (%s)", fmt.value)
+
+    imported = 0
+    errors = []
+    chunk: list[DeviceCreate] = []
+
+    try:
+        async for line, record in iter_records(request.stream(), fmt):
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                chunk.append(DeviceCreate.model_validate(record))
+            except (ValueError, ValidationError) as e:
+                if len(errors) < 100:
+                    errors.append({"line": line, "error": str(e)})
+                continue
+
+            if len(chunk) >= settings.IMPORT_CHUNK_SIZE:
+                imported += len(crud.create_devices(session=session, devices=chunk))
+                chunk = []
+
+        imported += len(crud.create_devices(session=session, devices=chunk))
+
+    except Exception:
+        logger.exception("Unexpected error during device import after %d devices", imported)
+        raise HTTPException(status_code=500, detail=f"Import failed after {imported} devices")
+
+    logger.info("Imported %d devices, %d rows rejected", imported, len(errors))
+
+    if imported:
+        await manager.broadcast({
+            "type": "devices_imported",
+            "count": imported,
+            "summary": sites.state(site).summary.snapshot(),
+        }, site=site)
+
+    return {"imported": imported, "rejected": len(errors), "errors": errors}
+
+
+@ingest_router.post("/readings", response_model=dict)
+async def ingest_readings(request: Request, principal: GatewayOrUser, session: writeSessionDep):
+    """
+        Batch of readings forwarded by an edge gateway (python -m backend.app.gateway)
+        with its gateway key, JSON optionally gzip compressed (Content-Encoding: gzip).
+        Readings keep the time they were taken. Each device of the batch uses one
+        reading of its rate budget, the readings of devices over it are dropped.
+    """
+    try:
+        body = await read_body(request.stream(), request.headers.get("content-encoding"), settings.INGEST_BATCH_MAX_BYTES)
+        batch = DeviceReadingBatch.model_validate_json(body)
+    except BodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False, include_input=False))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if len(batch.readings) > settings.INGEST_BATCH_MAX_READINGS:
+        raise HTTPException(status_code=413, detail=f"At most {settings.INGEST_BATCH_MAX_READINGS} readings per batch")
+
+    logger.info("Batch of %d readings received", len(batch.readings))
+
+    # Before any query, like single readings. A gateway may have queued many readings
+    # of a device while offline, so the budget is checked per device, not per reading.
+    latest = {}
+    for reading in batch.readings:
+        if reading.device_id not in latest or reading.timestamp >= latest[reading.device_id].timestamp:
+            latest[reading.device_id] = reading
+
+    dropped = {
+        device_id for device_id, reading in latest.items()
+        if ingest_guard.admit(device_id, (reading.status, reading.battery)) == Admission.DROP
+    }
+    readings = [reading for reading in batch.readings if reading.device_id not in dropped]
+
+    try:
+        counts = crud.apply_readings(session=session, readings=readings)
+        counts["dropped"] = len(batch.readings) - len(readings)
+
+        for outcome, count in counts.items():
+            INGEST_BATCH_READINGS.labels(outcome).inc(count)
+        if counts["unknown"]:
+            logger.warning("%d readings of unknown devices ignored", counts["unknown"])
+        if dropped:
+            logger.warning("%d devices are over their reading rate, %d readings dropped", len(dropped), counts["dropped"])
+
+        return counts
+
+    except Exception:
+        logger.exception("Unexpected error while applying a batch of %d readings", len(batch.readings))
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/export")
+async def export_devices(session: readSessionDep, format: ExportFormat = ExportFormat.NDJSON):
+    """
+        Stream every device as NDJSON or CSV without loading them all
+    """
+    logger.info("Device export requested (%s)", format.value)
+
+    batches = crud.iter_devices(session=session, batch_size=settings.EXPORT_BATCH_SIZE)
+
+    return StreamingResponse(
+        encode_chunks(batches, crud.DEVICE_EXPORT_COLUMNS, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=devices.{format.value}"},
+    )
+
+
+#==========================================
+@router.get("/summary", response_model=DeviceSummaryPublic)
+async def get_device_summary(site: siteDep, lowest: int = Query(default=5, ge=0, le=100)):
+    """
+        Device counts by status, location and type, battery distribution
+        and the devices with the lowest battery. Served from memory.
+    """
+    return sites.state(site).summary.snapshot(lowest=lowest)
+
+
+#==========================================
+@router.get("/states", response_model=list[DeviceStatePublic])
+async def get_device_states(session: readSessionDep, at: datetime | None = None):
+    """
+        Status and battery of every device at time `at` (default now), from the state history
+    """
+    at = at or datetime.now()
+    logger.info("Device states requested at %s", at)
+
+    try:
+        states = crud.get_device_states_at(session=session, at=at)
+
+        with phase("serialization"):
+            return FastJSONResponse(states)
+
+    except Exception:
+        logger.exception("Error retrieving device states at %s", at)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/battery-forecast", response_model=list[BatteryForecast])
+async def get_battery_forecast(
+    site: siteDep,
+    threshold: int = Query(default=10, ge=0, le=100),
+    days: float = Query(default=30, gt=0, le=365),
+):
+    """
+        Devices whose battery is predicted to reach `threshold` percent within `days`,
+        soonest first. Drain rates are kept in memory, nothing is queried.
+    """
+    logger.info("Battery forecast requested for %s%% within %s days", threshold, days)
+
+    try:
+        forecast = sites.state(site).batteries.predict(threshold, days)
+
+        with phase("serialization"):
+            return FastJSONResponse(forecast)
+
+    except Exception:
+        logger.exception("Error computing battery forecast")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/time-in-status", response_model=list[DeviceStatusTime])
+async def get_time_in_status(
+    session: readSessionDep,
+    status: DeviceStatus = DeviceStatus.OPEN,
+    start: datetime | None = None,
+    end: datetime | None = None,
+):
+    """
+        Seconds each device spent in a status (default open) between start and end.
+        Defaults to the last 24 hours.
+    """
+    end = end or datetime.now()
+    start = start or end - timedelta(days=1)
+
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    logger.info("Time in status %s requested from %s to %s", status.value, start, end)
+
+    try:
+        times = crud.get_time_in_status(session=session, status=status, start=start, end=end)
+
+        with phase("serialization"):
+            return FastJSONResponse(times)
+
+    except Exception:
+        logger.exception("Error computing time in status %s", status.value)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/search", response_model=list[DevicePublic])
+async def search_devices(
+    session: readSessionDep,
+    q: str = Query(min_length=1, max_length=200),
+    type: str | None = None,
+    limit: int = Query(default=50, ge=1, le=500),
+):
+    """
+        Devices whose name, location or type match every word of `q` as a prefix, best matches first
+    """
+    logger.info("Device search requested for %r", q)
+
+    try:
+        devices = crud.search_devices(session=session, query=q, device_type=type, limit=limit)
+
+        with phase("serialization"):
+            return FastJSONResponse(devices)
+
+    except Exception:
+        logger.exception("Error searching devices for %r", q)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+#==========================================
+@router.post("/gateway-keys", response_model=GatewayKeyPublic)
+async def create_gateway_key(site: siteDep, session: writeSessionDep):
+    """
+        Issue an API key edge gateways forward this site's readings with.
+        The key is only shown in this response.
+    """
+    gateway_key, api_key = crud.create_gateway_key(session=session)
+    logger.info("Gateway key issued for site: %s", site)
+
+    return GatewayKeyPublic(api_key=api_key, created_at=gateway_key.created_at)
+
+@router.delete("/gateway-keys", response_model=dict)
+async def revoke_gateway_keys(site: siteDep, session: writeSessionDep):
+    """
+        Revoke every gateway key of this site
+    """
+    revoked = crud.delete_gateway_keys(session=session)
+    logger.info("Revoked %d gateway keys of site: %s", revoked, site)
+
+    return {"revoked": revoked}
+
 @router.get("/{device_id}", response_model=DevicePublic)
-async def get_device(device_id: uuid.UUID, session: sessionDep):
+async def get_device(device_id: uuid.UUID, request: Request, response: Response, site: siteDep, session: readSessionDep):
     """
-        Get specific device by ID
+        Get specific device by ID, 304 when If-None-Match has its current ETag
     """
-    logger.info(f"device retrieval requested with id: {device_id}")
+    logger.info("device retrieval requested with id: %s", device_id, extra=SAMPLED)
+
+    headers = validators(*sites.state(site).device_changes.item(device_id))
+
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
 
     try:
         device = crud.get_device_by_id(session=session, device_id=device_id)
 
         if not device:
-            logger.warning(f"Device: {device_id} not found")
+            logger.warning("Device: %s not found", device_id)
             raise HTTPException(status_code=404, detail="Device not found")
         
-        logger.debug(f"Device: {device_id} data retrieved successfully")
+        logger.debug("Device: %s data retrieved successfully", device_id)
         
         return device
     
     except HTTPException:
         raise
     except Exception:
-        logger.exception(f"Error retrieving device with id: {device_id}")
+        logger.exception("Error retrieving device with id: %s", device_id)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+#==========================================
+@router.get("/{device_id}/battery", response_model=list[BatteryReading])
+async def get_battery_readings(
+    device_id: uuid.UUID,
+    session: readSessionDep,
+    start: datetime | None = None,
+    end: datetime | None = None,
+):
+    """
+        Battery readings of a device, oldest first
+    """
+    logger.info("Battery readings requested for device: %s", device_id)
+
+    try:
+        readings = crud.get_battery_readings(session=session, device_id=device_id, start=start, end=end)
+
+        with phase("serialization"):
+            return FastJSONResponse([{"timestamp": timestamp, "battery": battery} for timestamp, battery in readings])
+
+    except Exception:
+        logger.exception("Error retrieving battery readings of device: %s", device_id)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
 #TODO: create test for this
 #==========================================
 @router.patch("/{device_id}", response_model=DevicePublic)
-async def update_device(device_id: uuid.UUID, device_in: DeviceUpdate, session: sessionDep):
+async def update_device(device_id: uuid.UUID, device_in: DeviceUpdate, site: siteDep, session: writeSessionDep):
     """
         Update Device
     """
-    logger.info(f"Device update requested with id: {device_id} and data {device_in.model_dump()}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Device update requested with id: %s and data %s", device_id, device_in.model_dump())
 
     try:
         device = crud.get_device_by_id(session=session, device_id=device_id)
 
         if not device:
-            logger.warning(f"Device: {device_id} not found for update")
+            logger.warning("Device: %s not found for update", device_id)
             raise HTTPException(status_code=404, detail="Device not found")
         
         updated_device = crud.update_device(session=session, db_device=device, device_in=device_in)
 
-        logger.info(f"Device: {device_id} updated successfully")
+        logger.info("Device: %s updated successfully", device_id)
 
         await manager.broadcast({
             "type": "device_updated",
             "device": DevicePublic.model_validate(updated_device).model_dump(mode="json")
-        })
+        }, site=site)
 
         return updated_device
     
     except HTTPException:
         raise
     except Exception:
-        logger.exception(f"Error updating device with id: {device_id}")
+        logger.exception("Error updating device with id: %s", device_id)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 #TODO: add tests for this
 #==========================================
 @router.delete("/{device_id}", response_model=str)
-async def delete_device(device_id: uuid.UUID, session: sessionDep):
+async def delete_device(device_id: uuid.UUID, site: siteDep, session: writeSessionDep):
     """
         Delete User
     """
-    logger.info(f"Device deletion requested with device id: {device_id}")
+    logger.info("Device deletion requested with device id: %s", device_id)
 
     try:
         success = crud.delete_device(session=session, device_id=device_id)
 
         if not success:
-            logger.warning(f"Failed to delete device: {device_id}")
+            logger.warning("Failed to delete device: %s", device_id)
             raise HTTPException(status_code=404, detail="Error deleting device")
         
-        logger.info(f"Device: {device_id} deleted successfully")
+        logger.info("Device: %s deleted successfully", device_id)
 
         await manager.broadcast({
             "type": "device_deleted",
             "device_id": device_id
-        })
+        }, site=site)
 
         return "Deleted device successfully"
     
     except HTTPException:
         raise
     except Exception:
-        logger.exception(f"Error deleting device: {device_id}")
+        logger.exception("Error deleting device: %s", device_id)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
 #==========================================
-@router.get("/{device_id}/trigger", response_model=dict)
+@router.post("/{device_id}/keys", response_model=DeviceKeyPublic)
+async def create_device_key(device_id: uuid.UUID, session: writeSessionDep):
+    """
+        Issue an API key for a device. The key is only shown in this response.
+    """
+    logger.info("API key requested for device: %s", device_id)
+
+    if not crud.get_device_by_id(session=session, device_id=device_id):
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    try:
+        device_key, api_key = crud.create_device_key(session=session, device_id=device_id)
+
+        return DeviceKeyPublic(device_id=device_id, api_key=api_key, created_at=device_key.created_at)
+
+    except Exception:
+        logger.exception("Error creating API key for device: %s", device_id)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.delete("/{device_id}/keys", response_model=dict)
+async def revoke_device_keys(device_id: uuid.UUID, session: writeSessionDep):
+    """
+        Revoke every API key of a device
+    """
+    revoked = crud.delete_device_keys(session=session, device_id=device_id)
+    logger.info("Revoked %d API keys of device: %s", revoked, device_id)
+
+    return {"revoked": revoked}
+
+
+#==========================================
+@ingest_router.get("/{device_id}/trigger", response_model=dict)
 async def trigger_device(
     device_id: uuid.UUID, 
     new_status: str, 
-    session: sessionDep,
+    principal: DeviceOrUser,
+    site: siteDep,
+    session: writeSessionDep,
     battery: int | None = None
 ):
     """
         Device state change for open/closed with battery percentage
         Will be called by the IoT devices
     """
-    logger.info(f"Device state change requested with device id: {device_id}, new status: {new_status} and battery: {battery}")
+    logger.info(
+        "Device state change requested with device id: %s, new status: %s and battery: %s",
+        device_id, new_status, battery, extra=SAMPLED,
+    )
+
+    # Ids the site does not know of are looked up first, so they never take up
+    # rate limit state. Known devices are admitted before any query, a flooding
+    # device never reaches the database.
+    device = None
+    if device_id not in sites.state(site).summary:
+        device = crud.get_device_by_id(session=session, device_id=device_id)
+        if not device:
+            logger.warning("Device with id: %s is not found", device_id)
+            raise HTTPException(status_code=404, detail="Device not found")
+
+    admission = ingest_guard.admit(device_id, (new_status, battery))
+    if admission == Admission.DROP:
+        logger.warning("Device %s is over its reading rate, dropped", device_id, extra=SAMPLED)
+        raise HTTPException(
+            status_code=429,
+            detail="Too many readings from this device",
+            headers={"Retry-After": str(math.ceil(ingest_guard.retry_after(device_id)))},
+        )
 
-    device = crud.get_device_by_id(session=session, device_id=device_id)
+    if device is None:
+        device = crud.get_device_by_id(session=session, device_id=device_id)
 
     try:
         if not device:
-            logger.warning(f"Device with id: {device_id} is not found")
+            logger.warning("Device with id: %s is not found", device_id)
             raise HTTPException(status_code=404, detail="Device not found")
         
         if new_status not in DeviceStatus:
-            logger.warning(f"Device with id: {device_id} is not found")
+            logger.warning("Device with id: %s is not found", device_id)
             raise HTTPException(status_code=400, detail="Status is invalid")
+
+        # Same reading again: the device is alive but nothing changed. The stored
+        # state is checked too, other paths (offline check, PATCH) may have changed it.
+        if (
+            admission == Admission.COALESCE
+            and device.status == new_status
+            and (battery is None or device.battery == battery)
+        ):
+            device = crud.touch_device(session=session, db_device=device)
+            logger.debug("Repeated reading of device %s coalesced", device_id)
+
+            with phase("serialization"):
+                return {
+                    "success": True,
+                    "coalesced": True,
+                    "device": DevicePublic.model_validate(device).model_dump(mode="json"),
+                    "event": None,
+                }
         
         update_data = {
             "status": new_status,
@@ -185,51 +572,53 @@ async def trigger_device(
             if 0 <= battery <= 100:
                 update_data["battery"] = battery
             else:
-                logger.warning(f"Battery value {battery} is out of range (0-100)")
+                logger.warning("Battery value %s is out of range (0-100)", battery)
                 raise HTTPException(status_code=400, detail="Battery must be 0-100")
 
-        logger.debug(f"Updating device: {device_id} with: {update_data}")
+        logger.debug("Updating device: %s with: %s", device_id, update_data)
         device_in_update = DeviceUpdate(**update_data) 
+        previous_status = device.status
         
         device = crud.update_device(session=session, db_device=device, device_in=device_in_update)
 
-        event_details = f"status changed to {new_status}"
-        if battery is not None:
-            event_details += f" (battery: {battery}%)"
-
-        logger.debug(f"Creating event for device {device_id}: {event_details}")
+        logger.debug("Creating event for device %s: %s -> %s", device_id, previous_status, new_status)
 
         event = crud.create_event(
             session=session, 
             event=EventCreate(
                 device_id = device_id,
                 type=EventType.STATUS_CHANGE,
-                details=event_details,
+                old_status=previous_status,
+                new_status=new_status,
+                battery=battery,
             ),
         )
 
         if battery is not None and battery < 10:
-            logger.warning(f"Device {device_id} has low battery: {battery}%")
+            logger.warning("Device %s has low battery: %s%%", device_id, battery)
             crud.create_event(
                 session=session, 
                 event=EventCreate(
                     device_id = device_id,
                     type=EventType.BATTERY_LOW,
-                    details=f"battery low: {battery}%",
+                    battery=battery,
                 ),
             )
 
-        logger.info(f"Successfully updated {device_id}")
+        logger.info("Successfully updated %s", device_id, extra=SAMPLED)
 
-        return {
-            "success": True,
-            "device": DevicePublic.model_validate(device).model_dump(mode="json"),
-            "event": EventPublic.model_validate(event).model_dump(mode="json"),
-        }
+        with phase("serialization"):
+            return {
+                "success": True,
+                "device": DevicePublic.model_validate(device).model_dump(mode="json"),
+                "event": EventPublic.model_validate(event).model_dump(mode="json"),
+            }
     
     except HTTPException as e:
-        logger.error(f"HTTP error while triggering device: {device_id}: {e.detail}")
+        logger.error("HTTP error while triggering device: %s: %s", device_id, e.detail)
         raise
     except Exception as e:
-        logger.exception(f"Unexpected error while processing trigger for device: {device_id}")
+        # The reading was not written, do not coalesce its retry
+        ingest_guard.forget(device_id)
+        logger.exception("Unexpected error while processing trigger for device: %s", device_id)
         raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
@@ -1,26 +1,179 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from datetime import datetime, timedelta
 
 from backend.app import crud
-from backend.app.api.deps import sessionDep
-from backend.app.models import EventPublic
-from backend.app.core.config import logger
+from backend.app.api.deps import readSessionDep, siteDep
+from backend.app.models import (
+    EventPublic, EventType, EventRollupSeries, EventRollupPoint,
+    RollupResolution, RollupGroup
+)
+from backend.app.core.config import logger, settings, SAMPLED
+from backend.app.core.metrics import TimedRoute
+from backend.app.core.formats import ExportFormat, MEDIA_TYPES, FastJSONResponse, encode_chunks
+from backend.app.core.profiling import phase
+from backend.app.core.changes import etag_matches, validators
+from backend.app.core.sites import sites
 
-router = APIRouter(prefix="/events", tags=["events"])
+import uuid
+
+router = APIRouter(prefix="/events", tags=["events"], route_class=TimedRoute)
 
 @router.get("", response_model=list[EventPublic])
-async def get_events(session: sessionDep, limit: int = 10):
+async def get_events(request: Request, site: siteDep, session: readSessionDep, limit: int = 10):
     """
-        Get recent events
+        Get recent events, 304 when If-None-Match has the current ETag
     """
-    logger.info(f"Event data requested with a limit of: {limit}")
+    logger.info("Event data requested with a limit of: %s", limit, extra=SAMPLED)
+
+    event_changes = sites.state(site).event_changes
+    headers = validators(event_changes.version, event_changes.modified)
+
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
 
     try:
-        events = crud.get_events(session=session, limit=limit)
+        events = crud.get_event_rows(session=session, limit=limit)
 
-        logger.debug(f"Retrieved {len(events)} events from database")
+        logger.debug("Retrieved %d events from database", len(events))
         
-        return events
+        with phase("serialization"):
+            return FastJSONResponse(events, headers=headers)
     
     except Exception:
         logger.exception("Error retrieving events")
-        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+#==========================================
+def select_resolution(start: datetime, end: datetime) -> RollupResolution:
+    """
+        Pick the coarsest resolution that still gives a useful number of points
+    """
+    span = end - start
+    minute_retention = datetime.now() - timedelta(hours=settings.ROLLUP_MINUTE_RETENTION_HOURS)
+
+    if span <= timedelta(hours=6) and start >= minute_retention:
+        return RollupResolution.MINUTE
+    if span <= timedelta(days=7):
+        return RollupResolution.HOUR
+
+    return RollupResolution.DAY
+
+@router.get("/rollups", response_model=EventRollupSeries)
+async def get_event_rollups(
+    session: readSessionDep,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    group_by: RollupGroup = RollupGroup.TYPE,
+    resolution: RollupResolution | None = None,
+    device_id: uuid.UUID | None = None,
+    type: EventType | None = None,
+    location: str | None = None,
+):
+    """
+        Event counts over time from the pre-aggregated rollups.
+        Defaults to the last 24 hours, resolution is picked from the range when not given.
+    """
+    end = end or datetime.now()
+    start = start or end - timedelta(days=1)
+
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    resolution = resolution or select_resolution(start, end)
+
+    logger.info("Event rollups requested from %s to %s by %s (%s)", start, end, group_by.value, resolution.value)
+
+    try:
+        rows = crud.get_event_rollups(
+            session=session,
+            resolution=resolution,
+            group_by=group_by,
+            start=start,
+            end=end,
+            device_id=device_id,
+            event_type=type,
+            location=location,
+        )
+
+        return EventRollupSeries(
+            resolution=resolution,
+            group_by=group_by,
+            start=start,
+            end=end,
+            points=[
+                EventRollupPoint(
+                    bucket=bucket,
+                    key=key.value if isinstance(key, EventType) else str(key),
+                    count=count,
+                )
+                for bucket, key, count in rows
+            ],
+        )
+
+    except Exception:
+        logger.exception("Error retrieving event rollups")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+#==========================================
+@router.get("/search", response_model=list[EventPublic])
+async def search_events(
+    session: readSessionDep,
+    q: str = Query(min_length=1, max_length=200),
+    type: EventType | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+):
+    """
+        Events whose details, type or device match every word of `q` as a prefix, newest first
+    """
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    logger.info("Event search requested for %r from %s to %s", q, start, end)
+
+    try:
+        events = crud.search_events(session=session, query=q, event_type=type, start=start, end=end, limit=limit)
+
+        with phase("serialization"):
+            return FastJSONResponse(events)
+
+    except Exception:
+        logger.exception("Error searching events for %r", q)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+#==========================================
+@router.get("/export")
+async def export_events(
+    session: readSessionDep,
+    format: ExportFormat = ExportFormat.NDJSON,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    device_id: uuid.UUID | None = None,
+    type: EventType | None = None,
+):
+    """
+        Stream events in time order as NDJSON or CSV.
+        Memory use does not depend on the size of the range.
+    """
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    logger.info("Event export requested (%s) from %s to %s for device %s", format.value, start, end, device_id)
+
+    batches = crud.iter_events(
+        session=session,
+        start=start,
+        end=end,
+        device_id=device_id,
+        event_type=type,
+        batch_size=settings.EXPORT_BATCH_SIZE,
+    )
+
+    return StreamingResponse(
+        encode_chunks(batches, crud.EVENT_EXPORT_COLUMNS, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=events.{format.value}"},
+    )
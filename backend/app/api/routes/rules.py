@@ -0,0 +1,81 @@
+from fastapi import APIRouter, HTTPException
+
+from backend.app import crud
+from backend.app.api.deps import readSessionDep, writeSessionDep, siteDep
+from backend.app.core.config import logger
+from backend.app.core.metrics import TimedRoute
+from backend.app.core.sites import sites
+from backend.app.models import AlarmRuleCreate, AlarmRulePublic
+
+import uuid
+
+router = APIRouter(prefix="/rules", tags=["rules"], route_class=TimedRoute)
+
+@router.get("", response_model=list[AlarmRulePublic])
+async def get_rules(session: readSessionDep):
+    """
+        Get all alarm rules
+    """
+    return crud.get_rules(session=session)
+
+
+#==========================================
+@router.post("", response_model=AlarmRulePublic)
+async def create_rule(rule_in: AlarmRuleCreate, session: writeSessionDep):
+    """
+        Create an alarm rule, it is evaluated from the next reading on
+    """
+    logger.info("Rule creation requested: %s", rule_in.name)
+
+    try:
+        return crud.create_rule(session=session, rule=rule_in)
+
+    except ValueError as e:
+        logger.warning("Invalid rule %s: %s", rule_in.name, e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        logger.exception("Unexpected error during rule creation")
+        raise HTTPException(status_code=500, detail="Failed to create rule")
+
+
+#==========================================
+@router.delete("/{rule_id}", response_model=str)
+async def delete_rule(rule_id: uuid.UUID, session: writeSessionDep):
+    """
+        Delete alarm rule
+    """
+    logger.info("Rule deletion requested with id: %s", rule_id)
+
+    if not crud.delete_rule(session=session, rule_id=rule_id):
+        raise HTTPException(status_code=404, detail="Rule not found")
+
+    return "Deleted rule successfully"
+
+
+#==========================================
+@router.get("/armed", response_model=dict)
+async def get_armed(site: siteDep):
+    """
+        Locations that are armed ("*" means everywhere)
+    """
+    return {"armed": sorted(sites.state(site).rules.armed)}
+
+@router.post("/arm", response_model=dict)
+async def arm(session: writeSessionDep, location: str | None = None):
+    """
+        Arm one location or everything, it stays armed across restarts
+    """
+    armed = crud.arm_location(session=session, location=location)
+    logger.info("Armed: %s", location or "everywhere")
+
+    return {"armed": armed}
+
+@router.post("/disarm", response_model=dict)
+async def disarm(session: writeSessionDep, location: str | None = None):
+    """
+        Disarm one location or everything
+    """
+    armed = crud.disarm_location(session=session, location=location)
+    logger.info("Disarmed: %s", location or "everywhere")
+
+    return {"armed": armed}
@@ -0,0 +1,90 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.security import OAuth2PasswordRequestForm
+from datetime import datetime
+from typing import Annotated
+
+from backend.app import crud
+from backend.app.api.deps import CurrentUser, writeSessionDep, readSessionDep
+from backend.app.core.config import logger, settings
+from backend.app.core.metrics import TimedRoute
+from backend.app.core.security import authenticator, login_limiter
+from backend.app.models import Token, UserCreate, UserPublic
+
+import asyncio
+
+router = APIRouter(tags=["users"], route_class=TimedRoute)
+
+@router.post("/token", response_model=Token)
+async def login(request: Request, form: Annotated[OAuth2PasswordRequestForm, Depends()], session: readSessionDep):
+    """
+        Exchange email (as username) and password for a bearer token.
+        Refused with 429 after repeated failures for the email or client address.
+    """
+    email, address = form.username, request.client.host if request.client else None
+
+    retry_after = login_limiter.retry_after(email, address)
+    if retry_after:
+        logger.warning("Login for %s from %s refused, too many failures", email, address)
+        raise HTTPException(status_code=429, detail="Too many failed logins", headers={"Retry-After": str(retry_after)})
+
+    # Password hashing takes a while on purpose, keep it off the event loop
+    user = await asyncio.to_thread(crud.authenticate_user, session=session, email=email, password=form.password)
+    if user is None:
+        login_limiter.failed(email, address)
+        logger.warning("Failed login for %s from %s", email, address)
+        raise HTTPException(status_code=401, detail="Incorrect email or password", headers={"WWW-Authenticate": "Bearer"})
+
+    login_limiter.succeeded(email)
+    token, expires = authenticator.issue_token(user.id)
+    logger.info("User %s logged in", user.id)
+
+    return Token(access_token=token, expires_at=datetime.fromtimestamp(expires))
+
+@router.post("/stream-ticket", response_model=dict)
+async def stream_ticket(current_user: CurrentUser):
+    """
+        Single-use ticket to open a websocket or stream connection with ?ticket=
+    """
+    return {"ticket": authenticator.issue_ticket(current_user), "expires_in": settings.STREAM_TICKET_TTL}
+
+#==========================================
+@router.post("/token/revoke", response_model=dict)
+async def revoke_token(current_user: CurrentUser, session: writeSessionDep):
+    """
+        Revoke the token used for this request
+    """
+    if current_user.token_id is None:
+        raise HTTPException(status_code=400, detail="No token to revoke")
+
+    crud.revoke_token(
+        session=session,
+        token_id=current_user.token_id,
+        expires_at=datetime.fromtimestamp(current_user.expires),
+    )
+    logger.info("Token of user %s revoked", current_user.subject)
+
+    return {"revoked": True}
+
+@router.get("/users/me", response_model=UserPublic)
+async def get_me(current_user: CurrentUser, session: readSessionDep):
+    """
+        The user of the token
+    """
+    user = crud.get_user_by_id(session=session, user_id=current_user.subject) if current_user.subject else None
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return user
+
+@router.post("/users", response_model=UserPublic)
+async def create_user(user_in: UserCreate, current_user: CurrentUser, session: writeSessionDep):
+    """
+        Create a user, needs to be logged in
+    """
+    if crud.get_user_by_email(session=session, email=user_in.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
+
+    user = crud.create_user(session=session, user=user_in)
+    logger.info("User %s created by %s", user.id, current_user.subject)
+
+    return user
@@ -0,0 +1,247 @@
+from contextlib import asynccontextmanager
+from collections import deque
+from enum import Enum
+from typing import AsyncIterator, Iterable
+from urllib.parse import parse_qs
+
+from backend.app.core.config import logger, settings, SAMPLED
+from backend.app.core.lifecycle import reconnect_after
+from backend.app.core.metrics import ADMISSION_IN_FLIGHT, ADMISSION_REJECTED, EVENT_LOOP_LAG
+
+import asyncio
+import json
+import re
+
+class RouteClass(str, Enum):
+    ALARM = "alarm"                 # readings that open a door or window or report a device offline
+    ALARM_BATCH = "alarm_batch"     # gateway batches that say they carry alarm readings
+    INGEST = "ingest"               # other readings and gateway batches
+    INTERACTIVE = "interactive"     # everything else
+    HISTORY = "history"             # range queries over events and state history
+    EXPORT = "export"
+    SNAPSHOT = "snapshot"           # initial state of a new websocket or SSE client
+
+# Turned away first while the server is overloaded
+SHEDDABLE = frozenset({RouteClass.HISTORY, RouteClass.EXPORT, RouteClass.SNAPSHOT})
+
+ALARM_STATUSES = frozenset({"open", "offline"})
+
+# Set by edge gateways on reading batches that carry an alarm status. The body is
+# compressed and only read by the route, so the header is all there is to go on
+# before the request is admitted, and anyone can set it. Such batches get a pool
+# of their own, out of the way of other readings but still limited.
+ALARM_BATCH_HEADER = "X-Alarm-Readings"
+
+_API = r"^/api(?:/sites/[^/]+)?"
+
+# (method, path) -> class of the HTTP routes that are not INTERACTIVE. None is not
+# limited: probes, and streams and long polls which are long-lived (the stream
+# takes a SNAPSHOT slot itself, only while building its initial state).
+ROUTE_CLASSES: list[tuple[str, re.Pattern, RouteClass | None]] = [
+    ("GET", re.compile(_API + r"/devices/[^/]+/trigger$"), RouteClass.INGEST),
+    ("POST", re.compile(_API + r"/devices/readings$"), RouteClass.INGEST),
+    ("GET", re.compile(_API + r"/(?:devices|events)/export$"), RouteClass.EXPORT),
+    ("GET", re.compile(_API + r"/events/(?:rollups|search)$"), RouteClass.HISTORY),
+    ("GET", re.compile(_API + r"/devices/(?:states|time-in-status|search)$"), RouteClass.HISTORY),
+    ("GET", re.compile(_API + r"/devices/[^/]+/battery$"), RouteClass.HISTORY),
+    ("GET", re.compile(r"^/stream(?:/poll)?$"), None),
+    ("GET", re.compile(r"^/(?:health|ready|metrics)$"), None),
+]
+
+def classify(method: str, path: str, query_string: bytes = b"", headers: Iterable[tuple[bytes, bytes]] = ()) -> RouteClass | None:
+    """
+        Class of an HTTP request, None for requests that are not admission controlled
+    """
+    for route_method, pattern, route_class in ROUTE_CLASSES:
+        if method == route_method and pattern.match(path):
+            if route_class == RouteClass.INGEST and method == "GET":
+                status = parse_qs(query_string.decode("latin-1")).get("new_status", [""])[0]
+                if status in ALARM_STATUSES:
+                    return RouteClass.ALARM
+
+            if route_class == RouteClass.INGEST and method == "POST":
+                if any(name.lower() == ALARM_BATCH_HEADER.lower().encode() for name, _ in headers):
+                    return RouteClass.ALARM_BATCH
+
+            return route_class
+
+    return RouteClass.INTERACTIVE
+
+class Overloaded(Exception):
+    def __init__(self, route_class: RouteClass, retry_after: int):
+        super().__init__(f"Too busy for {route_class.value} requests")
+        self.route_class = route_class
+        self.retry_after = retry_after
+
+#==========================================
+class _Limiter:
+    """
+        At most `limit` requests at once (0 for no limit), up to `queue_size` more
+        wait their turn in arrival order. Runs on the event loop only.
+    """
+    def __init__(self, limit: int, queue_size: int):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.limit <= 0 or (self.in_flight < self.limit and not self._waiters):
+            self.in_flight += 1
+            return True
+
+        if len(self._waiters) >= self.queue_size or timeout <= 0:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            # Handed a slot just as the wait ran out
+            return waiter.done() and not waiter.cancelled()
+        except asyncio.CancelledError:
+            # Handed a slot just as the request went away, pass it on
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self):
+        # Hand the slot over instead of freeing it, so arrivals cannot overtake the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.in_flight -= 1
+
+class AdmissionController:
+    """
+        Per route class concurrency limits, so dashboards opened all at once during
+        an incident cannot crowd out the readings that raise alarms. Alarm readings
+        are never limited. History queries, exports and snapshots are turned away
+        at once while the event loop lags or many readings are in flight.
+        Rejected requests get 503 with Retry-After.
+    """
+    def __init__(
+        self,
+        limits: dict[str, int] | None = None,
+        queue_size: int = 32,
+        queue_timeout: float = 2.0,
+        shed_lag: float = 0.25,
+        shed_in_flight: int = 32,
+    ):
+        self.lag = 0.0
+        self.configure(limits or {}, queue_size, queue_timeout, shed_lag, shed_in_flight)
+
+        for route_class in RouteClass:
+            ADMISSION_IN_FLIGHT.labels(route_class.value).set_function(
+                lambda route_class=route_class: self._limiters[route_class].in_flight
+            )
+
+    def configure(self, limits: dict[str, int], queue_size: int, queue_timeout: float, shed_lag: float, shed_in_flight: int):
+        self.queue_timeout = queue_timeout
+        self.shed_lag = shed_lag
+        self.shed_in_flight = shed_in_flight
+        self._limiters = {
+            route_class: _Limiter(0 if route_class == RouteClass.ALARM else limits.get(route_class.value, 0), queue_size)
+            for route_class in RouteClass
+        }
+
+    def configure_from_settings(self):
+        self.configure(
+            settings.ADMISSION_LIMITS,
+            settings.ADMISSION_QUEUE_SIZE,
+            settings.ADMISSION_QUEUE_TIMEOUT,
+            settings.ADMISSION_SHED_LAG_SECONDS,
+            settings.ADMISSION_SHED_IN_FLIGHT,
+        )
+
+    @property
+    def overloaded(self) -> bool:
+        readings = sum(self._limiters[route_class].in_flight for route_class in (RouteClass.ALARM, RouteClass.ALARM_BATCH, RouteClass.INGEST))
+        return self.lag >= self.shed_lag or readings >= self.shed_in_flight or self._limiters[RouteClass.INGEST].waiting > 0
+
+    def in_flight(self) -> dict[str, int]:
+        return {route_class.value: limiter.in_flight for route_class, limiter in self._limiters.items()}
+
+    @asynccontextmanager
+    async def admit(self, route_class: RouteClass) -> AsyncIterator[None]:
+        """
+            Hold a slot of `route_class` for the duration of the block.
+            Raises Overloaded when there is none.
+        """
+        limiter = self._limiters[route_class]
+
+        if route_class in SHEDDABLE and self.overloaded:
+            ADMISSION_REJECTED.labels(route_class.value, "shed").inc()
+            raise Overloaded(route_class, reconnect_after())
+
+        # Low priority requests do not queue, a slot frees up or they come back later
+        timeout = 0.0 if route_class in SHEDDABLE else self.queue_timeout
+        if not await limiter.acquire(timeout):
+            ADMISSION_REJECTED.labels(route_class.value, "limit").inc()
+            raise Overloaded(route_class, reconnect_after())
+
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    async def monitor_lag(self, interval: float = 0.5):
+        """
+            How late the event loop wakes up from a sleep, i.e. how long handlers
+            block it. Readings wait behind that just like everything else.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.lag = max(0.0, loop.time() - start - interval)
+            EVENT_LOOP_LAG.set(self.lag)
+
+admission = AdmissionController()
+
+#==========================================
+class AdmissionMiddleware:
+    """
+        ASGI middleware that holds a slot of the request's class until the response
+        is fully sent (streamed exports included) and answers 503 when there is none
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.ADMISSION_ENABLED:
+            return await self.app(scope, receive, send)
+
+        route_class = classify(scope["method"], scope["path"], scope.get("query_string", b""), scope.get("headers", ()))
+        if route_class is None:
+            return await self.app(scope, receive, send)
+
+        try:
+            async with admission.admit(route_class):
+                await self.app(scope, receive, send)
+        except Overloaded as e:
+            logger.warning("%s %s rejected: %s", scope["method"], scope["path"], e, extra=SAMPLED)
+
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", str(e.retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": json.dumps({"detail": str(e)}).encode()})
@@ -0,0 +1,105 @@
+from email.utils import formatdate
+from typing import Hashable, Iterable
+
+import secrets
+import threading
+import time
+
+# Versions only mean something to the process that issued them, ETags carry
+# this so one from another worker or an earlier run never matches
+PROCESS_EPOCH = secrets.token_hex(4)
+
+def etag(version: int) -> str:
+    return f'"{PROCESS_EPOCH}-{version}"'
+
+def etag_matches(if_none_match: str | None, current: str) -> bool:
+    """
+        True when an If-None-Match header lists the current ETag (weak or strong) or is "*"
+    """
+    if not if_none_match:
+        return False
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == current:
+            return True
+
+    return False
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+def validators(version: int, modified: float) -> dict[str, str]:
+    """
+        Response headers describing one version of a resource
+    """
+    return {
+        "ETag": etag(version),
+        "Last-Modified": http_date(modified),
+        "X-Change-Version": str(version),
+    }
+
+class ChangeTracker:
+    """
+        Monotonic change version for a collection, bumped by the crud write paths.
+        Versions never fall behind the wall clock in microseconds, so they keep
+        increasing across restarts. Changes made before this process started are
+        unknown, callers asking for them get a full listing instead.
+        Kept in memory, so the server must run as a single worker: another worker
+        never sees these writes and would answer since_version with a delta that
+        misses them (ETags include PROCESS_EPOCH, they simply never match there).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.base = int(self.started * 1_000_000)
+        self.version = self.base
+        self.modified = self.started
+        # key -> (version, modified, deleted)
+        self._items: dict[Hashable, tuple[int, float, bool]] = {}
+
+    def record(self, key: Hashable | None = None, deleted: bool = False) -> int:
+        with self._lock:
+            self.modified = time.time()
+            self.version = max(self.version + 1, int(self.modified * 1_000_000))
+            if key is not None:
+                self._items[key] = (self.version, self.modified, deleted)
+
+            return self.version
+
+    def record_many(self, keys: Iterable[Hashable]) -> int:
+        with self._lock:
+            self.modified = time.time()
+            self.version = max(self.version + 1, int(self.modified * 1_000_000))
+            for key in keys:
+                self._items[key] = (self.version, self.modified, False)
+
+            return self.version
+
+    def item(self, key: Hashable) -> tuple[int, float]:
+        """
+            (version, modified) of the last change to one item
+        """
+        with self._lock:
+            version, modified, _ = self._items.get(key, (self.base, self.started, False))
+
+        return version, modified
+
+    def changed_since(self, version: int) -> tuple[list, list] | None:
+        """
+            Keys changed and keys deleted after `version`,
+            None when the version is older than what this process knows about
+        """
+        if version < self.base:
+            return None
+
+        changed, deleted = [], []
+        with self._lock:
+            for key, (item_version, _, is_deleted) in self._items.items():
+                if item_version > version:
+                    (deleted if is_deleted else changed).append(key)
+
+        return changed, deleted
+
+device_changes = ChangeTracker()
+event_changes = ChangeTracker()
@@ -1,14 +1,209 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
 
-import json
+import atexit
+import copy
+import itertools
 import logging
+import orjson
+import queue
+import threading
+import time
+
+# Start of the app's own imports, for the startup report
+IMPORT_STARTED = time.perf_counter()
+
+class Settings(BaseSettings):
+    model_config = SettingsConfigDict(
+        env_file="../.env",
+        env_ignore_empty=True,
+        extra="ignore",
+    )
+
+    DATABASE_FILENAME: str = "database.db"
+    DATABASE_URL: str = f"sqlite:///{DATABASE_FILENAME}"
+    # Query endpoints read through a separate engine: this replica when set,
+    # otherwise a read-only connection pool on the SQLite file. A replica should
+    # be synchronous, ETags are computed from writes seen by this process.
+    DATABASE_READ_URL: str | None = None
+    DATABASE_READ_POOL_SIZE: int = 5
+    SQLITE_WAL: bool = True
+    # PostgreSQL (postgresql+psycopg://..., needs psycopg 3) for more than one writer.
+    # Pool of each engine: DATABASE_POOL_SIZE (read engine: DATABASE_READ_POOL_SIZE)
+    # plus up to DATABASE_MAX_OVERFLOW extra connections under bursts.
+    DATABASE_POOL_SIZE: int = 10
+    DATABASE_MAX_OVERFLOW: int = 20
+    DATABASE_POOL_TIMEOUT: float = 30.0
+    DATABASE_POOL_RECYCLE: int = 1800
+    DATABASE_STATEMENT_TIMEOUT_MS: int = 30000
+    DATABASE_APPLICATION_NAME: str = "secury"
+
+    # Extra sites (buildings) served next to the default one, each in its own database.
+    # {site} in the URL is replaced by the site id.
+    SITES: list[str] = []
+    SITE_DATABASE_URL: str = "sqlite:///sites/{site}.db"
+    SITE_READ_DATABASE_URL: str | None = None
+
+    LOG_LEVEL: str = "DEBUG"
+    LOG_FILENAME: str = "secury.log"
+    # Hand records to a background thread instead of writing on the event loop
+    LOG_ASYNC: bool = True
+    LOG_QUEUE_SIZE: int = 10000
+    # Keep 1 out of N records of high-frequency messages
+    LOG_SAMPLE_RATE: int = 100
+    # Records dropped because the queue was full are reported at most this often
+    LOG_DROPPED_REPORT_INTERVAL: float = 60.0
+
+    # Authentication. Without SECRET_KEY a random one is used and user tokens
+    # stop working on restart (device API keys are stored hashed and keep working).
+    AUTH_ENABLED: bool = True
+    SECRET_KEY: str = ""
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24
+    # Verified credentials are cached for this long, revocations from other
+    # processes are picked up every AUTH_REFRESH_INTERVAL seconds
+    AUTH_CACHE_TTL: float = 60.0
+    AUTH_CACHE_SIZE: int = 10000
+    AUTH_REFRESH_INTERVAL: float = 30.0
+    # Logins are refused with 429 after this many failures within LOGIN_FAILURE_WINDOW
+    # seconds, counted per email and (more leniently) per client address
+    LOGIN_MAX_FAILURES: int = 5
+    LOGIN_MAX_FAILURES_PER_IP: int = 20
+    LOGIN_FAILURE_WINDOW: float = 300.0
+    LOGIN_TRACKED_KEYS: int = 100000
+    # Single-use tickets that browsers pass as ?ticket= to open a websocket or
+    # EventSource stream, since they cannot set an Authorization header there
+    STREAM_TICKET_TTL: float = 30.0
+    # First user, created at startup when there are no users
+    ADMIN_EMAIL: str | None = None
+    ADMIN_PASSWORD: str | None = None
+
+    # Opt-in request profiling, see core/profiling.py
+    PROFILING_ENABLED: bool = False
+    PROFILING_SAMPLE_RATE: float = 0.01
+    PROFILING_HEADER: str = "X-Profile"
+    PROFILING_INTERVAL_MS: float = 5
+    PROFILING_SLOW_MS: float = 250
+    PROFILING_MAX_CONCURRENT: int = 2
+    PROFILING_DIR: str = "profiles"
+    PROFILING_MAX_DUMPS: int = 50
+
+    # Seconds between device summary pushes over /ws
+    SUMMARY_PUSH_INTERVAL: float = 1.0
+
+    # Per-minute event rollups are only kept this long, charts fall back to hourly
+    ROLLUP_MINUTE_RETENTION_HOURS: int = 48
+
+    # Seconds between rule timer checks and alarm broadcasts
+    RULES_TICK_INTERVAL: float = 1.0
+
+    # Notification sinks, see core/notifications.py
+    NOTIFY_FILE: str | None = None
+    NOTIFY_WEBHOOK_URL: str | None = None
+    TELEGRAM_BOT_TOKEN: str | None = None
+    TELEGRAM_CHAT_ID: str | None = None
+    NOTIFY_EVENT_TYPES: list[str] = [
+        "device_offline", "battery_low", "rule_alarm", "state_timeout", "location_threshold",
+    ]
+    NOTIFY_WORKERS: int = 1
+    NOTIFY_QUEUE_SIZE: int = 1000
+    NOTIFY_BATCH_SIZE: int = 20
+    NOTIFY_BATCH_WINDOW: float = 2.0
+    NOTIFY_DEDUP_SECONDS: float = 300
+    NOTIFY_RATE_PER_MINUTE: float = 20
+    NOTIFY_RATE_BURST: int = 5
+    NOTIFY_MAX_RETRIES: int = 5
+    NOTIFY_BACKOFF_SECONDS: float = 1.0
+
+    # Rows per transaction for bulk imports and per chunk for streamed exports
+    IMPORT_CHUNK_SIZE: int = 500
+    EXPORT_BATCH_SIZE: int = 1000
+
+    # Server-Sent Events and long-poll subscribers
+    STREAM_QUEUE_SIZE: int = 256
+    STREAM_HEARTBEAT_SECONDS: float = 15.0
+    STREAM_REPLAY_SIZE: int = 1000
+    LONG_POLL_TIMEOUT: float = 25.0
+
+    # Per-device ingestion limits of trigger_device, see core/ingest.py.
+    # Identical readings within the window only refresh last_seen.
+    INGEST_RATE_PER_SECOND: float = 2.0
+    INGEST_BURST: int = 10
+    INGEST_DUPLICATE_WINDOW_SECONDS: float = 30.0
+    INGEST_TRACKED_DEVICES: int = 100000
+    # Reading batches of edge gateways (POST /devices/readings), limits after gunzip
+    INGEST_BATCH_MAX_READINGS: int = 5000
+    INGEST_BATCH_MAX_BYTES: int = 8 * 1024 * 1024
+
+    # Edge gateway (python -m backend.app.gateway): buffers device readings on disk
+    # and forwards them to GATEWAY_SERVER_URL in gzipped batches, with GATEWAY_API_KEY
+    # (POST /api/devices/gateway-keys) when the server has authentication on.
+    # The oldest superseded readings are dropped past GATEWAY_QUEUE_SIZE.
+    GATEWAY_HOST: str = "0.0.0.0"
+    GATEWAY_PORT: int = 8001
+    GATEWAY_SERVER_URL: str = "http://localhost:8000"
+    GATEWAY_SITE: str | None = None
+    GATEWAY_API_KEY: str | None = None
+    GATEWAY_QUEUE_FILE: str = "gateway_queue.db"
+    GATEWAY_QUEUE_SIZE: int = 100000
+    GATEWAY_BATCH_SIZE: int = 500
+    GATEWAY_FLUSH_INTERVAL: float = 2.0
+    GATEWAY_REQUEST_TIMEOUT: float = 10.0
+    GATEWAY_RETRY_MAX_SECONDS: float = 300.0
+    GATEWAY_LOG_FILENAME: str = "gateway.log"
+
+    # Admission control, see core/admission.py. Requests at once per route class
+    # (0 = no limit, alarm readings are never limited). Readings over their limit
+    # wait up to ADMISSION_QUEUE_TIMEOUT in a queue of ADMISSION_QUEUE_SIZE. History,
+    # export and snapshot requests over their limit, or while the event loop lags
+    # ADMISSION_SHED_LAG_SECONDS or ADMISSION_SHED_IN_FLIGHT readings are in flight,
+    # get 503 with Retry-After at once.
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_LIMITS: dict[str, int] = {
+        "alarm_batch": 16, "ingest": 64, "interactive": 32, "history": 4, "export": 2, "snapshot": 8,
+    }
+    ADMISSION_QUEUE_SIZE: int = 64
+    ADMISSION_QUEUE_TIMEOUT: float = 2.0
+    ADMISSION_SHED_LAG_SECONDS: float = 0.25
+    ADMISSION_SHED_IN_FLIGHT: int = 32
+    ADMISSION_LAG_INTERVAL: float = 0.5
+
+    # Shutdown, see core/lifecycle.py. On SIGTERM readiness fails at once and the
+    # listener closes SHUTDOWN_GRACE_SECONDS later. Clients get a random
+    # reconnect-after hint between the two RECONNECT_AFTER bounds.
+    SHUTDOWN_GRACE_SECONDS: float = 0.0
+    SHUTDOWN_TIMEOUT_SECONDS: float = 10.0
+    RECONNECT_AFTER_MIN_SECONDS: int = 1
+    RECONNECT_AFTER_MAX_SECONDS: int = 15
+    TASK_RESTART_BACKOFF_SECONDS: float = 1.0
+
+    # Skip migrations and create_all when the stored schema fingerprint matches the
+    # models, and seed/backfill after the server is ready instead of before
+    FAST_STARTUP: bool = True
+
+    # Battery telemetry, see core/telemetry.py. Drain rates weigh readings
+    # with this half-life, a jump up by BATTERY_REPLACED_JUMP starts a new trend.
+    BATTERY_CHUNK_SIZE: int = 256
+    BATTERY_TREND_HALF_LIFE_DAYS: float = 7.0
+    BATTERY_TREND_MIN_READINGS: int = 3
+    BATTERY_REPLACED_JUMP: int = 20
+
+settings = Settings()
+
+#==========================================
+def _dumps(data: dict) -> str:
+    return orjson.dumps(data, default=str).decode()
 
 class JsonFormatter(logging.Formatter):
     def format(self, record):
+        # Console and file handlers share this formatter, only serialize once
+        cached = getattr(record, "_json", None)
+        if cached is not None:
+            return cached
+
         log_record = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": datetime.fromtimestamp(record.created).isoformat(),
             "level": record.levelname,
             "logger": record.name,
             "module": record.module,
@@ -16,11 +211,93 @@ class JsonFormatter(logging.Formatter):
             "message": record.getMessage(),
         }
 
+        sample_rate = getattr(record, "sample_rate", None)
+        if sample_rate:
+            log_record["sample_rate"] = sample_rate
+
         if record.exc_info:
             log_record["exception"] = self.formatException(record.exc_info)
-        
-        return json.dumps(log_record)
-    
+
+        record._json = _dumps(log_record)
+        return record._json
+
+class SamplingFilter(logging.Filter):
+    """
+        Lets through 1 out of every `rate` records logged with extra=SAMPLED.
+        Counting is done per message template so rare messages are not starved.
+        Records that pass are tagged with the rate they represent.
+    """
+    def __init__(self, rate: int = 100):
+        super().__init__()
+        self.rate = max(1, rate)
+        self._counters: dict[str, itertools.count] = {}
+
+    def filter(self, record):
+        if self.rate == 1 or not getattr(record, "sampled", False):
+            return True
+
+        counter = self._counters.get(record.msg)
+        if counter is None:
+            counter = self._counters.setdefault(record.msg, itertools.count())
+
+        if next(counter) % self.rate:
+            return False
+
+        record.sample_rate = self.rate
+        return True
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+        Only merges the message arguments on the calling thread,
+        JSON serialization and exception formatting happen on the listener thread.
+        Drops the record instead of blocking when the queue is full, the drops are
+        counted and reported by a warning at most every LOG_DROPPED_REPORT_INTERVAL.
+    """
+    def __init__(self, queue, report_interval: float = 60.0):
+        super().__init__(queue)
+        self.report_interval = report_interval
+        self.dropped = 0
+        self._unreported = 0
+        self._reported_at = time.monotonic()
+        self._drop_lock = threading.Lock()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+                self._unreported += 1
+            return
+
+        if self._unreported and time.monotonic() - self._reported_at >= self.report_interval:
+            self._report_dropped(record.name)
+
+    def _report_dropped(self, name: str):
+        with self._drop_lock:
+            count, self._unreported = self._unreported, 0
+            self._reported_at = time.monotonic()
+
+        if count:
+            report = logging.LogRecord(
+                name, logging.WARNING, __file__, 0,
+                "Dropped %d log records, the log queue was full", (count,), None,
+            )
+            try:
+                self.queue.put_nowait(self.prepare(report))
+            except queue.Full:
+                with self._drop_lock:
+                    self._unreported += count
+
+# Mark high-frequency messages for sampling: logger.info("...", extra=SAMPLED)
+SAMPLED = {"sampled": True}
+
 log_config = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -30,6 +307,12 @@ log_config = {
             "()": JsonFormatter
         }
     },
+    "filters": {
+        "sampling": {
+            "()": SamplingFilter,
+            "rate": settings.LOG_SAMPLE_RATE,
+        }
+    },
     # Determine where logs will go
     "handlers": {
         "console": {
@@ -43,31 +326,79 @@ log_config = {
             "class": "logging.handlers.RotatingFileHandler",
             "level": "INFO",
             "formatter": "json",
-            "filename": "secury.log",
+            "filename": settings.LOG_FILENAME,
             "maxBytes": 10485760, # 10MB
             "backupCount": 5,
+            # Opened on the first record, not when the config is applied
+            "delay": True,
         },
     },
     # Control logging behavior (Capture Debug and up)
     "loggers": {
-        "app": {"handlers": ["console", "rotating_file"], "level": "DEBUG", "propagate": False},
+        "app": {
+            "handlers": ["console", "rotating_file"],
+            "filters": ["sampling"],
+            "level": settings.LOG_LEVEL,
+            "propagate": False,
+        },
     },
     "root": {"handlers": ["console"], "level": "DEBUG"}
 }
 
-# Apply entire config
-dictConfig(log_config)
+log_listener: QueueListener | None = None
+_queue_handler: _NonBlockingQueueHandler | None = None
+_configured = threading.Event()
 
-logger = logging.getLogger("app")
+def configure_logging(filename: str | None = None) -> logging.Logger:
+    """
+        Apply the logging config, writing the log file to `filename` (LOG_FILENAME
+        by default). In async mode the handlers of the "app" logger are moved behind
+        a queue and written by a background thread. Called by the server's lifespan
+        and the gateway, only the first call configures anything.
+    """
+    global log_listener, _queue_handler
 
-class Settings(BaseSettings):
-    model_config = SettingsConfigDict(
-        env_file="../.env",
-        env_ignore_empty=True,
-        extra="ignore",
-    )
+    app_logger = logging.getLogger("app")
+    if _configured.is_set():
+        return app_logger
 
-    DATABASE_FILENAME: str = "database.db"
-    DATABASE_URL: str = f"sqlite:///{DATABASE_FILENAME}"
+    config = copy.deepcopy(log_config)
+    if filename:
+        config["handlers"]["rotating_file"]["filename"] = filename
+    dictConfig(config)
+    _configured.set()
 
-settings = Settings()
\ No newline at end of file
+    if settings.LOG_ASYNC:
+        handlers = list(app_logger.handlers)
+        for handler in handlers:
+            app_logger.removeHandler(handler)
+
+        log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+        _queue_handler = _NonBlockingQueueHandler(log_queue, settings.LOG_DROPPED_REPORT_INTERVAL)
+        app_logger.addHandler(_queue_handler)
+
+        log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        log_listener.start()
+        atexit.register(stop_logging)
+
+    return app_logger
+
+def dropped_log_records() -> int:
+    """
+        Records dropped since startup because the log queue was full
+    """
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+def stop_logging() -> None:
+    """
+        Flush queued records and stop the background writer
+    """
+    global log_listener
+
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+# Handlers are only attached by configure_logging(), importing this module
+# (the gateway, scripts, tests) opens no file and starts no thread
+logger = logging.getLogger("app")
@@ -1,14 +1,233 @@
 from typing import Annotated
-from sqlmodel import Session, create_engine, SQLModel
+from sqlmodel import Session, SQLModel, insert
+from sqlalchemy import Column, DateTime, Engine, MetaData, String, Table, Uuid, inspect, select
+from sqlalchemy.exc import DBAPIError
 from fastapi import Depends
+from datetime import datetime
 
-from backend.app.models import Device, Event
+from backend.app.models import DEFAULT_SITE, Device, DeviceRef, DeviceStatus, Event, EventType
 
-from backend.app.core.config import settings
+from backend.app.core.config import logger, settings
+from backend.app.core.search import SEARCH_TABLES, create_search_tables
+from backend.app.core.storage import backend_for, backend_of
 #from backend.app.models import Device?
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(str(settings.DATABASE_URL), connect_args=connect_args)
+import functools
+import hashlib
+import re
+
+def create_primary_engine(url: str) -> Engine:
+    """
+        Engine every write goes through, tuned for its database (see core/storage.py).
+        SQLite files are created in WAL mode so the read engine can query them while ingestion writes.
+    """
+    return backend_for(url).create_primary_engine(url)
+
+def create_read_engine(primary: Engine, url: str | None = None) -> Engine:
+    """
+        Engine for query endpoints, with its own connection pool.
+        Uses the replica at `url` when given, otherwise opens the primary SQLite file
+        read-only (or a read-only pool on the PostgreSQL primary). Databases that
+        cannot be opened twice (in-memory) share the primary.
+    """
+    return backend_of(primary).create_read_engine(primary, url)
+
+engine = create_primary_engine(str(settings.DATABASE_URL))
+read_engine = create_read_engine(engine, settings.DATABASE_READ_URL)
+
+def checkpoint(primary: Engine) -> None:
+    """
+        Close the pool's connections at shutdown, after moving the WAL of a
+        SQLite file into the database so the next instance starts from a complete file
+    """
+    backend_of(primary).checkpoint(primary)
 
 def init_db(session: Session) -> None:
-    SQLModel.metadata.create_all(engine)
\ No newline at end of file
+    """
+        Migrate and create missing tables. With FAST_STARTUP this is skipped when the
+        database was last initialized with the same schema (one query instead of the
+        migration checks and create_all).
+    """
+    bind = session.get_bind()
+    fingerprint = schema_fingerprint()
+
+    if settings.FAST_STARTUP and stored_schema_fingerprint(bind) == fingerprint:
+        logger.debug("Schema of %s is up to date", bind.url)
+        return
+
+    migrate_compact_events(bind)
+    add_missing_columns(bind)
+    SQLModel.metadata.create_all(bind)
+    create_search_tables(bind)
+    store_schema_fingerprint(bind, fingerprint)
+
+#==========================================
+_schema_metadata = MetaData()
+
+schema_version = Table(
+    "schema_version",
+    _schema_metadata,
+    Column("fingerprint", String, primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+@functools.cache
+def schema_fingerprint() -> str:
+    """
+        Hash of the model tables, columns and indexes and of the added columns,
+        changes with any model or migration change
+    """
+    parts = []
+    for table in sorted(SQLModel.metadata.tables.values(), key=lambda table: table.name):
+        parts.append(table.name)
+        parts.extend(
+            f"{column.name}:{type(column.type).__name__}:{column.nullable}:{column.primary_key}"
+            for column in table.columns
+        )
+        parts.extend(sorted(index.name for index in table.indexes))
+
+    parts.extend(f"{table}.{column}" for table, column, _, _ in ADDED_COLUMNS)
+    parts.extend(SEARCH_TABLES.values())
+
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()[:16]
+
+def stored_schema_fingerprint(engine: Engine) -> str | None:
+    try:
+        with engine.connect() as connection:
+            return connection.execute(select(schema_version.c.fingerprint).limit(1)).scalar()
+    except DBAPIError:
+        # Not initialized yet
+        return None
+
+def store_schema_fingerprint(engine: Engine, fingerprint: str) -> None:
+    with engine.begin() as connection:
+        _schema_metadata.create_all(connection)
+        connection.execute(schema_version.delete())
+        connection.execute(schema_version.insert().values(fingerprint=fingerprint, applied_at=datetime.now()))
+
+#==========================================
+# Columns added after their table was first created: (table, column, DDL, index)
+ADDED_COLUMNS = [
+    ("device", "site_id", f"VARCHAR NOT NULL DEFAULT '{DEFAULT_SITE}'", "CREATE INDEX ix_device_site_id ON device (site_id)"),
+    ("device_ref", "site_id", f"VARCHAR NOT NULL DEFAULT '{DEFAULT_SITE}'", None),
+    ("user", "hashed_password", "VARCHAR NOT NULL DEFAULT ''", None),
+    # DDL None: the type of the model's column
+    ("event", "uid", None, None),
+]
+
+def add_missing_columns(engine: Engine) -> None:
+    """
+        Add the columns of ADDED_COLUMNS to tables created before them.
+        Existing devices belong to the default site, existing users have no password,
+        existing events keep the id derived from their seq.
+    """
+    with engine.begin() as connection:
+        tables = inspect(connection).get_table_names()
+
+        for table, column, ddl, index in ADDED_COLUMNS:
+            if table not in tables:
+                continue
+
+            columns = {existing["name"] for existing in inspect(connection).get_columns(table)}
+            if column in columns:
+                continue
+
+            if ddl is None:
+                ddl = SQLModel.metadata.tables[table].c[column].type.compile(dialect=connection.dialect)
+
+            logger.info("Adding %s to %s", column, table)
+            connection.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}')
+
+            if index is not None:
+                connection.exec_driver_sql(index)
+
+#==========================================
+_STATUS_CHANGE_DETAILS = re.compile(r"^status changed to (\w+)(?: \(battery: (\d+)%\))?$")
+_BATTERY_LOW_DETAILS = re.compile(r"^battery low: (\d+)%$")
+
+def _structured_fields(event_type: EventType, details: str) -> dict:
+    """
+        Recover structured fields from the text written by the old event layout
+    """
+    if event_type == EventType.STATUS_CHANGE:
+        match = _STATUS_CHANGE_DETAILS.match(details)
+        if match and match.group(1) in DeviceStatus:
+            battery = match.group(2)
+            return {"new_status": DeviceStatus(match.group(1)), "battery": int(battery) if battery else None}
+
+    if event_type == EventType.BATTERY_LOW:
+        match = _BATTERY_LOW_DETAILS.match(details)
+        if match:
+            return {"battery": int(match.group(1))}
+
+    if event_type == EventType.DEVICE_OFFLINE:
+        # The text names the device, kept as it is
+        return {"new_status": DeviceStatus.OFFLINE, "note": details}
+
+    return {"note": details}
+
+def migrate_compact_events(engine: Engine, batch_size: int = 5000) -> int:
+    """
+        Move events from the old layout (UUID keys, enum names, text details)
+        into the compact event table, keeping their ids. Does nothing once migrated.
+    """
+    with engine.begin() as connection:
+        if "event" not in inspect(connection).get_table_names():
+            return 0
+
+        columns = {column["name"] for column in inspect(connection).get_columns("event")}
+        if "details" not in columns:
+            return 0
+
+        logger.info("Migrating events to the compact layout...")
+
+        for index in inspect(connection).get_indexes("event"):
+            connection.exec_driver_sql(f'DROP INDEX "{index["name"]}"')
+        connection.exec_driver_sql("ALTER TABLE event RENAME TO event_legacy")
+
+        SQLModel.metadata.create_all(connection, tables=[DeviceRef.__table__, Event.__table__])
+
+        legacy = Table(
+            "event_legacy", MetaData(),
+            Column("id", Uuid),
+            Column("device_id", Uuid),
+            Column("type", String),
+            Column("details", String),
+            Column("timestamp", DateTime),
+        )
+
+        keys: dict = {}
+        migrated = 0
+        result = connection.execution_options(yield_per=batch_size).execute(
+            select(legacy.c.id, legacy.c.device_id, legacy.c.type, legacy.c.details, legacy.c.timestamp)
+            .order_by(legacy.c.timestamp)
+        )
+
+        for partition in result.partitions():
+            rows = []
+            for event_id, device_id, type_name, details, timestamp in partition:
+                if device_id not in keys:
+                    keys[device_id] = connection.execute(
+                        insert(DeviceRef).values(device_id=device_id).returning(DeviceRef.key)
+                    ).scalar_one()
+
+                event_type = EventType[type_name]
+                rows.append({
+                    "uid": event_id,
+                    "device_key": keys[device_id],
+                    "type": event_type,
+                    "timestamp": timestamp,
+                    "old_status": None,
+                    "new_status": None,
+                    "battery": None,
+                    "note": None,
+                    **_structured_fields(event_type, details),
+                })
+
+            connection.execute(insert(Event), rows)
+            migrated += len(rows)
+
+        connection.exec_driver_sql("DROP TABLE event_legacy")
+
+    logger.info("Migrated %d events", migrated)
+    return migrated
@@ -0,0 +1,167 @@
+from fastapi.responses import Response
+from enum import Enum
+from typing import Any, AsyncIterator, Iterable, Iterator
+
+import csv
+import io
+import json
+import orjson
+import zlib
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+def format_from_content_type(content_type: str | None) -> ExportFormat:
+    if content_type and "csv" in content_type:
+        return ExportFormat.CSV
+
+    return ExportFormat.NDJSON
+
+#==========================================
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, str]]:
+    """
+        Split a byte stream into (line number, line) without reading it all
+    """
+    pending = b""
+    number = 0
+
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+
+        for line in lines:
+            number += 1
+            yield number, line.decode("utf-8").rstrip("\r")
+
+    if pending:
+        yield number + 1, pending.decode("utf-8").rstrip("\r")
+
+
+async def iter_records(chunks: AsyncIterator[bytes], fmt: ExportFormat) -> AsyncIterator[tuple[int, dict | Exception]]:
+    """
+        Parse NDJSON objects or CSV rows (first line is the header) one line at a time.
+        Lines that cannot be parsed are yielded as the exception instead of a dict.
+    """
+    header: list[str] | None = None
+
+    async for number, line in iter_lines(chunks):
+        if not line.strip():
+            continue
+
+        if fmt == ExportFormat.NDJSON:
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+                yield number, record
+            except ValueError as e:
+                yield number, e
+            continue
+
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [value.strip() for value in values]
+            continue
+
+        if len(values) != len(header):
+            yield number, ValueError(f"expected {len(header)} columns, got {len(values)}")
+            continue
+
+        # Empty cells mean "not given" so model defaults apply
+        yield number, {key: value for key, value in zip(header, values) if value != ""}
+
+class BodyTooLarge(ValueError):
+    pass
+
+async def read_body(chunks: AsyncIterator[bytes], encoding: str | None, limit: int) -> bytes:
+    """
+        Read a request body, gunzipping it when Content-Encoding is gzip.
+        Raises BodyTooLarge past `limit` bytes (after decompression, so a small
+        compressed body cannot expand without bound) and ValueError for other
+        encodings or a broken gzip stream.
+    """
+    encoding = (encoding or "identity").strip().lower()
+    if encoding not in ("identity", "gzip"):
+        raise ValueError(f"Unsupported Content-Encoding {encoding}")
+
+    decompressor = zlib.decompressobj(wbits=31) if encoding == "gzip" else None
+    body = bytearray()
+
+    try:
+        async for chunk in chunks:
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk, limit + 1 - len(body))
+            body += chunk
+
+            if len(body) > limit:
+                raise BodyTooLarge(f"Body is over {limit} bytes")
+
+        if decompressor is not None and not decompressor.eof:
+            raise ValueError("Truncated gzip body")
+    except zlib.error as e:
+        raise ValueError(f"Invalid gzip body: {e}") from None
+
+    return bytes(body)
+
+#==========================================
+def _json_default(value):
+    if isinstance(value, Enum):
+        return value.value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+
+    return str(value)
+
+def dumps(value) -> bytes:
+    return orjson.dumps(value, default=_json_default)
+
+class FastJSONResponse(Response):
+    """
+        JSON response for rows that are already plain dicts.
+        Routes return it directly so FastAPI skips response_model validation,
+        the response_model is still used for the OpenAPI schema.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def _csv_value(value):
+    if isinstance(value, Enum):
+        return value.value
+    if value is None:
+        return ""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+
+    return value
+
+def encode_chunks(batches: Iterable[list[dict]], fieldnames: list[str], fmt: ExportFormat) -> Iterator[bytes]:
+    """
+        Encode batches of rows, one output chunk per batch
+    """
+    if fmt == ExportFormat.CSV:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fieldnames)
+
+        for batch in batches:
+            for row in batch:
+                writer.writerow([_csv_value(row[name]) for name in fieldnames])
+
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+        return
+
+    for batch in batches:
+        yield b"".join(dumps(row) + b"\n" for row in batch)
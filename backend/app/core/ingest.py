@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from enum import Enum
+
+from backend.app.core.config import settings
+from backend.app.core.metrics import INGEST_DROPPED, INGEST_COALESCED
+
+import threading
+import time
+import uuid
+
+class Admission(str, Enum):
+    ACCEPT = "accept"       # write the reading
+    COALESCE = "coalesce"   # same as the last reading, only refresh last_seen
+    DROP = "drop"           # over the device's rate, reject
+
+class _DeviceBudget:
+    __slots__ = ("tokens", "updated", "reading", "written")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated = now
+        # Last reading that was written and when
+        self.reading: tuple | None = None
+        self.written = 0.0
+
+class IngestGuard:
+    """
+        Per-device token bucket and duplicate filter in front of trigger_device.
+        Each device may send `rate` readings per second with bursts of `burst`.
+        A reading identical to the last written one within `window` seconds is
+        coalesced: the caller only refreshes last_seen, no event or broadcast.
+        Coalesced readings use a token too, so a stuck sensor costs at most
+        `rate` cheap UPDATEs per second and is rejected beyond that.
+        State is kept for the `size` most recently seen devices.
+    """
+    def __init__(self, rate: float, burst: int, window: float, size: int):
+        self.rate = rate
+        self.capacity = float(max(burst, 1))
+        self.window = window
+        self.size = size
+        self._lock = threading.Lock()
+        self._devices: OrderedDict[uuid.UUID, _DeviceBudget] = OrderedDict()
+
+    def _budget(self, device_id: uuid.UUID, now: float) -> _DeviceBudget:
+        budget = self._devices.get(device_id)
+
+        if budget is None:
+            budget = self._devices[device_id] = _DeviceBudget(self.capacity, now)
+            while len(self._devices) > self.size:
+                self._devices.popitem(last=False)
+        else:
+            self._devices.move_to_end(device_id)
+
+        return budget
+
+    def admit(self, device_id: uuid.UUID, reading: tuple, now: float | None = None) -> Admission:
+        """
+            What to do with a reading of a device, `reading` is any hashable
+            value that is equal for identical readings (status, battery)
+        """
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            budget = self._budget(device_id, now)
+
+            budget.tokens = min(self.capacity, budget.tokens + (now - budget.updated) * self.rate)
+            budget.updated = now
+
+            if budget.tokens < 1:
+                INGEST_DROPPED.inc()
+                return Admission.DROP
+
+            budget.tokens -= 1
+
+            if budget.reading == reading and now - budget.written < self.window:
+                INGEST_COALESCED.inc()
+                return Admission.COALESCE
+
+            budget.reading = reading
+            budget.written = now
+
+        return Admission.ACCEPT
+
+    def retry_after(self, device_id: uuid.UUID) -> float:
+        """
+            Seconds until the device has a token again
+        """
+        budget = self._devices.get(device_id)
+        if budget is None or self.rate <= 0:
+            return 1.0
+
+        return max(0.0, (1 - budget.tokens) / self.rate)
+
+    def forget(self, device_id: uuid.UUID):
+        with self._lock:
+            self._devices.pop(device_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+
+ingest_guard = IngestGuard(
+    settings.INGEST_RATE_PER_SECOND,
+    settings.INGEST_BURST,
+    settings.INGEST_DUPLICATE_WINDOW_SECONDS,
+    settings.INGEST_TRACKED_DEVICES,
+)
@@ -0,0 +1,234 @@
+from contextlib import contextmanager
+from enum import Enum
+from typing import Awaitable, Callable
+
+from backend.app.core.config import logger, settings, IMPORT_STARTED
+from backend.app.core.metrics import BACKGROUND_TASK_RESTARTS, STARTUP_SECONDS
+
+import asyncio
+import random
+import signal
+import threading
+import time
+
+class LifecycleState(str, Enum):
+    STARTING = "starting"
+    READY = "ready"
+    DRAINING = "draining"
+    STOPPED = "stopped"
+
+def reconnect_after() -> int:
+    """
+        Seconds a disconnected client should wait before reconnecting,
+        spread out so the clients of an instance do not all hit the next one at once
+    """
+    return random.randint(settings.RECONNECT_AFTER_MIN_SECONDS, max(settings.RECONNECT_AFTER_MIN_SECONDS, settings.RECONNECT_AFTER_MAX_SECONDS))
+
+class StartupReport:
+    """
+        Wall time of each startup phase, logged when the server is ready and
+        exported as secury_startup_phase_seconds. The first report also
+        covers the imports since core/config.py was loaded.
+    """
+    _imports_reported = False
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.total: float | None = None
+
+        if not StartupReport._imports_reported:
+            StartupReport._imports_reported = True
+            self.record("imports", self.started - IMPORT_STARTED)
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        STARTUP_SECONDS.labels(name).set(self.phases[name])
+
+    @contextmanager
+    def measure(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def finish(self) -> float:
+        self.total = time.perf_counter() - self.started + self.phases.get("imports", 0.0)
+        STARTUP_SECONDS.labels("total").set(self.total)
+
+        logger.info(
+            "Started in %.0fms (%s)",
+            self.total * 1000,
+            ", ".join(f"{name}: {seconds * 1000:.0f}ms" for name, seconds in self.phases.items()),
+        )
+        return self.total
+
+    def as_dict(self) -> dict:
+        return {
+            "total_ms": round(self.total * 1000, 1) if self.total is not None else None,
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+        }
+
+class TaskSupervisor:
+    """
+        Owns the background loops started by the lifespan and the server's lifecycle state.
+        Loops that crash are restarted with a backoff. drain() (on SIGTERM or at shutdown)
+        fails readiness and runs the drain hooks (closing sockets), shutdown() then cancels
+        the loops. Loops only do database work between awaits, so cancelling them never
+        interrupts a write.
+    """
+    def __init__(self):
+        self.state = LifecycleState.STARTING
+        self.startup: StartupReport | None = None
+        self.tasks: dict[str, asyncio.Task] = {}
+        self._drain_hooks: list[Callable[[], Awaitable[None]]] = []
+        self._drain_task: asyncio.Task | None = None
+        self._previous_handlers: dict[int, object] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.state == LifecycleState.READY
+
+    @property
+    def draining(self) -> bool:
+        return self.state in (LifecycleState.DRAINING, LifecycleState.STOPPED)
+
+    def begin(self):
+        """
+            Reset for a new lifespan (tests start the app many times in one process)
+        """
+        self.state = LifecycleState.STARTING
+        self.startup = StartupReport()
+        self.tasks.clear()
+        self._drain_hooks.clear()
+        self._drain_task = None
+
+    def mark_ready(self):
+        if self.state == LifecycleState.STARTING:
+            self.state = LifecycleState.READY
+            if self.startup is not None:
+                self.startup.finish()
+
+    def on_drain(self, hook: Callable[[], Awaitable[None]]):
+        self._drain_hooks.append(hook)
+
+    #==========================================
+    def start(self, name: str, factory: Callable[[], Awaitable[None]], restart: bool = True) -> asyncio.Task:
+        """
+            Run factory() as a tracked task, restarting it when it raises
+        """
+        task = asyncio.create_task(self._supervise(name, factory, restart), name=name)
+        self.tasks[name] = task
+        return task
+
+    async def _supervise(self, name: str, factory: Callable[[], Awaitable[None]], restart: bool):
+        delay = settings.TASK_RESTART_BACKOFF_SECONDS
+
+        while True:
+            try:
+                await factory()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if not restart or self.draining:
+                    logger.exception("Background task %s crashed", name)
+                    return
+
+                logger.exception("Background task %s crashed, restarting in %.1fs", name, delay)
+                BACKGROUND_TASK_RESTARTS.labels(name).inc()
+
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+
+    def task_states(self) -> dict[str, str]:
+        return {
+            name: "running" if not task.done() else "cancelled" if task.cancelled() else "stopped"
+            for name, task in self.tasks.items()
+        }
+
+    #==========================================
+    def drain(self) -> bool:
+        """
+            Stop taking new work: readiness fails, new connections are refused
+            and the drain hooks run. False if already draining.
+        """
+        if self.draining:
+            return False
+
+        self.state = LifecycleState.DRAINING
+        logger.info("Draining, %d drain hooks", len(self._drain_hooks))
+        self._drain_task = asyncio.get_running_loop().create_task(self._run_drain_hooks())
+
+        return True
+
+    async def _run_drain_hooks(self):
+        for hook in self._drain_hooks:
+            try:
+                await hook()
+            except Exception:
+                logger.exception("Drain hook failed")
+
+    async def shutdown(self, timeout: float | None = None):
+        """
+            Drain if not already draining, then cancel the loops and wait for them
+        """
+        timeout = settings.SHUTDOWN_TIMEOUT_SECONDS if timeout is None else timeout
+
+        self.drain()
+        if self._drain_task is not None:
+            await asyncio.wait([self._drain_task], timeout=timeout)
+
+        tasks = [task for task in self.tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                logger.warning("Background task %s did not stop within %.1fs", task.get_name(), timeout)
+
+        self.restore_signal_handlers()
+        self.state = LifecycleState.STOPPED
+        logger.info("Background tasks stopped")
+
+    #==========================================
+    def install_signal_handlers(self, grace: float | None = None):
+        """
+            Start draining as soon as SIGTERM/SIGINT arrives and pass the signal on
+            to the server `grace` seconds later, so load balancers see readiness
+            fail before the listener closes. A second signal is passed on at once.
+            Only possible from the main thread (not under the test client).
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        grace = settings.SHUTDOWN_GRACE_SECONDS if grace is None else grace
+        loop = asyncio.get_running_loop()
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(signum)
+            if not callable(previous):
+                continue
+
+            def handler(signum, frame, previous=previous):
+                if self.draining:
+                    previous(signum, frame)
+                    return
+
+                loop.call_soon_threadsafe(self.drain)
+                loop.call_soon_threadsafe(loop.call_later, grace, previous, signum, frame)
+
+            self._previous_handlers[signum] = previous
+            signal.signal(signum, handler)
+
+    def restore_signal_handlers(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        for signum, previous in self._previous_handlers.items():
+            signal.signal(signum, previous)
+        self._previous_handlers.clear()
+
+supervisor = TaskSupervisor()
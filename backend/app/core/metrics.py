@@ -0,0 +1,440 @@
+from abc import ABC, abstractmethod
+from fastapi import Request
+from fastapi.routing import APIRoute
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterable
+
+from backend.app.core.config import dropped_log_records
+from backend.app.core.profiling import phase
+
+import bisect
+import threading
+import time
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+def _format_labels(labelnames: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+#==========================================
+class Metric(ABC):
+    """
+        Base class of every metric.
+        Children (one per label combination) are created once and cached,
+        so the hot path is a dict lookup plus a locked add.
+    """
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: dict[tuple[str, ...], object] = {}
+
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+        REGISTRY.register(self)
+
+    @abstractmethod
+    def _new_child(self):
+        """
+            Value holder of one label combination
+        """
+
+    def labels(self, *values: str):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+
+        return child
+
+    def _unlabelled(self):
+        return self._children[()]
+
+    def collect(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+
+        for values, child in list(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+
+        return lines
+
+
+class _ValueChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+        self._function: Callable[[], float] | None = None
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def get(self) -> float:
+        if self._function is not None:
+            return self._function()
+
+        return self._value
+
+    def render(self, name, labelnames, values) -> list[str]:
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.get())}"]
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount: float = 1):
+        self._unlabelled().inc(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """
+            Read a total kept elsewhere when /metrics is scraped
+        """
+        self._unlabelled().set_function(function)
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount: float = 1):
+        self._unlabelled().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._unlabelled().dec(amount)
+
+    def set(self, value: float):
+        self._unlabelled().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        """
+            Compute the value only when /metrics is scraped
+        """
+        self._unlabelled().set_function(function)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple[float, ...]):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self, name, labelnames, values) -> list[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._buckets + (float("inf"),), counts):
+            cumulative += count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}")
+
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+
+        return lines
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabelled().observe(value)
+
+    def time(self):
+        return self._unlabelled().time()
+
+#==========================================
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """
+            Prometheus text exposition format (version 0.0.4)
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.collect())
+
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+#==========================================
+# Metrics exposed by the application
+REQUEST_LATENCY = Histogram(
+    "secury_http_request_duration_seconds",
+    "HTTP request latency per route",
+    ["method", "route", "status"],
+)
+
+DB_QUERY_SECONDS = Histogram(
+    "secury_db_query_duration_seconds",
+    "Duration of crud operations including their commit",
+    ["operation"],
+)
+
+DB_COMMIT_SECONDS = Histogram(
+    "secury_db_commit_duration_seconds",
+    "Duration of session commits issued by crud operations",
+    ["operation"],
+)
+
+BROADCAST_SECONDS = Histogram(
+    "secury_websocket_broadcast_duration_seconds",
+    "Time spent encoding a message and fanning it out to every subscriber",
+)
+
+BROADCAST_FAILURES = Counter(
+    "secury_websocket_broadcast_failures_total",
+    "Websocket sends that failed during a broadcast",
+)
+
+WEBSOCKET_CLIENTS = Gauge(
+    "secury_websocket_clients",
+    "Currently connected websocket clients",
+)
+
+STREAM_CLIENTS = Gauge(
+    "secury_stream_clients",
+    "Currently connected Server-Sent Events clients",
+)
+
+STREAM_DROPPED = Counter(
+    "secury_stream_messages_dropped_total",
+    "Messages dropped for Server-Sent Events clients that fell behind",
+)
+
+INGEST_DROPPED = Counter(
+    "secury_ingest_readings_dropped_total",
+    "Device readings rejected by the per-device rate limit",
+)
+
+INGEST_COALESCED = Counter(
+    "secury_ingest_readings_coalesced_total",
+    "Repeated device readings that only refreshed last_seen",
+)
+
+INGEST_BATCH_READINGS = Counter(
+    "secury_ingest_batch_readings_total",
+    "Readings received in gateway batches per outcome",
+    ["outcome"],
+)
+
+GATEWAY_QUEUED = Gauge(
+    "secury_gateway_queued_readings",
+    "Readings buffered by the edge gateway, not yet forwarded",
+)
+
+GATEWAY_FORWARDED = Counter(
+    "secury_gateway_forwarded_readings_total",
+    "Readings forwarded by the edge gateway",
+)
+
+GATEWAY_DROPPED = Counter(
+    "secury_gateway_dropped_readings_total",
+    "Readings the edge gateway dropped",
+    ["reason"],
+)
+
+GATEWAY_FORWARD_FAILURES = Counter(
+    "secury_gateway_forward_failures_total",
+    "Failed attempts to forward a batch of readings",
+)
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "secury_admission_in_flight_requests",
+    "Requests holding an admission slot per route class",
+    ["route_class"],
+)
+
+ADMISSION_REJECTED = Counter(
+    "secury_admission_rejected_total",
+    "Requests answered 503 by admission control per route class and reason",
+    ["route_class", "reason"],
+)
+
+EVENT_LOOP_LAG = Gauge(
+    "secury_event_loop_lag_seconds",
+    "How late the event loop last woke up from a sleep",
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    "secury_log_records_dropped_total",
+    "Log records dropped because the log queue was full",
+)
+LOG_RECORDS_DROPPED.set_function(dropped_log_records)
+
+BACKGROUND_TASK_RESTARTS = Counter(
+    "secury_background_task_restarts_total",
+    "Background loops restarted after crashing",
+    ["task"],
+)
+
+STARTUP_SECONDS = Gauge(
+    "secury_startup_phase_seconds",
+    "Duration of each phase of the last startup",
+    ["phase"],
+)
+
+HEALTHCHECK_SECONDS = Histogram(
+    "secury_healthcheck_cycle_duration_seconds",
+    "Duration of each monitor_device_health cycle",
+)
+
+HEALTHCHECK_OFFLINE = Counter(
+    "secury_healthcheck_devices_marked_offline_total",
+    "Devices marked offline by monitor_device_health",
+)
+
+EVENTS_WRITTEN = Counter(
+    "secury_events_written_total",
+    "Events written per event type",
+    ["type"],
+)
+
+NOTIFICATIONS_SENT = Counter(
+    "secury_notifications_sent_total",
+    "Notifications delivered per sink",
+    ["sink"],
+)
+
+NOTIFICATIONS_DROPPED = Counter(
+    "secury_notifications_dropped_total",
+    "Notifications not delivered",
+    ["reason"],
+)
+
+NOTIFICATIONS_RETRIED = Counter(
+    "secury_notifications_retried_total",
+    "Failed notification batches that were retried",
+    ["sink"],
+)
+
+#==========================================
+def timed(histogram: Histogram, phase_name: str | None = None):
+    """
+        Decorator that observes the duration of a function,
+        labelled with the function name.
+        Also attributed to `phase_name` when the request is being profiled.
+    """
+    def decorator(function):
+        child = histogram.labels(function.__name__)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                if phase_name is None:
+                    return function(*args, **kwargs)
+
+                with phase(phase_name):
+                    return function(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class TimedRoute(APIRoute):
+    """
+        Route class that records the latency of every request
+        labelled with the route template (not the raw path)
+    """
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        route = self.path
+
+        async def timed_handler(request: Request):
+            start = time.perf_counter()
+            status = "500"
+            try:
+                response = await handler(request)
+                status = str(response.status_code)
+                return response
+            except Exception as e:
+                status = str(getattr(e, "status_code", 500))
+                raise
+            finally:
+                REQUEST_LATENCY.labels(request.method, route, status).observe(time.perf_counter() - start)
+
+        return timed_handler
@@ -0,0 +1,288 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from backend.app.core.config import logger, settings
+from backend.app.core.metrics import NOTIFICATIONS_SENT, NOTIFICATIONS_DROPPED, NOTIFICATIONS_RETRIED
+from backend.app.models import Event, EventType
+
+import asyncio
+import json
+import random
+import threading
+import time
+import urllib.request
+import uuid
+
+@dataclass
+class Notification:
+    event_type: str
+    device_id: str
+    message: str
+    timestamp: str = field(default_factory=lambda: datetime.now().isoformat())
+
+    def to_dict(self) -> dict:
+        return {
+            "event_type": self.event_type,
+            "device_id": self.device_id,
+            "message": self.message,
+            "timestamp": self.timestamp,
+        }
+
+#==========================================
+class NotificationSink(ABC):
+    """
+        Destination for notifications. send() receives a whole batch
+        and raises to have the batch retried.
+    """
+    name: str = "sink"
+
+    @abstractmethod
+    async def send(self, batch: list[Notification]) -> None:
+        ...
+
+
+class FileSink(NotificationSink):
+    """
+        Appends notifications as NDJSON lines, a stand-in for real destinations in tests
+    """
+    def __init__(self, path: str):
+        self.name = f"file:{path}"
+        self.path = path
+
+    async def send(self, batch: list[Notification]) -> None:
+        lines = "".join(json.dumps(notification.to_dict()) + "\n" for notification in batch)
+        await asyncio.to_thread(self._write, lines)
+
+    def _write(self, lines: str):
+        with open(self.path, "a") as file:
+            file.write(lines)
+
+
+class WebhookSink(NotificationSink):
+    """
+        POSTs each batch as {"notifications": [...]} to a URL
+    """
+    def __init__(self, url: str, timeout: float = 10):
+        self.name = f"webhook:{url}"
+        self.url = url
+        self.timeout = timeout
+
+    def payload(self, batch: list[Notification]) -> dict:
+        return {"notifications": [notification.to_dict() for notification in batch]}
+
+    async def send(self, batch: list[Notification]) -> None:
+        await asyncio.to_thread(self._post, json.dumps(self.payload(batch)).encode())
+
+    def _post(self, body: bytes):
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status >= 300:
+                raise RuntimeError(f"{self.url} answered {response.status}")
+
+
+class TelegramSink(WebhookSink):
+    """
+        Sends a batch as one Telegram message
+    """
+    def __init__(self, bot_token: str, chat_id: str):
+        super().__init__(f"https://api.telegram.org/bot{bot_token}/sendMessage")
+        self.name = f"telegram:{chat_id}"
+        self.chat_id = chat_id
+
+    def payload(self, batch: list[Notification]) -> dict:
+        return {
+            "chat_id": self.chat_id,
+            "text": "\n".join(f"[{n.event_type}] {n.message}" for n in batch),
+        }
+
+#==========================================
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """
+            Take a token, returns how long to wait before using it
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class _Destination:
+    def __init__(self, sink: NotificationSink, queue_size: int, rate_per_minute: float, burst: int):
+        self.sink = sink
+        self.queue: asyncio.Queue[Notification] = asyncio.Queue(maxsize=queue_size)
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self.workers: list[asyncio.Task] = []
+
+
+class NotificationDispatcher:
+    """
+        Fans notifications out to every sink from background workers.
+        notify() only enqueues, so callers on the ingestion path never wait on a sink.
+        Each destination batches, rate limits and retries on its own.
+    """
+    def __init__(self):
+        self._sinks: list[NotificationSink] = []
+        self._destinations: list[_Destination] = []
+        self._recent: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: int | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    def register(self, sink: NotificationSink):
+        self._sinks.append(sink)
+
+    def configure_from_settings(self):
+        self._sinks.clear()
+
+        if settings.NOTIFY_FILE:
+            self.register(FileSink(settings.NOTIFY_FILE))
+        if settings.NOTIFY_WEBHOOK_URL:
+            self.register(WebhookSink(settings.NOTIFY_WEBHOOK_URL))
+        if settings.TELEGRAM_BOT_TOKEN and settings.TELEGRAM_CHAT_ID:
+            self.register(TelegramSink(settings.TELEGRAM_BOT_TOKEN, settings.TELEGRAM_CHAT_ID))
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._destinations = []
+
+        for sink in self._sinks:
+            destination = _Destination(
+                sink, settings.NOTIFY_QUEUE_SIZE,
+                settings.NOTIFY_RATE_PER_MINUTE, settings.NOTIFY_RATE_BURST,
+            )
+            destination.workers = [
+                asyncio.create_task(self._worker(destination)) for _ in range(settings.NOTIFY_WORKERS)
+            ]
+            self._destinations.append(destination)
+
+    async def stop(self, timeout: float = 5.0):
+        """
+            Give queued notifications `timeout` seconds to go out, then stop the workers
+        """
+        if not self.running:
+            return
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(destination.queue.join() for destination in self._destinations)),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Notification queues not drained before shutdown")
+
+        for destination in self._destinations:
+            for worker in destination.workers:
+                worker.cancel()
+            await asyncio.gather(*destination.workers, return_exceptions=True)
+
+        self._destinations = []
+        self._loop = None
+
+    #==========================================
+    def notify(self, notification: Notification) -> bool:
+        """
+            Queue a notification for every sink. Never blocks,
+            returns False if it was a duplicate or could not be queued.
+        """
+        if not self.running or not self._destinations:
+            return False
+
+        key = (notification.event_type, notification.device_id, notification.message)
+        now = time.monotonic()
+
+        with self._lock:
+            last = self._recent.get(key)
+            if last is not None and now - last < settings.NOTIFY_DEDUP_SECONDS:
+                NOTIFICATIONS_DROPPED.labels("duplicate").inc()
+                return False
+
+            self._recent[key] = now
+            if len(self._recent) > 10000:
+                self._recent = {k: t for k, t in self._recent.items() if now - t < settings.NOTIFY_DEDUP_SECONDS}
+
+        if threading.get_ident() == self._loop_thread:
+            self._enqueue(notification)
+        else:
+            self._loop.call_soon_threadsafe(self._enqueue, notification)
+
+        return True
+
+    def notify_event(self, event: Event, device_id: uuid.UUID | None = None) -> bool:
+        """
+            device_id: for events written without loading their device_ref (bulk inserts)
+        """
+        event_type = EventType(event.type).value
+        if event_type not in settings.NOTIFY_EVENT_TYPES:
+            return False
+
+        return self.notify(Notification(
+            event_type=event_type,
+            device_id=str(device_id or event.device_id),
+            message=event.details,
+            timestamp=event.timestamp.isoformat(),
+        ))
+
+    def _enqueue(self, notification: Notification):
+        for destination in self._destinations:
+            try:
+                destination.queue.put_nowait(notification)
+            except asyncio.QueueFull:
+                NOTIFICATIONS_DROPPED.labels("queue_full").inc()
+
+    async def _worker(self, destination: _Destination):
+        while True:
+            batch = [await destination.queue.get()]
+
+            # Collect whatever else arrives within the batch window
+            deadline = time.monotonic() + settings.NOTIFY_BATCH_WINDOW
+            while len(batch) < settings.NOTIFY_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(destination.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await asyncio.sleep(destination.bucket.delay())
+                await self._send(destination.sink, batch)
+            finally:
+                for _ in batch:
+                    destination.queue.task_done()
+
+    async def _send(self, sink: NotificationSink, batch: list[Notification]):
+        for attempt in range(settings.NOTIFY_MAX_RETRIES + 1):
+            try:
+                await sink.send(batch)
+                NOTIFICATIONS_SENT.labels(sink.name).inc(len(batch))
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == settings.NOTIFY_MAX_RETRIES:
+                    logger.error("Giving up on %d notifications for %s: %s", len(batch), sink.name, e)
+                    NOTIFICATIONS_DROPPED.labels("failed").inc(len(batch))
+                    return
+
+                backoff = settings.NOTIFY_BACKOFF_SECONDS * 2 ** attempt
+                logger.warning("Sending to %s failed (%s), retrying in %.1fs", sink.name, e, backoff)
+                NOTIFICATIONS_RETRIED.labels(sink.name).inc()
+                await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+
+notifier = NotificationDispatcher()
@@ -0,0 +1,241 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from backend.app.core.config import logger, settings
+
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+
+_current_profile: ContextVar["RequestProfile | None"] = ContextVar("current_profile", default=None)
+_NO_PHASE = nullcontext()
+
+#==========================================
+class StackSampler(threading.Thread):
+    """
+        Samples the stack of one thread at a fixed interval.
+        Much cheaper than a tracing profiler because the profiled code is never instrumented,
+        the output is folded stacks that flamegraph.pl / speedscope read directly.
+
+        The event loop thread runs every request, so with `root` (the frame of the
+        profiled task's coroutine) only samples taken while that task is running are
+        kept, starting at `root`. Work the request hands to other tasks or threads
+        is not sampled.
+    """
+    def __init__(self, thread_id: int, interval: float, root=None):
+        super().__init__(daemon=True, name="secury-profiler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root = root
+        self.stacks: Counter[str] = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                if frame is self.root:
+                    break
+                frame = frame.f_back
+            else:
+                if self.root is not None:
+                    # Another coroutine is running on the loop
+                    continue
+
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        """
+            Stop sampling without waiting for the thread, join() to wait
+        """
+        self._stop_event.set()
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.items())
+
+
+class RequestProfile:
+    """
+        Time breakdown of a single profiled request
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.phases: dict[str, float] = {}
+        self._active: set[str] = set()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.sampler: StackSampler | None = None
+
+    @contextmanager
+    def phase(self, name: str):
+        # Nested phases of the same kind (crud calling crud) are only counted once
+        if name in self._active:
+            yield
+            return
+
+        self._active.add(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._active.discard(name)
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def summary(self) -> dict:
+        accounted = sum(self.phases.values())
+
+        return {
+            "name": self.name,
+            "duration_ms": round(self.duration * 1000, 3),
+            "phases_ms": {
+                **{name: round(seconds * 1000, 3) for name, seconds in self.phases.items()},
+                "other": round(max(self.duration - accounted, 0.0) * 1000, 3),
+            },
+            "samples": sum(self.sampler.stacks.values()) if self.sampler else 0,
+        }
+
+#==========================================
+def phase(name: str):
+    """
+        Attribute the enclosed block to a phase ("db", "serialization", "broadcast")
+        of the current profiled request. Free when nothing is being profiled.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return _NO_PHASE
+
+    return profile.phase(name)
+
+
+def _task_frame():
+    """
+        Frame of the running asyncio task's coroutine, None outside of a task
+    """
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        return None
+
+    return getattr(task.get_coro(), "cr_frame", None) if task is not None else None
+
+
+class Profiler:
+    def __init__(self):
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.PROFILING_ENABLED
+
+    def should_profile(self, headers: dict[str, str]) -> bool:
+        if not self.enabled:
+            return False
+
+        if headers.get(settings.PROFILING_HEADER.lower()):
+            return True
+
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+    @contextmanager
+    def profile(self, name: str, headers: dict[str, str] | None = None):
+        """
+            Profile the enclosed block if it is sampled or explicitly requested
+        """
+        if not self.should_profile(headers or {}):
+            yield None
+            return
+
+        with self._lock:
+            if self._active >= settings.PROFILING_MAX_CONCURRENT:
+                profile = None
+            else:
+                self._active += 1
+                profile = RequestProfile(name)
+
+        if profile is None:
+            yield None
+            return
+
+        profile.sampler = StackSampler(threading.get_ident(), settings.PROFILING_INTERVAL_MS / 1000, _task_frame())
+        profile.sampler.start()
+        token = _current_profile.set(profile)
+
+        try:
+            yield profile
+        finally:
+            _current_profile.reset(token)
+            profile.duration = time.perf_counter() - profile.started
+
+            with self._lock:
+                self._active -= 1
+
+            self._finish(profile)
+
+    def _finish(self, profile: RequestProfile):
+        profile.sampler.stop()
+
+        if profile.duration * 1000 < settings.PROFILING_SLOW_MS:
+            logger.debug("Profiled %s: %s", profile.name, profile.phases)
+            return
+
+        # Joining the sampler and writing files stays off the event loop
+        threading.Thread(target=self._dump, args=(profile,), daemon=True).start()
+
+    def _dump(self, profile: RequestProfile):
+        try:
+            profile.sampler.join()
+
+            directory = Path(settings.PROFILING_DIR)
+            directory.mkdir(parents=True, exist_ok=True)
+
+            safe_name = "".join(c if c.isalnum() else "_" for c in profile.name).strip("_")
+            stem = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{safe_name}"
+            summary = profile.summary()
+
+            (directory / f"{stem}.folded").write_text(profile.sampler.folded())
+            (directory / f"{stem}.json").write_text(json.dumps(summary, indent=2))
+
+            logger.warning("Slow request %s took %.1fms: %s", profile.name, summary["duration_ms"], summary["phases_ms"])
+
+            self._prune(directory)
+        except Exception:
+            logger.exception("Failed to write profile for %s", profile.name)
+
+    def _prune(self, directory: Path):
+        dumps = sorted(directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+
+        for old in dumps[:max(len(dumps) - settings.PROFILING_MAX_DUMPS, 0)]:
+            old.unlink(missing_ok=True)
+            old.with_suffix(".folded").unlink(missing_ok=True)
+
+profiler = Profiler()
+
+#==========================================
+class ProfilingMiddleware:
+    """
+        ASGI middleware that runs sampled or tagged HTTP requests under the profiler
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+
+        with profiler.profile(f"{scope['method']} {scope['path']}", headers):
+            await self.app(scope, receive, send)
@@ -0,0 +1,262 @@
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Iterator
+
+from backend.app.models import (
+    AlarmRule, Device, DeviceStatus,
+    EventCreate, EventType, RuleKind
+)
+
+import heapq
+import threading
+import uuid
+
+RULE_EVENT_TYPES = {
+    RuleKind.STATE: EventType.RULE_ALARM,
+    RuleKind.DURATION: EventType.STATE_TIMEOUT,
+    RuleKind.COUNT: EventType.LOCATION_THRESHOLD,
+}
+
+ALL_LOCATIONS = "*"
+
+class CompiledRule:
+    """
+        Rule reduced to an index key plus a predicate over the fields the key does not cover
+    """
+    __slots__ = ("id", "name", "kind", "status", "armed_only", "duration", "threshold", "window", "key", "predicate")
+
+    def __init__(self, rule: AlarmRule):
+        self.id = rule.id
+        self.name = rule.name
+        self.kind = RuleKind(rule.kind)
+        self.status = DeviceStatus(rule.status).value
+        self.armed_only = rule.armed_only
+
+        if self.kind == RuleKind.DURATION and not rule.duration_seconds:
+            raise ValueError("duration rules need duration_seconds")
+        if self.kind == RuleKind.COUNT and not (rule.threshold and rule.window_seconds):
+            raise ValueError("count rules need threshold and window_seconds")
+
+        self.duration = timedelta(seconds=rule.duration_seconds or 0)
+        self.threshold = rule.threshold or 0
+        self.window = timedelta(seconds=rule.window_seconds or 0)
+
+        # Index on the most selective field, check the others in the predicate
+        checks: list[Callable[[Device], bool]] = []
+        if rule.device_id is not None:
+            self.key = ("device", str(rule.device_id), self.status)
+        elif rule.location is not None:
+            self.key = ("location", rule.location, self.status)
+        elif rule.device_type is not None:
+            self.key = ("type", rule.device_type, self.status)
+        else:
+            self.key = ("any", None, self.status)
+
+        if rule.location is not None and self.key[0] != "location":
+            location = rule.location
+            checks.append(lambda device: device.location == location)
+        if rule.device_type is not None and self.key[0] != "type":
+            device_type = rule.device_type
+            checks.append(lambda device: device.type == device_type)
+
+        self.predicate = (lambda device: all(check(device) for check in checks)) if checks else None
+
+    def matches(self, device: Device) -> bool:
+        return self.predicate is None or self.predicate(device)
+
+
+class RuleEngine:
+    """
+        Evaluates alarm rules against device state changes.
+        Rules are indexed by (device | location | type | any, status) so a reading
+        only looks at the rules that can match it, whatever the total number of rules.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules: dict[uuid.UUID, CompiledRule] = {}
+        self._index: dict[tuple, list[CompiledRule]] = {}
+        # device id -> (status, transition number), used to invalidate duration timers
+        self._states: dict[uuid.UUID, tuple[str, int]] = {}
+        self._timers: list[tuple[datetime, int, uuid.UUID, uuid.UUID, int]] = []
+        self._timer_seq = 0
+        self._windows: dict[tuple[uuid.UUID, str], deque] = {}
+        # device id -> (name, location) for timers that fire after the session is gone
+        self._devices: dict[uuid.UUID, tuple[str, str]] = {}
+        self.armed: set[str] = set()
+        # Written rule events (json) waiting to be broadcast
+        self.outbox: deque[dict] = deque(maxlen=1000)
+
+    #==========================================
+    def load(self, rules: Iterable[AlarmRule], armed: Iterable[str] = ()):
+        """
+            Replace the rules and armed locations with the stored ones. Pending
+            duration timers are kept, those of rules that are gone never fire.
+        """
+        with self._lock:
+            self._rules.clear()
+            self._index.clear()
+            self._windows.clear()
+            self.armed = set(armed)
+
+            for rule in rules:
+                if rule.enabled:
+                    self._add(CompiledRule(rule))
+
+    def resume(self, devices: Iterable[Device]):
+        """
+            Restart the duration timers of devices already in a rule's status
+            (after a restart), counted from the device's last update
+        """
+        with self._lock:
+            for device in devices:
+                status = DeviceStatus(device.status).value
+                transition = self._states.get(device.id, (None, 0))[1] + 1
+                self._states[device.id] = (status, transition)
+
+                for rule in self._matching(device, status):
+                    if rule.kind == RuleKind.DURATION:
+                        self._start_timer(rule, device, transition, device.last_updated)
+
+    def add(self, rule: AlarmRule):
+        compiled = CompiledRule(rule)
+
+        with self._lock:
+            self._remove(rule.id)
+            if rule.enabled:
+                self._add(compiled)
+
+    def remove(self, rule_id: uuid.UUID):
+        with self._lock:
+            self._remove(rule_id)
+
+    def _add(self, rule: CompiledRule):
+        self._rules[rule.id] = rule
+        self._index.setdefault(rule.key, []).append(rule)
+
+    def _remove(self, rule_id: uuid.UUID):
+        rule = self._rules.pop(rule_id, None)
+        if rule is None:
+            return
+
+        bucket = self._index.get(rule.key, [])
+        bucket[:] = [r for r in bucket if r.id != rule_id]
+        if not bucket:
+            self._index.pop(rule.key, None)
+
+        for key in [key for key in self._windows if key[0] == rule_id]:
+            del self._windows[key]
+
+    def arm(self, location: str | None = None):
+        self.armed.add(location or ALL_LOCATIONS)
+
+    def disarm(self, location: str | None = None):
+        if location is None:
+            self.armed.clear()
+        else:
+            self.armed.discard(location)
+
+    def is_armed(self, location: str) -> bool:
+        return ALL_LOCATIONS in self.armed or location in self.armed
+
+    #==========================================
+    def on_reading(self, device: Device, previous_status: DeviceStatus | str | None, now: datetime | None = None) -> list[EventCreate]:
+        """
+            Evaluate a device reading, returns the events to write.
+            Only transitions into a status trigger rules.
+        """
+        status = DeviceStatus(device.status).value
+        previous = DeviceStatus(previous_status).value if previous_status is not None else None
+
+        if status == previous:
+            return []
+
+        now = now or datetime.now()
+        events = []
+
+        with self._lock:
+            transition = self._states.get(device.id, (None, 0))[1] + 1
+            self._states[device.id] = (status, transition)
+
+            for rule in self._matching(device, status):
+                if rule.armed_only and not self.is_armed(device.location):
+                    continue
+
+                event = self._evaluate(rule, device, transition, now)
+                if event is not None:
+                    events.append(event)
+
+        return events
+
+    def _matching(self, device: Device, status: str) -> Iterator[CompiledRule]:
+        for key in (
+            ("device", str(device.id), status),
+            ("location", device.location, status),
+            ("type", device.type, status),
+            ("any", None, status),
+        ):
+            for rule in self._index.get(key, ()):
+                if rule.matches(device):
+                    yield rule
+
+    def _start_timer(self, rule: CompiledRule, device: Device, transition: int, since: datetime):
+        self._timer_seq += 1
+        self._devices[device.id] = (device.name, device.location)
+        heapq.heappush(self._timers, (since + rule.duration, self._timer_seq, rule.id, device.id, transition))
+
+    def _evaluate(self, rule: CompiledRule, device: Device, transition: int, now: datetime) -> EventCreate | None:
+        if rule.kind == RuleKind.STATE:
+            return self._event(rule, device.id, f"{rule.name}: {device.name} is {rule.status}")
+
+        if rule.kind == RuleKind.DURATION:
+            self._start_timer(rule, device, transition, now)
+            return None
+
+        # COUNT: distinct devices of one location entering the status within the window
+        window = self._windows.setdefault((rule.id, device.location), deque())
+        window.append((now, device.id))
+        while window and now - window[0][0] > rule.window:
+            window.popleft()
+
+        devices = {device_id for _, device_id in window}
+        if len(devices) < rule.threshold:
+            return None
+
+        window.clear()
+        return self._event(
+            rule, device.id,
+            f"{rule.name}: {len(devices)} devices in {device.location} are {rule.status}",
+        )
+
+    def expire(self, now: datetime | None = None) -> list[EventCreate]:
+        """
+            Fire duration rules whose device is still in the same state
+        """
+        now = now or datetime.now()
+        events = []
+
+        with self._lock:
+            while self._timers and self._timers[0][0] <= now:
+                _, _, rule_id, device_id, transition = heapq.heappop(self._timers)
+
+                rule = self._rules.get(rule_id)
+                if rule is None or self._states.get(device_id) != (rule.status, transition):
+                    continue
+
+                name, location = self._devices.get(device_id, (str(device_id), ""))
+
+                if rule.armed_only and not self.is_armed(location):
+                    continue
+
+                events.append(self._event(
+                    rule, device_id,
+                    f"{rule.name}: {name} {rule.status} for more than {int(rule.duration.total_seconds())}s",
+                ))
+
+        return events
+
+    @staticmethod
+    def _event(rule: CompiledRule, device_id: uuid.UUID, details: str) -> EventCreate:
+        # The text names the rule and device, it is kept as the event's note
+        return EventCreate(device_id=device_id, type=RULE_EVENT_TYPES[rule.kind], new_status=rule.status, details=details)
+
+rule_engine = RuleEngine()
@@ -0,0 +1,128 @@
+from sqlalchemy import Connection, Engine, column, literal_column, table
+from sqlalchemy.exc import DBAPIError
+
+from backend.app.core.config import logger
+
+import re
+import threading
+import weakref
+
+# SQLite FTS5 tables, rowid is the device_ref key / the event seq.
+# Prefix indexes make "do*" as cheap as "door".
+SEARCH_TABLES = {
+    "device_fts": "CREATE VIRTUAL TABLE IF NOT EXISTS device_fts USING fts5("
+                  "name, location, type, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "event_fts": "CREATE VIRTUAL TABLE IF NOT EXISTS event_fts USING fts5("
+                 "details, device, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+}
+
+device_fts = table("device_fts", column("rowid"), column("rank"))
+event_fts = table("event_fts", column("rowid"))
+
+_WORD = re.compile(r"\w+")
+MAX_WORDS = 16
+
+def words(query: str) -> list[str]:
+    return _WORD.findall(query.lower())[:MAX_WORDS]
+
+def match_expression(query: str) -> str | None:
+    """
+        FTS5 query where every word has to match as a prefix: back door -> "back"* AND "door"*.
+        Only word characters are kept, so user input cannot inject FTS syntax.
+    """
+    return " AND ".join(f'"{word}"*' for word in words(query)) or None
+
+def device_match(expression: str):
+    return literal_column("device_fts").match(expression)
+
+def event_match(expression: str):
+    return literal_column("event_fts").match(expression)
+
+#==========================================
+_lock = threading.Lock()
+# Engine -> whether it has the FTS tables, checked once per engine
+_enabled: "weakref.WeakKeyDictionary[Engine, bool]" = weakref.WeakKeyDictionary()
+
+def create_search_tables(engine: Engine) -> bool:
+    """
+        Create the FTS5 tables on SQLite. False when the database has no FTS5
+        (other databases, SQLite built without it), search then falls back to LIKE.
+    """
+    if engine.dialect.name != "sqlite":
+        logger.info("Full-text search is SQLite only, %s searches with LIKE (unranked, scans the tables)", engine.dialect.name)
+        _enabled[engine] = False
+        return False
+
+    try:
+        with engine.begin() as connection:
+            for ddl in SEARCH_TABLES.values():
+                connection.exec_driver_sql(ddl)
+    except DBAPIError as e:
+        logger.warning("Full-text search is not available, falling back to LIKE: %s", e)
+        _enabled[engine] = False
+        return False
+
+    _enabled[engine] = True
+    return True
+
+def enabled(engine: Engine) -> bool:
+    """
+        Whether the database behind an engine has the FTS tables. Read engines
+        and engines opened elsewhere are checked on first use.
+    """
+    found = _enabled.get(engine)
+    if found is not None:
+        return found
+
+    found = False
+    if engine.dialect.name == "sqlite":
+        try:
+            with engine.connect() as connection:
+                names = {row[0] for row in connection.exec_driver_sql(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('device_fts', 'event_fts')"
+                )}
+            found = names == set(SEARCH_TABLES)
+        except DBAPIError:
+            found = False
+
+    with _lock:
+        _enabled[engine] = found
+
+    return found
+
+#==========================================
+# Writes go through the caller's connection, so they commit with the row they index
+def index_devices(connection: Connection, rows: list[dict]):
+    """
+        rows: key, name, location, type
+    """
+    if not rows:
+        return
+
+    connection.exec_driver_sql("DELETE FROM device_fts WHERE rowid = ?", [(row["key"],) for row in rows])
+    connection.exec_driver_sql(
+        "INSERT INTO device_fts (rowid, name, location, type) VALUES (?, ?, ?, ?)",
+        [(row["key"], row["name"], row["location"], row["type"]) for row in rows],
+    )
+
+def remove_device(connection: Connection, key: int):
+    connection.exec_driver_sql("DELETE FROM device_fts WHERE rowid = ?", (key,))
+
+def index_events(connection: Connection, rows: list[dict]):
+    """
+        rows: seq, details, device (name, location and type of the device when the event was written)
+    """
+    if not rows:
+        return
+
+    connection.exec_driver_sql(
+        "INSERT INTO event_fts (rowid, details, device) VALUES (?, ?, ?)",
+        [(row["seq"], row["details"], row["device"]) for row in rows],
+    )
+
+def is_empty(connection: Connection) -> bool:
+    for name in SEARCH_TABLES:
+        if connection.exec_driver_sql(f"SELECT rowid FROM {name} LIMIT 1").first() is not None:
+            return False
+
+    return True
@@ -0,0 +1,418 @@
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+from backend.app.core.config import logger, settings
+
+import base64
+import hashlib
+import hmac
+import json
+import math
+import secrets
+import threading
+import time
+import uuid
+
+PASSWORD_ITERATIONS = 200_000
+DEVICE_KEY_PREFIX = "dk_"
+GATEWAY_KEY_PREFIX = "gk_"
+TOKEN_VERSION = "v1"
+
+def hash_password(password: str) -> str:
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PASSWORD_ITERATIONS)
+
+    return f"pbkdf2_sha256${PASSWORD_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+def verify_password(password: str, hashed: str) -> bool:
+    try:
+        algorithm, iterations, salt, digest = hashed.split("$")
+    except ValueError:
+        return False
+
+    if algorithm != "pbkdf2_sha256":
+        return False
+
+    candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(candidate.hex(), digest)
+
+def device_key_digest(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def bearer_token(authorization: str | None) -> str | None:
+    """
+        Token of an "Authorization: Bearer <token>" header
+    """
+    if not authorization:
+        return None
+
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+
+    return token.strip()
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+#==========================================
+@dataclass(frozen=True)
+class Principal:
+    """
+        Who a request is made by: a user (token), a device or an edge gateway (API keys).
+        token_id is the token id of a user token, the key digest of an API key.
+        Gateway keys belong to one site.
+    """
+    kind: str
+    subject: uuid.UUID | None
+    expires: float = float("inf")
+    token_id: str | None = None
+    site: str | None = None
+
+    @property
+    def is_device(self) -> bool:
+        return self.kind == "device"
+
+    @property
+    def is_gateway(self) -> bool:
+        return self.kind == "gateway"
+
+    @property
+    def is_user(self) -> bool:
+        return self.kind in ("user", "anonymous")
+
+# Used for every request while AUTH_ENABLED is off
+ANONYMOUS = Principal(kind="anonymous", subject=None)
+
+class VerificationCache:
+    """
+        Verified credentials by their raw value, so repeated requests skip
+        signature checks and hashing. Entries live at most `ttl` seconds and
+        never past the credential's own expiry. Oldest entries are evicted first.
+    """
+    def __init__(self, ttl: float, size: int):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, Principal]] = OrderedDict()
+
+    def get(self, credential: str, now: float | None = None) -> Principal | None:
+        now = time.time() if now is None else now
+
+        entry = self._entries.get(credential)
+        if entry is None:
+            return None
+
+        expires, principal = entry
+        if expires <= now:
+            with self._lock:
+                self._entries.pop(credential, None)
+            return None
+
+        return principal
+
+    def put(self, credential: str, principal: Principal, now: float | None = None):
+        now = time.time() if now is None else now
+
+        with self._lock:
+            self._entries[credential] = (min(now + self.ttl, principal.expires), principal)
+            self._entries.move_to_end(credential)
+
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate: Callable[[Principal], bool]):
+        with self._lock:
+            for credential in [credential for credential, (_, principal) in self._entries.items() if predicate(principal)]:
+                del self._entries[credential]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class LoginLimiter:
+    """
+        Failed logins per key (email or client address) within a sliding window.
+        A key is blocked once it reaches its limit, until its oldest failure
+        leaves the window. A successful login clears the email's failures.
+        At most `size` keys are tracked, the least recently failed are evicted first.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._lock = threading.Lock()
+        self._failures: OrderedDict[str, deque[float]] = OrderedDict()
+
+    def _recent(self, key: str, now: float) -> deque[float]:
+        failures = self._failures.get(key)
+        if failures is None:
+            return deque()
+
+        while failures and failures[0] <= now - settings.LOGIN_FAILURE_WINDOW:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+
+        return failures
+
+    def retry_after(self, email: str, address: str | None, now: float | None = None) -> int:
+        """
+            Seconds until a login for `email` from `address` is allowed again, 0 when it is
+        """
+        now = time.time() if now is None else now
+        wait = 0.0
+
+        with self._lock:
+            for key, limit in ((f"email:{email.lower()}", settings.LOGIN_MAX_FAILURES), (f"ip:{address}", settings.LOGIN_MAX_FAILURES_PER_IP)):
+                failures = self._recent(key, now)
+                if len(failures) >= limit > 0:
+                    wait = max(wait, failures[-limit] + settings.LOGIN_FAILURE_WINDOW - now)
+
+        return math.ceil(wait)
+
+    def failed(self, email: str, address: str | None, now: float | None = None):
+        now = time.time() if now is None else now
+
+        with self._lock:
+            for key in (f"email:{email.lower()}", f"ip:{address}"):
+                self._failures.setdefault(key, deque()).append(now)
+                self._failures.move_to_end(key)
+
+            while len(self._failures) > self.size:
+                self._failures.popitem(last=False)
+
+    def succeeded(self, email: str):
+        with self._lock:
+            self._failures.pop(f"email:{email.lower()}", None)
+
+    def clear(self):
+        with self._lock:
+            self._failures.clear()
+
+login_limiter = LoginLimiter(settings.LOGIN_TRACKED_KEYS)
+
+class Authenticator:
+    """
+        Verifies user tokens and device and gateway API keys from memory only.
+        User tokens are HMAC signed (id, expiry and token id), API keys are
+        looked up by their SHA-256 digest. Revoked token ids and API key digests
+        are loaded from the database at startup and refreshed periodically,
+        so no request ever needs a query to be authenticated.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._secret = b""
+        self.cache = VerificationCache(settings.AUTH_CACHE_TTL, settings.AUTH_CACHE_SIZE)
+        # key digest -> device id
+        self._device_keys: dict[str, uuid.UUID] = {}
+        # key digest -> site
+        self._gateway_keys: dict[str, str] = {}
+        # token id -> expiry
+        self._revoked: dict[str, float] = {}
+        # stream ticket -> (expiry, principal)
+        self._tickets: dict[str, tuple[float, Principal]] = {}
+
+    def configure(self, secret: str | None = None):
+        if not secret:
+            logger.warning("SECRET_KEY is not set, user tokens will not survive a restart")
+            secret = secrets.token_urlsafe(32)
+
+        self._secret = secret.encode()
+        self.cache.clear()
+
+    #==========================================
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self._secret, payload.encode(), hashlib.sha256).digest())
+
+    def issue_token(self, user_id: uuid.UUID, expires_in: float | None = None) -> tuple[str, int]:
+        expires = time.time() + (expires_in if expires_in is not None else settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+        claims = {"sub": user_id.hex, "exp": int(expires), "jti": secrets.token_hex(8)}
+
+        payload = f"{TOKEN_VERSION}.{_b64encode(json.dumps(claims, separators=(',', ':')).encode())}"
+        return f"{payload}.{self._sign(payload)}", int(expires)
+
+    def verify_token(self, token: str, now: float | None = None) -> Principal | None:
+        now = time.time() if now is None else now
+
+        # The cache holds every kind of credential, an API key is never a token
+        principal = self.cache.get(token, now)
+        if principal is not None:
+            return principal if principal.kind == "user" else None
+
+        version, _, rest = token.partition(".")
+        encoded, _, signature = rest.partition(".")
+        if version != TOKEN_VERSION or not encoded or not signature:
+            return None
+
+        if not hmac.compare_digest(self._sign(f"{version}.{encoded}"), signature):
+            return None
+
+        try:
+            claims = json.loads(_b64decode(encoded))
+            principal = Principal(
+                kind="user",
+                subject=uuid.UUID(hex=claims["sub"]),
+                expires=float(claims["exp"]),
+                token_id=claims["jti"],
+            )
+        except (ValueError, KeyError, TypeError):
+            return None
+
+        if principal.expires <= now or principal.token_id in self._revoked:
+            return None
+
+        self.cache.put(token, principal, now)
+        return principal
+
+    def revoke_token(self, token_id: str, expires: float):
+        with self._lock:
+            self._revoked[token_id] = expires
+
+        self.cache.invalidate(lambda principal: principal.token_id == token_id)
+
+    def load_revoked(self, revoked: Iterable[tuple[str, float]]):
+        now = time.time()
+        revoked = {token_id: expires for token_id, expires in revoked if expires > now}
+
+        with self._lock:
+            added = revoked.keys() - self._revoked.keys()
+            self._revoked = revoked
+
+        if added:
+            self.cache.invalidate(lambda principal: principal.token_id in added)
+
+    def issue_ticket(self, principal: Principal, now: float | None = None) -> str:
+        """
+            Short-lived single-use ticket that opens one websocket or stream
+            connection as `principal`, so tokens never end up in URLs and logs
+        """
+        now = time.time() if now is None else now
+        ticket = secrets.token_urlsafe(24)
+
+        with self._lock:
+            self._tickets = {key: entry for key, entry in self._tickets.items() if entry[0] > now}
+            self._tickets[ticket] = (min(now + settings.STREAM_TICKET_TTL, principal.expires), principal)
+
+        return ticket
+
+    def redeem_ticket(self, ticket: str, now: float | None = None) -> Principal | None:
+        now = time.time() if now is None else now
+
+        with self._lock:
+            entry = self._tickets.pop(ticket, None)
+
+        if entry is None or entry[0] <= now or entry[1].token_id in self._revoked:
+            return None
+
+        return entry[1]
+
+    #==========================================
+    @staticmethod
+    def new_device_key() -> tuple[str, str]:
+        """
+            A new (key, digest) pair, only the digest is stored
+        """
+        key = DEVICE_KEY_PREFIX + secrets.token_urlsafe(32)
+        return key, device_key_digest(key)
+
+    def add_device_key(self, digest: str, device_id: uuid.UUID):
+        with self._lock:
+            self._device_keys[digest] = device_id
+
+    def remove_device_keys(self, device_id: uuid.UUID):
+        with self._lock:
+            self._device_keys = {digest: owner for digest, owner in self._device_keys.items() if owner != device_id}
+
+        self.cache.invalidate(lambda principal: principal.is_device and principal.subject == device_id)
+
+    def load_device_keys(self, keys: Iterable[tuple[str, uuid.UUID]]):
+        keys = dict(keys)
+
+        with self._lock:
+            removed = self._device_keys.keys() - keys.keys()
+            self._device_keys = keys
+
+        if removed:
+            self.cache.invalidate(lambda principal: principal.is_device and principal.token_id in removed)
+
+    def verify_device_key(self, key: str, now: float | None = None) -> Principal | None:
+        principal = self.cache.get(key, now)
+        if principal is not None:
+            return principal if principal.is_device else None
+
+        if not key.startswith(DEVICE_KEY_PREFIX):
+            return None
+
+        digest = device_key_digest(key)
+        device_id = self._device_keys.get(digest)
+        if device_id is None:
+            return None
+
+        principal = Principal(kind="device", subject=device_id, token_id=digest)
+        self.cache.put(key, principal, now)
+        return principal
+
+    #==========================================
+    @staticmethod
+    def new_gateway_key() -> tuple[str, str]:
+        key = GATEWAY_KEY_PREFIX + secrets.token_urlsafe(32)
+        return key, device_key_digest(key)
+
+    def add_gateway_key(self, digest: str, site: str):
+        with self._lock:
+            self._gateway_keys[digest] = site
+
+    def remove_gateway_keys(self, site: str):
+        with self._lock:
+            self._gateway_keys = {digest: owner for digest, owner in self._gateway_keys.items() if owner != site}
+
+        self.cache.invalidate(lambda principal: principal.is_gateway and principal.site == site)
+
+    def load_gateway_keys(self, keys: Iterable[tuple[str, str]]):
+        keys = dict(keys)
+
+        with self._lock:
+            removed = self._gateway_keys.keys() - keys.keys()
+            self._gateway_keys = keys
+
+        if removed:
+            self.cache.invalidate(lambda principal: principal.is_gateway and principal.token_id in removed)
+
+    def verify_gateway_key(self, key: str, now: float | None = None) -> Principal | None:
+        principal = self.cache.get(key, now)
+        if principal is not None:
+            return principal if principal.is_gateway else None
+
+        digest = device_key_digest(key)
+        site = self._gateway_keys.get(digest)
+        if site is None:
+            return None
+
+        principal = Principal(kind="gateway", subject=None, token_id=digest, site=site)
+        self.cache.put(key, principal, now)
+        return principal
+
+    #==========================================
+    def authenticate(self, token: str | None = None, api_key: str | None = None, ticket: str | None = None) -> Principal | None:
+        """
+            Principal for a user token, API key or stream ticket, None when none verifies.
+            Everyone is ANONYMOUS while AUTH_ENABLED is off.
+        """
+        if not settings.AUTH_ENABLED:
+            return ANONYMOUS
+
+        if api_key and api_key.startswith(GATEWAY_KEY_PREFIX):
+            return self.verify_gateway_key(api_key)
+        if api_key:
+            return self.verify_device_key(api_key)
+        if token:
+            return self.verify_token(token)
+        if ticket:
+            return self.redeem_ticket(ticket)
+
+        return None
+
+authenticator = Authenticator()
@@ -0,0 +1,112 @@
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from backend.app.models import DEFAULT_SITE
+from backend.app.core.config import logger, settings
+from backend.app.core.database import engine, read_engine, create_primary_engine, create_read_engine, init_db
+from backend.app.core.changes import ChangeTracker, device_changes, event_changes
+from backend.app.core.rules import RuleEngine, rule_engine
+from backend.app.core.summary import DeviceSummary, device_summary
+from backend.app.core.telemetry import BatteryTrends
+
+import re
+import threading
+import weakref
+
+SITE_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+
+class SiteState:
+    """
+        In-memory state kept for each site next to its database
+    """
+    def __init__(
+        self,
+        summary: DeviceSummary | None = None,
+        rules: RuleEngine | None = None,
+        device_changes: ChangeTracker | None = None,
+        event_changes: ChangeTracker | None = None,
+        batteries: BatteryTrends | None = None,
+    ):
+        self.summary = summary or DeviceSummary()
+        self.rules = rules or RuleEngine()
+        self.device_changes = device_changes or ChangeTracker()
+        self.event_changes = event_changes or ChangeTracker()
+        self.batteries = batteries or BatteryTrends()
+
+class SiteRegistry:
+    """
+        One database and one SiteState per site (building).
+        The default site uses settings.DATABASE_URL and the module level singletons,
+        other sites get settings.SITE_DATABASE_URL with their id filled in.
+        Each site has a primary (write) and a read engine, created on first use.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines: dict[str, Engine] = {DEFAULT_SITE: engine}
+        self._read_engines: dict[str, Engine] = {DEFAULT_SITE: read_engine}
+        self._states: dict[str, SiteState] = {
+            DEFAULT_SITE: SiteState(device_summary, rule_engine, device_changes, event_changes),
+        }
+        # Engine -> site, so crud can find the site of a session. Unknown binds
+        # (tests, scripts) belong to the default site.
+        self._by_engine: weakref.WeakKeyDictionary[Engine, str] = weakref.WeakKeyDictionary({
+            engine: DEFAULT_SITE,
+            read_engine: DEFAULT_SITE,
+        })
+
+    def ids(self) -> list[str]:
+        return [DEFAULT_SITE, *(site for site in settings.SITES if site != DEFAULT_SITE)]
+
+    def exists(self, site_id: str) -> bool:
+        return site_id == DEFAULT_SITE or site_id in settings.SITES
+
+    def engine(self, site_id: str) -> Engine:
+        site_engine = self._engines.get(site_id)
+        if site_engine is not None:
+            return site_engine
+
+        if not self.exists(site_id) or not re.match(SITE_ID_PATTERN, site_id):
+            raise KeyError(site_id)
+
+        with self._lock:
+            if site_id not in self._engines:
+                site_engine = create_primary_engine(settings.SITE_DATABASE_URL.format(site=site_id))
+
+                with Session(site_engine) as session:
+                    init_db(session)
+
+                replica_url = settings.SITE_READ_DATABASE_URL
+                site_read_engine = create_read_engine(site_engine, replica_url.format(site=site_id) if replica_url else None)
+
+                self._by_engine[site_engine] = site_id
+                self._by_engine[site_read_engine] = site_id
+                self._read_engines[site_id] = site_read_engine
+                self._engines[site_id] = site_engine
+                logger.info("Opened database of site %s", site_id)
+
+            return self._engines[site_id]
+
+    def read_engine(self, site_id: str) -> Engine:
+        site_read_engine = self._read_engines.get(site_id)
+        if site_read_engine is not None:
+            return site_read_engine
+
+        # Opening the primary creates the read engine too
+        self.engine(site_id)
+        return self._read_engines[site_id]
+
+    def state(self, site_id: str) -> SiteState:
+        state = self._states.get(site_id)
+        if state is None:
+            with self._lock:
+                state = self._states.setdefault(site_id, SiteState())
+
+        return state
+
+    def site_of(self, session: Session) -> str:
+        return self._by_engine.get(session.get_bind(), DEFAULT_SITE)
+
+    def state_of(self, session: Session) -> SiteState:
+        return self.state(self.site_of(session))
+
+sites = SiteRegistry()
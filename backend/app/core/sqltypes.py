@@ -0,0 +1,93 @@
+from sqlalchemy.types import TypeDecorator, BigInteger, DateTime, LargeBinary, SmallInteger, Uuid
+from datetime import datetime, timedelta
+from enum import Enum
+
+import uuid
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+class EpochMicroseconds(TypeDecorator):
+    """
+        Naive datetime stored as an 8 byte integer (microseconds since 1970-01-01)
+        instead of a 26 character string. Comparisons and ordering still work on the column.
+        Databases with a native 8 byte timestamp (PostgreSQL) store that instead.
+    """
+    impl = BigInteger
+    cache_ok = True
+    NATIVE = ("postgresql",)
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name in self.NATIVE:
+            return dialect.type_descriptor(DateTime())
+
+        return dialect.type_descriptor(BigInteger())
+
+    def process_bind_param(self, value: datetime | None, dialect):
+        if value is None or dialect.name in self.NATIVE:
+            return value
+
+        return (value - EPOCH) // MICROSECOND
+
+    def process_result_value(self, value: int | None, dialect):
+        if value is None or dialect.name in self.NATIVE:
+            return value
+
+        return EPOCH + value * MICROSECOND
+
+
+class CodedEnum(TypeDecorator):
+    """
+        Enum stored as a small integer code. Codes are explicit so members can be
+        added or reordered without rewriting stored rows.
+    """
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, enum: type[Enum], codes: dict[Enum, int]):
+        super().__init__()
+        self.enum = enum
+        # Attributes named after __init__ arguments must be hashable for the statement cache
+        self.codes = tuple(codes.items())
+        self._to_code = dict(codes)
+        self._to_member = {code: member for member, code in codes.items()}
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+
+        return self._to_code[self.enum(value)]
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+
+        return self._to_member[value]
+
+
+class CompactUuid(TypeDecorator):
+    """
+        UUID stored as its 16 raw bytes instead of 32 hex characters.
+        Databases with a native UUID type (PostgreSQL) store that instead.
+    """
+    impl = LargeBinary
+    cache_ok = True
+    NATIVE = ("postgresql",)
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name in self.NATIVE:
+            return dialect.type_descriptor(Uuid())
+
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value: uuid.UUID | None, dialect):
+        if value is None or dialect.name in self.NATIVE:
+            return value
+
+        return value.bytes
+
+    def process_result_value(self, value: bytes | None, dialect):
+        if value is None or dialect.name in self.NATIVE:
+            return value
+
+        return uuid.UUID(bytes=bytes(value))
@@ -0,0 +1,210 @@
+from abc import ABC, abstractmethod
+from sqlalchemy import BigInteger, Connection, Engine, Table, create_engine, event, func, insert, type_coerce
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+
+from backend.app.core.config import logger, settings
+from backend.app.core.sqltypes import EpochMicroseconds
+
+import os
+
+BUCKET_MICROSECONDS = {"minute": 60_000_000, "hour": 3_600_000_000, "day": 86_400_000_000}
+
+class StorageBackend(ABC):
+    """
+        What differs between the databases the server can run on: how engines
+        are created and tuned, upserts, bulk inserts, time buckets and shutdown. Everything
+        else goes through SQLAlchemy unchanged.
+    """
+    dialect = ""
+
+    def create_primary_engine(self, url: str) -> Engine:
+        return create_engine(url)
+
+    def create_read_engine(self, primary: Engine, url: str | None = None) -> Engine:
+        if url:
+            return create_engine(url, pool_size=settings.DATABASE_READ_POOL_SIZE, pool_pre_ping=True)
+
+        return primary
+
+    @abstractmethod
+    def upsert(self, table):
+        """
+            INSERT statement with on_conflict_do_update()
+        """
+
+    def bulk_insert(self, connection: Connection, table: Table, rows: list[dict]) -> int:
+        """
+            Insert many rows in the caller's transaction, returns the number of rows
+        """
+        if rows:
+            connection.execute(insert(table), rows)
+
+        return len(rows)
+
+    @abstractmethod
+    def time_bucket(self, column, unit: str):
+        """
+            SQL expression truncating a timestamp column to the start of its
+            minute, hour or day, for grouping rows by time in the database
+        """
+
+    def checkpoint(self, primary: Engine) -> None:
+        primary.dispose()
+
+#==========================================
+def _use_wal(dbapi_connection, connection_record):
+    # Readers no longer block the writer (and the other way around)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+class SQLiteBackend(StorageBackend):
+    """
+        One file per site in WAL mode, queries read it through a second,
+        read-only connection pool. A single writer at a time.
+    """
+    dialect = "sqlite"
+    connect_args = {"check_same_thread": False}
+
+    @staticmethod
+    def file_of(engine: Engine) -> str | None:
+        """
+            Path of a SQLite database file, None for other databases and in-memory ones
+        """
+        if engine.dialect.name != "sqlite" or engine.url.database in (None, "", ":memory:"):
+            return None
+
+        return engine.url.database
+
+    def create_primary_engine(self, url: str) -> Engine:
+        primary = create_engine(url, connect_args=self.connect_args)
+
+        path = self.file_of(primary)
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            if settings.SQLITE_WAL:
+                event.listen(primary, "connect", _use_wal)
+
+        return primary
+
+    def create_read_engine(self, primary: Engine, url: str | None = None) -> Engine:
+        path = self.file_of(primary)
+        if url or path is None:
+            return super().create_read_engine(primary, url)
+
+        return create_engine(
+            f"sqlite:///file:{os.path.abspath(path)}?mode=ro&uri=true",
+            connect_args=self.connect_args,
+            pool_size=settings.DATABASE_READ_POOL_SIZE,
+        )
+
+    def upsert(self, table):
+        return sqlite.insert(table)
+
+    def time_bucket(self, column, unit: str):
+        # Timestamps are integer microseconds (EpochMicroseconds)
+        width = BUCKET_MICROSECONDS[unit]
+        return type_coerce(type_coerce(column, BigInteger) // width * width, EpochMicroseconds())
+
+    def checkpoint(self, primary: Engine) -> None:
+        """
+            Move the WAL into the database file so the next instance starts from a complete file
+        """
+        try:
+            if self.file_of(primary) is not None and settings.SQLITE_WAL:
+                with primary.connect() as connection:
+                    connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception as e:
+            logger.error("Error checkpointing %s: %s", primary.url, e)
+        finally:
+            primary.dispose()
+
+#==========================================
+class PostgresBackend(StorageBackend):
+    """
+        PostgreSQL through psycopg 3 (postgresql+psycopg://), for fleets that need
+        more than one writer. Connections are pooled and checked before use,
+        statements time out server side, bulk inserts use COPY. UUIDs and
+        timestamps are stored with the native types.
+    """
+    dialect = "postgresql"
+
+    def engine_options(self, pool_size: int) -> dict:
+        return {
+            "pool_size": pool_size,
+            "max_overflow": settings.DATABASE_MAX_OVERFLOW,
+            "pool_timeout": settings.DATABASE_POOL_TIMEOUT,
+            # Recycled before server or proxy idle timeouts close them under us
+            "pool_recycle": settings.DATABASE_POOL_RECYCLE,
+            "pool_pre_ping": True,
+            "connect_args": {
+                "application_name": settings.DATABASE_APPLICATION_NAME,
+                "options": f"-c statement_timeout={settings.DATABASE_STATEMENT_TIMEOUT_MS}",
+            },
+        }
+
+    def create_primary_engine(self, url: str) -> Engine:
+        return create_engine(url, **self.engine_options(settings.DATABASE_POOL_SIZE))
+
+    def create_read_engine(self, primary: Engine, url: str | None = None) -> Engine:
+        """
+            Separate pool so queries cannot starve ingestion of connections,
+            on the replica when given, read-only transactions either way
+        """
+        return create_engine(
+            url or primary.url,
+            execution_options={"postgresql_readonly": True},
+            **self.engine_options(settings.DATABASE_READ_POOL_SIZE),
+        )
+
+    def upsert(self, table):
+        return postgresql.insert(table)
+
+    def time_bucket(self, column, unit: str):
+        return func.date_trunc(unit, column)
+
+    def bulk_insert(self, connection: Connection, table: Table, rows: list[dict]) -> int:
+        """
+            COPY FROM STDIN: one round trip per buffer instead of one per row,
+            no statement parsing. The column types' bind processing (coded
+            enums) is applied here since COPY bypasses SQLAlchemy.
+        """
+        if not rows:
+            return 0
+
+        dialect = connection.dialect
+        columns = [column for column in table.columns if column.name in rows[0]]
+        processors = [column.type.bind_processor(dialect) for column in columns]
+        names = ", ".join(dialect.identifier_preparer.quote(column.name) for column in columns)
+
+        cursor = connection.connection.driver_connection.cursor()
+        try:
+            with cursor.copy(f"COPY {dialect.identifier_preparer.format_table(table)} ({names}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row([
+                        process(row[column.name]) if process else row[column.name]
+                        for column, process in zip(columns, processors)
+                    ])
+        finally:
+            cursor.close()
+
+        return len(rows)
+
+#==========================================
+BACKENDS: dict[str, StorageBackend] = {
+    backend.dialect: backend for backend in (SQLiteBackend(), PostgresBackend())
+}
+
+def backend_for(url: str) -> StorageBackend:
+    dialect = make_url(url).get_backend_name()
+    try:
+        return BACKENDS[dialect]
+    except KeyError:
+        raise ValueError(f"Unsupported database {dialect}, expected one of {', '.join(BACKENDS)}") from None
+
+def backend_of(engine: Engine) -> StorageBackend:
+    return BACKENDS[engine.dialect.name]
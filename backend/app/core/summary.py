@@ -0,0 +1,160 @@
+from collections import Counter
+from typing import Iterable
+
+from backend.app.models import Device, DeviceStatus
+
+import bisect
+import threading
+import uuid
+
+BATTERY_BUCKETS = ((0, 9), (10, 24), (25, 49), (50, 74), (75, 100))
+
+def _battery_bucket(battery: int) -> str:
+    for low, high in BATTERY_BUCKETS:
+        if battery <= high:
+            return f"{low}-{high}"
+
+    return f"{BATTERY_BUCKETS[-1][0]}-{BATTERY_BUCKETS[-1][1]}"
+
+class DeviceSummary:
+    """
+        Aggregated device counts kept in memory.
+        Updated incrementally by the crud write paths so reading it never touches the database.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices: dict[uuid.UUID, tuple] = {}
+        self._by_status: Counter[str] = Counter()
+        self._by_location: Counter[str] = Counter()
+        self._by_type: Counter[str] = Counter()
+        self._by_battery: Counter[str] = Counter()
+        # (battery, id) sorted ascending, so the lowest batteries are a slice
+        self._batteries: list[tuple[int, str]] = []
+        self._cache: dict[int, dict] = {}
+        self.version = 0
+
+    def _add(self, device_id: uuid.UUID, entry: tuple):
+        status, location, device_type, battery, name = entry
+        self._devices[device_id] = entry
+        self._by_status[status] += 1
+        self._by_location[location] += 1
+        self._by_type[device_type] += 1
+        self._by_battery[_battery_bucket(battery)] += 1
+        bisect.insort(self._batteries, (battery, str(device_id)))
+
+    def _discard(self, device_id: uuid.UUID):
+        entry = self._devices.pop(device_id, None)
+        if entry is None:
+            return
+
+        status, location, device_type, battery, name = entry
+        for counter, key in (
+            (self._by_status, status),
+            (self._by_location, location),
+            (self._by_type, device_type),
+            (self._by_battery, _battery_bucket(battery)),
+        ):
+            counter[key] -= 1
+            if counter[key] <= 0:
+                del counter[key]
+
+        index = bisect.bisect_left(self._batteries, (battery, str(device_id)))
+        if index < len(self._batteries) and self._batteries[index] == (battery, str(device_id)):
+            del self._batteries[index]
+
+    def _changed(self):
+        self.version += 1
+        self._cache.clear()
+
+    #==========================================
+    def rebuild(self, devices: Iterable[Device]):
+        """
+            Load every device once (at startup)
+        """
+        with self._lock:
+            self._devices.clear()
+            for counter in (self._by_status, self._by_location, self._by_type, self._by_battery):
+                counter.clear()
+            self._batteries.clear()
+
+            for device in devices:
+                self._add(device.id, self._entry(device))
+
+            self._changed()
+
+    def upsert(self, device: Device):
+        entry = self._entry(device)
+
+        with self._lock:
+            if self._devices.get(device.id) == entry:
+                return
+
+            self._discard(device.id)
+            self._add(device.id, entry)
+            self._changed()
+
+    def remove(self, device_id: uuid.UUID):
+        with self._lock:
+            if device_id not in self._devices:
+                return
+
+            self._discard(device_id)
+            self._changed()
+
+    def __contains__(self, device_id: uuid.UUID) -> bool:
+        return device_id in self._devices
+
+    def labels_of(self, device_id: uuid.UUID) -> tuple[str, str, str] | None:
+        """
+            (name, location, type) of a device
+        """
+        entry = self._devices.get(device_id)
+        if entry is None:
+            return None
+
+        status, location, device_type, battery, name = entry
+        return name, location, device_type
+
+    def location_of(self, device_id: uuid.UUID) -> str | None:
+        entry = self._devices.get(device_id)
+        return entry[1] if entry is not None else None
+
+    def snapshot(self, lowest: int = 5) -> dict:
+        """
+            Summary as a JSON ready dict, cached until the next change
+        """
+        with self._lock:
+            cached = self._cache.get(lowest)
+            if cached is not None:
+                return cached
+
+            snapshot = {
+                "version": self.version,
+                "total": len(self._devices),
+                "by_status": {status.value: self._by_status.get(status.value, 0) for status in DeviceStatus},
+                "by_location": dict(self._by_location),
+                "by_type": dict(self._by_type),
+                "battery_distribution": {
+                    f"{low}-{high}": self._by_battery.get(f"{low}-{high}", 0) for low, high in BATTERY_BUCKETS
+                },
+                "lowest_battery": [
+                    {
+                        "id": device_id,
+                        "name": self._devices[uuid.UUID(device_id)][4],
+                        "location": self._devices[uuid.UUID(device_id)][1],
+                        "battery": battery,
+                    }
+                    for battery, device_id in self._batteries[:max(lowest, 0)]
+                ],
+            }
+            self._cache[lowest] = snapshot
+
+            return snapshot
+
+    @staticmethod
+    def _entry(device: Device) -> tuple:
+        status = device.status.value if isinstance(device.status, DeviceStatus) else str(device.status)
+
+        return (status, device.location, device.type, device.battery, device.name)
+
+device_summary = DeviceSummary()
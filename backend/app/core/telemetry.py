@@ -0,0 +1,199 @@
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from backend.app.core.config import settings
+
+import numpy as np
+import threading
+import uuid
+
+SECONDS_PER_DAY = 86400.0
+
+#==========================================
+# Chunk columns are varint encoded deltas: readings arrive every few minutes and
+# drop by 0 or 1 percent, so most deltas take a single byte.
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+def _unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+def encode_varints(values: Iterable[int], signed: bool = False) -> bytes:
+    out = bytearray()
+
+    for value in values:
+        value = _zigzag(value) if signed else value
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    return bytes(out)
+
+def decode_varints(data: bytes, signed: bool = False) -> list[int]:
+    values = []
+    value = shift = 0
+
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+
+        values.append(_unzigzag(value) if signed else value)
+        value = shift = 0
+
+    return values
+
+def decode_chunk(start: datetime, first_value: int, time_deltas: bytes, value_deltas: bytes) -> list[tuple[datetime, int]]:
+    """
+        Readings of a chunk: the first one is stored as is, the others as
+        seconds and percent since the previous reading
+    """
+    readings = [(start, first_value)]
+    timestamp, value = start, first_value
+
+    for seconds, change in zip(decode_varints(time_deltas), decode_varints(value_deltas, signed=True)):
+        timestamp += timedelta(seconds=seconds)
+        value += change
+        readings.append((timestamp, value))
+
+    return readings
+
+#==========================================
+class BatteryTrend:
+    """
+        Drain rate of one device by exponentially weighted least squares over
+        (days, percent). Sums are kept relative to the last reading so they stay
+        small, each reading is O(1). A jump up means the battery was replaced and
+        starts a new trend.
+    """
+    __slots__ = ("last", "value", "readings", "w", "st", "sv", "stt", "stv")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last: datetime | None = None
+        self.value = 0
+        self.readings = 0
+        self.w = self.st = self.sv = self.stt = self.stv = 0.0
+
+    def add(self, timestamp: datetime, value: int, half_life_days: float, replaced_jump: int):
+        if self.last is not None and value - self.value >= replaced_jump:
+            self.reset()
+
+        if self.last is not None:
+            days = (timestamp - self.last).total_seconds() / SECONDS_PER_DAY
+            if days < 0:
+                # Out of order, too late to weigh in
+                return
+
+            decay = 0.5 ** (days / half_life_days)
+            w, st, sv, stt, stv = (decay * s for s in (self.w, self.st, self.sv, self.stt, self.stv))
+
+            # Move the origin to the new reading
+            self.w = w
+            self.st = st - w * days
+            self.sv = sv
+            self.stt = stt - 2 * days * st + w * days * days
+            self.stv = stv - days * sv
+
+        self.last = timestamp
+        self.value = value
+        self.readings += 1
+        # The new reading sits at t = 0
+        self.w += 1
+        self.sv += value
+
+    @property
+    def slope(self) -> float | None:
+        """
+            Percent per day, negative while draining
+        """
+        denominator = self.w * self.stt - self.st * self.st
+        if self.readings < 2 or denominator <= 0:
+            return None
+
+        return (self.w * self.stv - self.st * self.sv) / denominator
+
+class BatteryTrends:
+    """
+        BatteryTrend of every device of a site, fed by crud with each battery reading
+        and rebuilt from the stored chunks at startup
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._trends: dict[uuid.UUID, BatteryTrend] = {}
+
+    def add(self, device_id: uuid.UUID, timestamp: datetime, value: int):
+        with self._lock:
+            trend = self._trends.get(device_id)
+            if trend is None:
+                trend = self._trends[device_id] = BatteryTrend()
+
+            trend.add(timestamp, value, settings.BATTERY_TREND_HALF_LIFE_DAYS, settings.BATTERY_REPLACED_JUMP)
+
+    def remove(self, device_id: uuid.UUID):
+        with self._lock:
+            self._trends.pop(device_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._trends.clear()
+
+    def merge(self, other: "BatteryTrends"):
+        """
+            Take the trends of `other` for devices without one, readings that
+            arrived while `other` was being built are kept
+        """
+        with self._lock:
+            for device_id, trend in other._trends.items():
+                self._trends.setdefault(device_id, trend)
+
+    def get(self, device_id: uuid.UUID) -> BatteryTrend | None:
+        return self._trends.get(device_id)
+
+    def _columns(self) -> tuple[list[uuid.UUID], list[tuple]]:
+        with self._lock:
+            rows = [
+                (device_id, trend.value, trend.last.timestamp(), trend.w, trend.st, trend.sv, trend.stt, trend.stv)
+                for device_id, trend in self._trends.items()
+                if trend.readings >= settings.BATTERY_TREND_MIN_READINGS
+            ]
+
+        return [row[0] for row in rows], [row[1:] for row in rows]
+
+    def predict(self, threshold: int, days: float, now: datetime | None = None) -> list[dict]:
+        """
+            Devices predicted to be at or below `threshold` percent within `days`,
+            soonest first. Computed over the whole fleet at once with numpy.
+        """
+        now = now or datetime.now()
+        device_ids, rows = self._columns()
+        if not rows:
+            return []
+
+        values, last, w, st, sv, stt, stv = np.array(rows, dtype=float).T
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            denominator = w * stt - st * st
+            slopes = np.where(denominator > 0, (w * stv - st * sv) / denominator, 0.0)
+            crossing = last + np.where(slopes < 0, (values - threshold) / -slopes, np.inf) * SECONDS_PER_DAY
+            crossing = np.where(values <= threshold, last, crossing)
+
+        selected = np.nonzero(crossing <= now.timestamp() + days * SECONDS_PER_DAY)[0]
+        predictions = [(device_ids[i], values[i], slopes[i], crossing[i]) for i in selected]
+
+        predictions.sort(key=lambda prediction: prediction[3])
+
+        return [
+            {
+                "device_id": device_id,
+                "battery": int(value),
+                "drain_per_day": round(-float(slope), 3),
+                "days_left": round(max(0.0, (float(crossing) - now.timestamp()) / SECONDS_PER_DAY), 2),
+                "predicted_at": datetime.fromtimestamp(float(crossing)),
+            }
+            for device_id, value, slope, crossing in predictions
+        ]
@@ -1,62 +1,333 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session
+from collections import deque
+from typing import AsyncIterator
 
 from backend.app import crud
-from backend.app.models import DevicePublic, EventPublic
-from backend.app.core.database import engine
-from backend.app.core.config import logger
+from backend.app.core.admission import Overloaded, RouteClass, admission
+from backend.app.core.config import logger, settings, SAMPLED
+from backend.app.core.formats import dumps
+from backend.app.core.lifecycle import reconnect_after, supervisor
+from backend.app.core.metrics import (
+    BROADCAST_SECONDS, BROADCAST_FAILURES, WEBSOCKET_CLIENTS,
+    STREAM_CLIENTS, STREAM_DROPPED
+)
+from backend.app.core.profiling import profiler, phase
+from backend.app.core.sites import sites
+from backend.app.core.security import Principal, authenticator, bearer_token
+from backend.app.models import DEFAULT_SITE
+
+import asyncio
+import uuid
 
 websocket_router = APIRouter(prefix="/ws", tags=["websocket"])
+stream_router = APIRouter(prefix="/stream", tags=["stream"])
+
+def _split(value: str | None) -> frozenset[str] | None:
+    if not value:
+        return None
+
+    return frozenset(part.strip() for part in value.split(",") if part.strip()) or None
+
+class Subscription:
+    """
+        Which broadcast messages a subscriber gets. Subscribers only get messages
+        of one site, the other filters are optional and take a comma separated list.
+        Device and location filters only apply to messages about a device,
+        collection wide messages (summaries, imports) are only filtered by type.
+    """
+    def __init__(
+        self,
+        types: str | None = None,
+        device_id: str | None = None,
+        location: str | None = None,
+        site: str = DEFAULT_SITE,
+    ):
+        self.site = site
+        self.types = _split(types)
+        self.device_ids = _split(device_id)
+        self.locations = _split(location)
+
+    def matches(self, message: dict) -> bool:
+        if message.get("site", DEFAULT_SITE) != self.site:
+            return False
+
+        if self.types is not None and message.get("type") not in self.types:
+            return False
+
+        if self.device_ids is None and self.locations is None:
+            return True
+
+        device = message.get("device") or {}
+        event = message.get("event") or {}
+        device_id = device.get("id") or message.get("device_id") or event.get("device_id")
+        if device_id is None:
+            return True
+
+        if self.device_ids is not None and str(device_id) not in self.device_ids:
+            return False
+
+        if self.locations is not None:
+            location = device.get("location")
+            if location is None:
+                try:
+                    location = sites.state(self.site).summary.location_of(uuid.UUID(str(device_id)))
+                except ValueError:
+                    location = None
+            if location not in self.locations:
+                return False
+
+        return True
+
+class StreamSubscriber:
+    """
+        Server-Sent Events client. Frames are queued, the oldest is dropped when a client falls behind.
+        A frame without a sequence number is the last one, the stream ends after it.
+    """
+    def __init__(self, subscription: Subscription):
+        self.subscription = subscription
+        self.queue: asyncio.Queue[tuple[int | None, bytes]] = asyncio.Queue(maxsize=settings.STREAM_QUEUE_SIZE)
+
+    def push(self, item: tuple[int | None, bytes]):
+        if self.queue.full():
+            self.queue.get_nowait()
+            STREAM_DROPPED.inc()
+
+        self.queue.put_nowait(item)
+
+def sse_frame(seq: int | None, message_type: str, data: str) -> bytes:
+    event_id = f"id: {seq}\n" if seq is not None else ""
+    return f"{event_id}event: {message_type}\ndata: {data}\n\n".encode()
+
+def reconnect_message(delay: int) -> dict:
+    return {"type": "reconnect", "reconnect_after": delay}
+
+def reconnect_frame(delay: int) -> bytes:
+    """
+        Last frame of a stream closed for draining, `retry` sets the EventSource reconnect delay
+    """
+    return f"retry: {delay * 1000}\n".encode() + sse_frame(None, "reconnect", dumps(reconnect_message(delay)).decode())
 
 class ConnectionManager:
+    """
+        Fans broadcast messages out to websocket, Server-Sent Events and long-poll clients.
+        Each message is encoded once, the last STREAM_REPLAY_SIZE are kept (numbered)
+        for long-poll cursors and SSE Last-Event-ID resumes.
+    """
     def __init__(self):
         self.active_connections: list[WebSocket] = []
-    
-    async def connect(self, websocket: WebSocket):
+        self.subscriptions: dict[WebSocket, Subscription] = {}
+        self.streams: list[StreamSubscriber] = []
+        # (seq, message, json text, SSE frame)
+        self.recent: deque[tuple[int, dict, str, bytes]] = deque(maxlen=settings.STREAM_REPLAY_SIZE)
+        self.seq = 0
+        self._waiters: set[asyncio.Event] = set()
+
+    async def connect(self, websocket: WebSocket, subscription: Subscription | None = None):
         await websocket.accept()
         self.active_connections.append(websocket)
-    
+        self.subscriptions[websocket] = subscription or Subscription()
+
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
+        self.subscriptions.pop(websocket, None)
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self.active_connections or self.streams or self._waiters)
 
     async def send_personal_message(self, message: dict, websocket: WebSocket):
-        await websocket.send_json(message)
+        await websocket.send_text(dumps(message).decode())
+
+    def subscribe_stream(self, subscription: Subscription) -> StreamSubscriber:
+        subscriber = StreamSubscriber(subscription)
+        self.streams.append(subscriber)
+        return subscriber
+
+    def unsubscribe_stream(self, subscriber: StreamSubscriber):
+        if subscriber in self.streams:
+            self.streams.remove(subscriber)
+
+    def messages_after(self, cursor: int, subscription: Subscription) -> list[tuple[int, str, bytes]]:
+        """
+            Buffered (seq, json text, SSE frame) newer than cursor that match the subscription.
+            A cursor from before a restart is treated as "from the start of the buffer".
+        """
+        if cursor > self.seq:
+            cursor = 0
+
+        return [
+            (seq, text, frame)
+            for seq, message, text, frame in self.recent
+            if seq > cursor and subscription.matches(message)
+        ]
+
+    def can_resume(self, cursor: int) -> bool:
+        """
+            Whether every message after cursor is still buffered. Otherwise (the
+            client was gone too long, or the cursor is from before a restart)
+            resuming would silently skip messages.
+        """
+        if cursor > self.seq:
+            return False
+
+        oldest = self.recent[0][0] if self.recent else self.seq + 1
+        return cursor >= oldest - 1
+
+    async def wait_for_messages(self, timeout: float) -> bool:
+        """
+            Wait until the next broadcast, False on timeout
+        """
+        waiter = asyncio.Event()
+        self._waiters.add(waiter)
+
+        try:
+            await asyncio.wait_for(waiter.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._waiters.discard(waiter)
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
+    async def broadcast(self, message: dict, site: str = DEFAULT_SITE):
+        """
+            Send a message to the subscribers of a site, the message is tagged with the site
+        """
+        message = {**message, "site": site}
+
+        with BROADCAST_SECONDS.time(), phase("broadcast"):
+            text = dumps(message).decode()
+            self.seq += 1
+            frame = sse_frame(self.seq, message.get("type", "message"), text)
+            self.recent.append((self.seq, message, text, frame))
+
+            for stream in list(self.streams):
+                if stream.subscription.matches(message):
+                    stream.push((self.seq, frame))
+
+            for waiter in self._waiters:
+                waiter.set()
+
+            for connection in list(self.active_connections):
+                subscription = self.subscriptions.get(connection)
+                if subscription is not None and not subscription.matches(message):
+                    continue
+
+                try:
+                    await connection.send_text(text)
+                except Exception as e:
+                    logger.error("Error sending message: %s", e)
+                    BROADCAST_FAILURES.inc()
+                    self.disconnect(connection)
+
+    async def close_all(self):
+        """
+            Ask every client to reconnect (to another instance) after a random delay
+            and close it. Drain hook, new connections are refused while draining.
+        """
+        closed = len(self.active_connections) + len(self.streams)
+
+        for connection in list(self.active_connections):
+            delay = reconnect_after()
             try:
-                await connection.send_json(message)
+                await connection.send_text(dumps(reconnect_message(delay)).decode())
+                await connection.close(code=1012, reason=f"reconnect_after={delay}")
             except Exception as e:
-                logger.error(f"Error sending message: {e}")
-                self.disconnect(connection)
+                logger.debug("Error closing websocket: %s", e)
+            self.disconnect(connection)
+
+        for stream in list(self.streams):
+            stream.push((None, reconnect_frame(reconnect_after())))
+
+        # Pending long-polls return at once
+        for waiter in self._waiters:
+            waiter.set()
+
+        logger.info("Closed %d websocket and stream clients", closed)
 
 manager = ConnectionManager()
 
+def authenticate_connection(headers, query_params) -> Principal | None:
+    """
+        User of a websocket or stream connection. Browsers cannot set headers on
+        WebSocket and EventSource connections, so they pass a single-use ticket
+        from POST /api/stream-ticket as ?ticket= instead (never the token itself,
+        which would end up in access logs). A reconnect needs a new ticket.
+    """
+    principal = authenticator.authenticate(
+        token=bearer_token(headers.get("authorization")),
+        ticket=query_params.get("ticket"),
+    )
+
+    return principal if principal is not None and principal.is_user else None
+
+WEBSOCKET_CLIENTS.set_function(lambda: len(manager.active_connections))
+STREAM_CLIENTS.set_function(lambda: len(manager.streams))
+
+def build_initial_state(site: str = DEFAULT_SITE) -> dict:
+    """
+        Devices and recent events of a site sent to every new websocket and SSE client
+    """
+    with Session(sites.read_engine(site)) as session:
+        devices = crud.get_device_rows(session=session)
+        events = crud.get_event_rows(session=session, limit=10)
+
+    return {
+        "type": "initial_state",
+        "site": site,
+        "devices": devices,
+        "events": events,
+    }
+
+#==========================================
 @websocket_router.websocket("")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    types: str | None = None,
+    device_id: str | None = None,
+    location: str | None = None,
+    site: str = DEFAULT_SITE,
+):
     """
-        Websocket connection for real-time updates.
+        Websocket connection for real-time updates of one site.
         Frontend will connect here to receive live sensor updates.
+        Optional types, device_id and location filters (comma separated) limit what is pushed.
     """
-    await manager.connect(websocket)
-    
-    logger.info(f"New websocket connection. Total: {len(manager.active_connections)}")
+    if authenticate_connection(websocket.headers, websocket.query_params) is None:
+        logger.warning("Rejected unauthenticated websocket connection")
+        await websocket.close(code=1008, reason="Not authenticated")
+        return
 
-    with Session(engine) as session:
-        devices = crud.get_devices(session=session)
-        events = crud.get_events(session=session, limit=10)
+    if not sites.exists(site):
+        await websocket.close(code=1008, reason="Site not found")
+        return
 
-    await manager.send_personal_message({
-        "type": "initial_state",
-        "devices": [ DevicePublic.model_validate(device).model_dump(mode="json") for device in devices],
-        "events": [EventPublic.model_validate(event).model_dump(mode="json") for event in events],
-    }, websocket)
+    if supervisor.draining:
+        await websocket.close(code=1012, reason=f"reconnect_after={reconnect_after()}")
+        return
 
     try:
+        try:
+            async with admission.admit(RouteClass.SNAPSHOT):
+                await manager.connect(websocket, Subscription(types, device_id, location, site))
+
+                logger.info("New websocket connection. Total: %d", len(manager.active_connections))
+
+                with profiler.profile("initial_state", dict(websocket.headers)):
+                    initial_state = build_initial_state(site)
+
+                    with phase("serialization"):
+                        await manager.send_personal_message(initial_state, websocket)
+        except Overloaded as e:
+            # 1013: try again later
+            await websocket.close(code=1013, reason=f"reconnect_after={e.retry_after}")
+            return
+
         while True:
             data = await websocket.receive_text()
-            logger.info(f"Received from client: {data}")
+            logger.info("Received from client: %s", data, extra=SAMPLED)
 
             await manager.send_personal_message({
                 "type": "ack",
@@ -64,5 +335,142 @@ async def websocket_endpoint(websocket: WebSocket):
             }, websocket)
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
-        logger.info(f"Websocket disconnected. Remaining: {len(manager.active_connections)}")
+        pass
+    finally:
+        # Also when building or sending the initial state failed
+        if websocket in manager.subscriptions:
+            manager.disconnect(websocket)
+            logger.info("Websocket disconnected. Remaining: %d", len(manager.active_connections))
+
+#==========================================
+async def sse_frames(
+    subscriber: StreamSubscriber,
+    last_event_id: int | None = None,
+    initial_state: dict | None = None,
+) -> AsyncIterator[bytes]:
+    """
+        Frames for one SSE client: the initial state (or the missed messages when
+        resuming with Last-Event-ID), then live messages with keepalive comments in between
+    """
+    try:
+        last_seq = 0
+
+        if last_event_id is None:
+            initial_state = initial_state or build_initial_state(subscriber.subscription.site)
+            yield sse_frame(None, "initial_state", dumps(initial_state).decode())
+        else:
+            for seq, _, frame in manager.messages_after(last_event_id, subscriber.subscription):
+                last_seq = seq
+                yield frame
+
+        while True:
+            try:
+                seq, frame = await asyncio.wait_for(subscriber.queue.get(), settings.STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+
+            if seq is None:
+                yield frame
+                return
+
+            # Already sent while replaying
+            if seq <= last_seq:
+                continue
+
+            yield frame
+
+    finally:
+        manager.unsubscribe_stream(subscriber)
+        logger.info("Stream client disconnected. Remaining: %d", len(manager.streams))
+
+@stream_router.get("")
+async def stream(
+    request: Request,
+    types: str | None = None,
+    device_id: str | None = None,
+    location: str | None = None,
+    site: str = DEFAULT_SITE,
+):
+    """
+        Server-Sent Events with the same messages and filters as the websocket.
+        Reconnecting clients send Last-Event-ID and get the messages they missed,
+        or a new initial state when those are no longer buffered.
+    """
+    if authenticate_connection(request.headers, request.query_params) is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+
+    if not sites.exists(site):
+        raise HTTPException(status_code=404, detail="Site not found")
+
+    if supervisor.draining:
+        raise HTTPException(status_code=503, detail="Server is shutting down", headers={"Retry-After": str(reconnect_after())})
+
+    last_event_id = request.headers.get("last-event-id")
+    last_event_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+
+    if last_event_id is not None and not manager.can_resume(last_event_id):
+        logger.info("Stream resumed from %d, which is no longer buffered: sending the initial state", last_event_id)
+        last_event_id = None
+
+    # Subscribe before reading the initial state so nothing falls in between
+    subscriber = manager.subscribe_stream(Subscription(types, device_id, location, site))
+
+    # Built here rather than in the stream, so an overloaded server can still answer 503
+    initial_state = None
+    if last_event_id is None:
+        try:
+            async with admission.admit(RouteClass.SNAPSHOT):
+                initial_state = build_initial_state(site)
+        except Overloaded as e:
+            manager.unsubscribe_stream(subscriber)
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    logger.info("New stream connection. Total: %d", len(manager.streams))
+
+    return StreamingResponse(
+        sse_frames(subscriber, last_event_id, initial_state),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@stream_router.get("/poll")
+async def long_poll(
+    request: Request,
+    cursor: int | None = None,
+    timeout: float = Query(default=settings.LONG_POLL_TIMEOUT, ge=0, le=60),
+    types: str | None = None,
+    device_id: str | None = None,
+    location: str | None = None,
+    site: str = DEFAULT_SITE,
+):
+    """
+        Long-poll alternative to the stream. Returns the messages after `cursor`,
+        waiting up to `timeout` seconds for one. Pass the returned cursor to the next call,
+        without a cursor only messages from now on are returned.
+    """
+    if authenticate_connection(request.headers, request.query_params) is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+
+    if not sites.exists(site):
+        raise HTTPException(status_code=404, detail="Site not found")
+
+    if supervisor.draining:
+        raise HTTPException(status_code=503, detail="Server is shutting down", headers={"Retry-After": str(reconnect_after())})
+
+    subscription = Subscription(types, device_id, location, site)
+    cursor = manager.seq if cursor is None else cursor
+    deadline = asyncio.get_running_loop().time() + timeout
+
+    messages = manager.messages_after(cursor, subscription)
+    while not messages:
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0 or supervisor.draining or not await manager.wait_for_messages(remaining):
+            break
+        messages = manager.messages_after(cursor, subscription)
+
+    # Every match up to manager.seq was collected, so the next call can start there.
+    # Messages are already encoded, only the envelope is built here.
+    body = b'{"cursor":%d,"messages":[%s]}' % (manager.seq, ",".join(text for _, text, _ in messages).encode())
+
+    return Response(body, media_type="application/json")
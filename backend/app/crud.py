@@ -1,35 +1,211 @@
-from sqlmodel import Session, select
-from typing import List, Any
+from sqlmodel import Session, select, func, delete, insert
+from typing import List, Any, Iterator
 from datetime import datetime, timedelta
+from collections import Counter
 
 from backend.app.models import (
     Device, DeviceUpdate, DeviceCreate, DeviceStatus, 
-    Event, EventCreate, EventType
+    DeviceRef, DeviceState, BatteryChunk, Event, EventCreate, EventType, event_id, render_event_details,
+    EventRollup, RollupResolution, RollupGroup,
+    AlarmRule, AlarmRuleCreate, ArmedLocation, EventPublic, DeviceReading,
+    User, UserCreate, DeviceKey, GatewayKey, RevokedToken
 )
+from backend.app.core.metrics import DB_QUERY_SECONDS, DB_COMMIT_SECONDS, EVENTS_WRITTEN, timed
+from backend.app.core.rules import ALL_LOCATIONS, CompiledRule
+from backend.app.core.sites import sites
+from backend.app.core.security import authenticator, hash_password, verify_password
+from backend.app.core.notifications import notifier
+from backend.app.core.config import settings
+from backend.app.core import search
+from backend.app.core.storage import backend_of
+from backend.app.core.telemetry import BatteryTrends, decode_chunk, encode_varints
 
 import uuid 
+import weakref
 
+def _commit(session: Session, operation: str) -> None:
+    with DB_COMMIT_SECONDS.labels(operation).time():
+        session.commit()
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
 def get_devices(*, session: Session) -> List[Device]:
     return session.exec(select(Device)).all()
 
+@timed(DB_QUERY_SECONDS, phase_name="db")
 def get_device_by_id(*, session: Session, device_id: uuid.UUID) -> Device | None:
     return session.get(Device, device_id)
 
+@timed(DB_QUERY_SECONDS, phase_name="db")
 def update_device(*, session: Session, db_device: Device, device_in: DeviceUpdate) -> Device:
     """
         Updates device (Only stuff inside DeviceUpdate)
     """
+    previous_status = db_device.status
+    previous_battery = db_device.battery
+
     device_data = device_in.model_dump(exclude_unset=True)
     db_device.sqlmodel_update(device_data)
 
     db_device.last_seen = datetime.now()
+    battery = device_data.get("battery")
 
     session.add(db_device)
-    session.commit()
+    if db_device.status != previous_status or db_device.battery != previous_battery:
+        _record_state(session=session, device=db_device, at=db_device.last_seen)
+    if battery is not None:
+        _append_battery_reading(session=session, device_id=db_device.id, battery=battery, at=db_device.last_seen)
+    if device_data.keys() & {"name", "location", "type"}:
+        _index_device(session=session, device=db_device)
+    _commit(session, "update_device")
     session.refresh(db_device)
 
+    state = sites.state_of(session)
+    state.summary.upsert(db_device)
+    state.device_changes.record(db_device.id)
+    if battery is not None:
+        state.batteries.add(db_device.id, db_device.last_seen, battery)
+
+    write_rule_events(session=session, events=state.rules.on_reading(db_device, previous_status))
+
     return db_device
 
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def touch_device(*, session: Session, db_device: Device) -> Device:
+    """
+        Only refresh last_seen, for repeated readings that change nothing else
+    """
+    db_device.last_seen = datetime.now()
+
+    session.add(db_device)
+    _commit(session, "touch_device")
+
+    sites.state_of(session).device_changes.record(db_device.id)
+
+    return db_device
+
+def _apply_stale_reading(*, session: Session, device: Device, reading: DeviceReading, events: list[EventCreate]) -> bool:
+    """
+        Add a reading taken before the device's current state to its history, as a
+        change from the state the device had at that time. False when it changed
+        nothing then, or there is no history from that time to compare it with.
+    """
+    device_key = get_device_key(session=session, device_id=device.id)
+    before = session.exec(
+        select(DeviceState)
+        .where(DeviceState.device_key == device_key, DeviceState.valid_from <= reading.timestamp)
+        .order_by(DeviceState.valid_from.desc(), DeviceState.seq.desc())
+        .limit(1)
+    ).first()
+
+    if before is None or before.status is None:
+        return False
+    if before.status == reading.status and (reading.battery is None or reading.battery == before.battery):
+        return False
+
+    battery = before.battery if reading.battery is None else reading.battery
+    session.add(DeviceState(device_key=device_key, valid_from=reading.timestamp, status=reading.status, battery=battery))
+    if reading.battery is not None:
+        _append_battery_reading(session=session, device_id=device.id, battery=reading.battery, at=reading.timestamp)
+
+    events.append(EventCreate(
+        device_id=device.id,
+        type=EventType.STATUS_CHANGE,
+        old_status=before.status,
+        new_status=reading.status,
+        battery=reading.battery,
+        timestamp=reading.timestamp,
+    ))
+    return True
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def apply_readings(*, session: Session, readings: List[DeviceReading]) -> dict:
+    """
+        Readings forwarded by an edge gateway, applied in the order they were taken
+        and with their own timestamps: status changes become events at the time they
+        happened, repeated readings only move last_seen forward. Readings older than
+        the device's current state (it also reached the server directly) are stale:
+        they are compared with the state the device had when they were taken and
+        only added to its history, they never change the device or fire rules.
+        One bulk insert and commit for the batch.
+        Returns the number of readings applied, coalesced, stale and of unknown devices.
+    """
+    counts = {"applied": 0, "coalesced": 0, "stale": 0, "unknown": 0}
+    if not readings:
+        return counts
+
+    devices = {
+        device.id: device
+        for device in session.exec(select(Device).where(Device.id.in_({reading.device_id for reading in readings}))).all()
+    }
+
+    state = sites.state_of(session)
+    events: list[EventCreate] = []
+    rule_events: list[EventCreate] = []
+    batteries = []
+    touched = {}
+
+    for reading in sorted(readings, key=lambda reading: reading.timestamp):
+        device = devices.get(reading.device_id)
+        if device is None:
+            counts["unknown"] += 1
+            continue
+
+        touched[device.id] = device
+        device.last_seen = max(device.last_seen, reading.last_seen or reading.timestamp)
+
+        if reading.timestamp < device.last_updated:
+            if _apply_stale_reading(session=session, device=device, reading=reading, events=events):
+                counts["stale"] += 1
+            else:
+                counts["coalesced"] += 1
+            continue
+
+        if device.status == reading.status and (reading.battery is None or reading.battery == device.battery):
+            counts["coalesced"] += 1
+            continue
+
+        counts["applied"] += 1
+
+        previous_status = device.status
+        device.status = reading.status
+        device.last_updated = reading.timestamp
+        if reading.battery is not None:
+            device.battery = reading.battery
+            _append_battery_reading(session=session, device_id=device.id, battery=reading.battery, at=reading.timestamp)
+            batteries.append((device.id, reading.timestamp, reading.battery))
+
+        _record_state(session=session, device=device, at=reading.timestamp)
+        events.append(EventCreate(
+            device_id=device.id,
+            type=EventType.STATUS_CHANGE,
+            old_status=previous_status,
+            new_status=reading.status,
+            battery=reading.battery,
+            timestamp=reading.timestamp,
+        ))
+        if reading.battery is not None and reading.battery < 10:
+            events.append(EventCreate(device_id=device.id, type=EventType.BATTERY_LOW, battery=reading.battery, timestamp=reading.timestamp))
+
+        rule_events.extend(state.rules.on_reading(device, previous_status, now=reading.timestamp))
+
+    session.add_all(touched.values())
+    if events:
+        # Commits the device changes with the events
+        create_events(session=session, events=events)
+    else:
+        _commit(session, "apply_readings")
+
+    for device in touched.values():
+        state.summary.upsert(device)
+    state.device_changes.record_many(touched)
+    for device_id, timestamp, battery in batteries:
+        state.batteries.add(device_id, timestamp, battery)
+
+    write_rule_events(session=session, events=rule_events)
+
+    return counts
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
 def delete_device(*, session: Session, device_id: uuid.UUID) -> bool:
     """
         Deletes device
@@ -40,16 +216,28 @@ def delete_device(*, session: Session, device_id: uuid.UUID) -> bool:
         return False
     
     session.delete(device)
-    session.commit()
+    session.exec(delete(DeviceKey).where(DeviceKey.device_id == device_id))
+    device_key = get_device_key(session=session, device_id=device_id)
+    session.add(DeviceState(device_key=device_key, valid_from=datetime.now()))
+    if search.enabled(session.get_bind()):
+        search.remove_device(session.connection(), device_key)
+    _commit(session, "delete_device")
+    authenticator.remove_device_keys(device_id)
+    state = sites.state_of(session)
+    state.summary.remove(device_id)
+    state.batteries.remove(device_id)
+    state.device_changes.record(device_id, deleted=True)
     
     return True
 
+@timed(DB_QUERY_SECONDS, phase_name="db")
 def check_offline_devices(*, session: Session, timeout_minutes: int = 10) -> List[Device]:
     """
         Mark devices offline if not seen recently.
         Returns a list of devices marked offline
     """
-    cutoff = datetime.now() - timedelta(minutes=timeout_minutes)
+    now = datetime.now()
+    cutoff = now - timedelta(minutes=timeout_minutes)
     offline_devices = session.exec(
         select(Device).where(
             Device.last_seen < cutoff,
@@ -57,24 +245,38 @@ def check_offline_devices(*, session: Session, timeout_minutes: int = 10) -> Lis
         )
     ).all()
 
+    previous_statuses = {device.id: device.status for device in offline_devices}
+
     for device in offline_devices:
         device.status = DeviceStatus.OFFLINE
         session.add(device)
+        _record_state(session=session, device=device, at=now)
 
         create_event(
             session=session,
             event=EventCreate(
                 device_id=device.id,
                 type = EventType.DEVICE_OFFLINE,
-                details=f"{device.name} has gone offline"
+                old_status=previous_statuses[device.id],
+                new_status=DeviceStatus.OFFLINE,
+                details=f"{device.name} has gone offline",
             ),
         )
     
     if offline_devices:
-        session.commit()
+        _commit(session, "check_offline_devices")
+
+    state = sites.state_of(session)
+    if offline_devices:
+        state.device_changes.record_many(device.id for device in offline_devices)
+
+    for device in offline_devices:
+        state.summary.upsert(device)
+        write_rule_events(session=session, events=state.rules.on_reading(device, previous_statuses[device.id]))
 
     return offline_devices
 
+@timed(DB_QUERY_SECONDS, phase_name="db")
 def create_device(*, session: Session, device: DeviceCreate) -> Device:
     device_data = device.model_dump(exclude_unset=True)
 
@@ -83,21 +285,929 @@ def create_device(*, session: Session, device: DeviceCreate) -> Device:
 
     db_obj = Device(**device_data)
     
+    db_obj.site_id = sites.site_of(session)
     db_obj.last_seen = datetime.now()
     
     session.add(db_obj)
-    session.commit()
+    _record_state(session=session, device=db_obj, at=db_obj.last_seen)
+    _index_device(session=session, device=db_obj)
+    _commit(session, "create_device")
     session.refresh(db_obj)
 
+    state = sites.state_of(session)
+    state.summary.upsert(db_obj)
+    state.device_changes.record(db_obj.id)
+
     return db_obj
 
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def create_devices(*, session: Session, devices: List[DeviceCreate]) -> List[Device]:
+    """
+        Insert many devices with one executemany and one commit.
+        The returned devices are not attached to the session.
+    """
+    now = datetime.now()
+    site_id = sites.site_of(session)
+    db_objs = []
+
+    for device in devices:
+        device_data = device.model_dump(exclude_unset=True)
+        if device_data.get("status") is None:
+            device_data["status"] = DeviceStatus.CLOSED
+
+        db_obj = Device(**device_data)
+        db_obj.site_id = site_id
+        db_obj.last_seen = now
+        db_objs.append(db_obj)
+
+    if not db_objs:
+        return []
+
+    session.exec(insert(Device), params=[db_obj.model_dump() for db_obj in db_objs])
+    keys = _record_states(session=session, devices=db_objs, at=now)
+    if search.enabled(session.get_bind()):
+        search.index_devices(session.connection(), [_device_search_row(keys[db_obj.id], db_obj) for db_obj in db_objs])
+    _commit(session, "create_devices")
+
+    state = sites.state(site_id)
+    for db_obj in db_objs:
+        state.summary.upsert(db_obj)
+    state.device_changes.record_many(db_obj.id for db_obj in db_objs)
+
+    return db_objs
+
+DEVICE_EXPORT_COLUMNS = ["id", "name", "type", "location", "status", "battery", "last_updated", "last_seen", "site_id"]
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def get_device_rows(*, session: Session, device_ids: List[uuid.UUID] | None = None) -> List[dict]:
+    """
+        Devices as plain dicts with the DevicePublic fields, without building ORM objects.
+        All devices unless device_ids is given.
+    """
+    columns = [getattr(Device, name) for name in DEVICE_EXPORT_COLUMNS]
+    statement = select(*columns)
+
+    if device_ids is not None:
+        if not device_ids:
+            return []
+        statement = statement.where(Device.id.in_(device_ids))
+
+    rows = session.exec(statement).all()
+
+    return [dict(zip(DEVICE_EXPORT_COLUMNS, row)) for row in rows]
+
+def iter_devices(*, session: Session, batch_size: int = 1000) -> Iterator[List[dict]]:
+    """
+        Stream every device as plain dicts, batch_size rows at a time
+    """
+    columns = [getattr(Device, name) for name in DEVICE_EXPORT_COLUMNS]
+    result = session.exec(select(*columns).order_by(Device.name).execution_options(yield_per=batch_size))
+
+    for partition in result.partitions():
+        yield [dict(zip(DEVICE_EXPORT_COLUMNS, row)) for row in partition]
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
 def get_events(*, session: Session, limit) -> List[Event]:
     return session.exec(select(Event).order_by(Event.timestamp).limit(limit=limit)).all()
 
+EVENT_EXPORT_COLUMNS = ["id", "timestamp", "device_id", "type", "details", "site_id"]
+
+_EVENT_ROW_COLUMNS = (
+    Event.seq, Event.uid, Event.timestamp, DeviceRef.device_id, Event.type,
+    Event.new_status, Event.battery, Event.note, DeviceRef.site_id,
+)
+
+def _event_row(seq, uid, timestamp, device_id, event_type, new_status, battery, note, site_id) -> dict:
+    return {
+        "id": event_id(seq, uid),
+        "timestamp": timestamp,
+        "device_id": device_id,
+        "type": event_type,
+        "details": render_event_details(event_type, new_status, battery, note),
+        "site_id": site_id,
+    }
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def get_event_rows(*, session: Session, limit) -> List[dict]:
+    """
+        Same events as get_events as plain dicts with the EventPublic fields
+    """
+    statement = select(*_EVENT_ROW_COLUMNS).join(DeviceRef).order_by(Event.timestamp).limit(limit)
+
+    return [_event_row(*row) for row in session.exec(statement)]
+
+def iter_events(
+    *,
+    session: Session,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    device_id: uuid.UUID | None = None,
+    event_type: EventType | None = None,
+    batch_size: int = 1000,
+) -> Iterator[List[dict]]:
+    """
+        Stream events in time order as plain dicts, batch_size rows at a time.
+        Rows are fetched from the cursor as they are consumed so memory stays flat.
+    """
+    statement = select(*_EVENT_ROW_COLUMNS).join(DeviceRef).order_by(Event.timestamp)
+
+    if start is not None:
+        statement = statement.where(Event.timestamp >= start)
+    if end is not None:
+        statement = statement.where(Event.timestamp < end)
+    if device_id is not None:
+        statement = statement.where(DeviceRef.device_id == device_id)
+    if event_type is not None:
+        statement = statement.where(Event.type == event_type)
+
+    result = session.exec(statement.execution_options(yield_per=batch_size))
+
+    for partition in result.partitions():
+        yield [_event_row(*row) for row in partition]
+
+#==========================================
+def _record_state(*, session: Session, device: Device, at: datetime) -> None:
+    """
+        Add a state history row for the current status and battery of a device,
+        committed together with the device change
+    """
+    session.add(DeviceState(
+        device_key=get_device_key(session=session, device_id=device.id),
+        valid_from=at,
+        status=device.status,
+        battery=device.battery,
+    ))
+
+def _record_states(*, session: Session, devices: List[Device], at: datetime) -> dict[uuid.UUID, int]:
+    """
+        _record_state for many new devices: their references are inserted
+        and read back with one statement each instead of one flush per device.
+        Returns the device keys.
+    """
+    site_id = sites.site_of(session)
+    session.exec(insert(DeviceRef), params=[{"device_id": device.id, "site_id": site_id} for device in devices])
+
+    keys = {}
+    device_ids = [device.id for device in devices]
+    for start in range(0, len(device_ids), 500):
+        chunk = device_ids[start:start + 500]
+        keys.update(session.exec(select(DeviceRef.device_id, DeviceRef.key).where(DeviceRef.device_id.in_(chunk))).all())
+
+    session.exec(insert(DeviceState), params=[
+        {"device_key": keys[device.id], "valid_from": at, "status": device.status, "battery": device.battery}
+        for device in devices
+    ])
+
+    return keys
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def get_device_states_at(*, session: Session, at: datetime) -> List[dict]:
+    """
+        Status and battery of every device that existed at `at`, with the time it
+        got into that state. One grouped pass over (device_key, valid_from).
+    """
+    latest = (
+        select(DeviceState.device_key, func.max(DeviceState.valid_from).label("valid_from"))
+        .where(DeviceState.valid_from <= at)
+        .group_by(DeviceState.device_key)
+        .subquery()
+    )
+
+    statement = (
+        select(DeviceRef.device_id, DeviceState.status, DeviceState.battery, DeviceState.valid_from)
+        .join(latest, (DeviceState.device_key == latest.c.device_key) & (DeviceState.valid_from == latest.c.valid_from))
+        .join(DeviceRef, DeviceRef.key == DeviceState.device_key)
+        .order_by(DeviceState.seq)
+    )
+
+    # The last row wins when a device changed twice within the same microsecond
+    states = {}
+    for device_id, status, battery, valid_from in session.exec(statement):
+        states[device_id] = {"device_id": device_id, "status": status, "battery": battery, "since": valid_from}
+
+    return [state for state in states.values() if state["status"] is not None]
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def get_time_in_status(*, session: Session, status: DeviceStatus, start: datetime, end: datetime) -> List[dict]:
+    """
+        Seconds each device spent in `status` between start and end: the states
+        at `start`, then one ordered pass over the changes inside the range
+    """
+    # device_id -> [current status, since, seconds, entered]
+    totals = {
+        state["device_id"]: [state["status"], start, 0.0, 0]
+        for state in get_device_states_at(session=session, at=start)
+    }
+
+    changes = session.exec(
+        select(DeviceRef.device_id, DeviceState.status, DeviceState.valid_from)
+        .join(DeviceRef, DeviceRef.key == DeviceState.device_key)
+        .where(DeviceState.valid_from > start, DeviceState.valid_from < end)
+        .order_by(DeviceState.valid_from, DeviceState.seq)
+    )
+
+    for device_id, new_status, valid_from in changes:
+        total = totals.setdefault(device_id, [None, start, 0.0, 0])
+
+        if total[0] == status:
+            total[2] += (valid_from - total[1]).total_seconds()
+        elif new_status == status:
+            total[3] += 1
+
+        total[0] = new_status
+        total[1] = valid_from
+
+    results = []
+    for device_id, (current, since, seconds, entered) in totals.items():
+        if current == status:
+            seconds += (end - since).total_seconds()
+
+        results.append({"device_id": device_id, "status": status, "seconds": seconds, "entered": entered})
+
+    return results
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def backfill_device_states(*, session: Session) -> int:
+    """
+        Start the state history of devices that have none (created before it existed)
+        from their current state at their last update. Returns the number of devices.
+    """
+    has_history = select(DeviceState.seq).join(DeviceRef, DeviceRef.key == DeviceState.device_key).where(DeviceRef.device_id == Device.id)
+    devices = session.exec(select(Device).where(~has_history.exists())).all()
+
+    for device in devices:
+        _record_state(session=session, device=device, at=device.last_updated)
+
+    if devices:
+        _commit(session, "backfill_device_states")
+
+    return len(devices)
+
+#==========================================
+def _append_battery_reading(*, session: Session, device_id: uuid.UUID, battery: int, at: datetime) -> None:
+    """
+        Append a reading to the newest battery chunk of a device, or start a new
+        chunk when it is full. Timestamps after the first are kept to the second.
+    """
+    device_key = get_device_key(session=session, device_id=device_id)
+
+    chunk = session.exec(
+        select(BatteryChunk)
+        .where(BatteryChunk.device_key == device_key)
+        .order_by(BatteryChunk.start.desc())
+        .limit(1)
+    ).first()
+
+    if chunk is None or chunk.count >= settings.BATTERY_CHUNK_SIZE or at < chunk.end:
+        session.add(BatteryChunk(device_key=device_key, start=at, end=at, first_value=battery, last_value=battery))
+        return
+
+    seconds = round((at - chunk.end).total_seconds())
+
+    chunk.time_deltas += encode_varints([seconds])
+    chunk.value_deltas += encode_varints([battery - chunk.last_value], signed=True)
+    chunk.end += timedelta(seconds=seconds)
+    chunk.last_value = battery
+    chunk.count += 1
+    session.add(chunk)
+
+def _decode(chunk: BatteryChunk) -> list[tuple[datetime, int]]:
+    return decode_chunk(chunk.start, chunk.first_value, chunk.time_deltas, chunk.value_deltas)
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def get_battery_readings(
+    *,
+    session: Session,
+    device_id: uuid.UUID,
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> List[tuple[datetime, int]]:
+    """
+        Battery readings of a device between start and end, oldest first
+    """
+    statement = (
+        select(BatteryChunk)
+        .join(DeviceRef, DeviceRef.key == BatteryChunk.device_key)
+        .where(DeviceRef.device_id == device_id)
+        .order_by(BatteryChunk.start)
+    )
+    if start is not None:
+        statement = statement.where(BatteryChunk.end >= start)
+    if end is not None:
+        statement = statement.where(BatteryChunk.start <= end)
+
+    # Late readings forwarded by gateways start chunks of their own that may overlap others
+    readings = [
+        (timestamp, value)
+        for chunk in session.exec(statement)
+        for timestamp, value in _decode(chunk)
+        if (start is None or timestamp >= start) and (end is None or timestamp <= end)
+    ]
+    return sorted(readings, key=lambda reading: reading[0])
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def load_battery_trends(*, session: Session, since: datetime) -> int:
+    """
+        Rebuild the drain rates of a site from the chunks that have readings after `since`,
+        devices that already reported since startup keep their live trend.
+        Returns the number of readings.
+    """
+    batteries = BatteryTrends()
+
+    chunks = session.exec(
+        select(DeviceRef.device_id, BatteryChunk)
+        .join(DeviceRef, DeviceRef.key == BatteryChunk.device_key)
+        .where(BatteryChunk.end >= since)
+        .order_by(BatteryChunk.device_key, BatteryChunk.start)
+        .execution_options(yield_per=500)
+    )
+
+    loaded = 0
+    for device_id, chunk in chunks:
+        for timestamp, value in _decode(chunk):
+            if timestamp >= since:
+                batteries.add(device_id, timestamp, value)
+                loaded += 1
+
+    sites.state_of(session).batteries.merge(batteries)
+    return loaded
+
+#==========================================
+def _device_search_row(key: int, device: Device) -> dict:
+    return {"key": key, "name": device.name, "location": device.location, "type": device.type}
+
+def _event_search_row(seq: int, event_type: EventType, details: str, labels: tuple[str, str, str] | None) -> dict:
+    # The type is indexed as words too, so "offline" finds device_offline events
+    return {
+        "seq": seq,
+        "details": f"{details} {EventType(event_type).value.replace('_', ' ')}",
+        "device": " ".join(labels) if labels else "",
+    }
+
+def _index_device(*, session: Session, device: Device) -> None:
+    if search.enabled(session.get_bind()):
+        key = get_device_key(session=session, device_id=device.id)
+        search.index_devices(session.connection(), [_device_search_row(key, device)])
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def search_devices(*, session: Session, query: str, device_type: str | None = None, limit: int = 50) -> List[dict]:
+    """
+        Devices whose name, location or type contain every word of the query as a prefix,
+        best matches first. Uses the FTS index when the database has one, LIKE otherwise.
+    """
+    expression = search.match_expression(query)
+    if expression is None:
+        return []
+
+    columns = [getattr(Device, name) for name in DEVICE_EXPORT_COLUMNS]
+
+    if search.enabled(session.get_bind()):
+        statement = (
+            select(*columns)
+            .join(DeviceRef, DeviceRef.device_id == Device.id)
+            .join(search.device_fts, search.device_fts.c.rowid == DeviceRef.key)
+            .where(search.device_match(expression))
+            .order_by(search.device_fts.c.rank)
+        )
+    else:
+        statement = select(*columns).order_by(Device.name)
+        for word in search.words(query):
+            pattern = f"%{word}%"
+            statement = statement.where(Device.name.ilike(pattern) | Device.location.ilike(pattern) | Device.type.ilike(pattern))
+
+    if device_type is not None:
+        statement = statement.where(Device.type == device_type)
+
+    rows = session.exec(statement.limit(limit)).all()
+
+    return [dict(zip(DEVICE_EXPORT_COLUMNS, row)) for row in rows]
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def search_events(
+    *,
+    session: Session,
+    query: str,
+    event_type: EventType | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    limit: int = 100,
+) -> List[dict]:
+    """
+        Events whose details, type or device (name, location, type) contain every word
+        of the query as a prefix, newest first
+    """
+    expression = search.match_expression(query)
+    if expression is None:
+        return []
+
+    statement = select(*_EVENT_ROW_COLUMNS).join(DeviceRef)
+
+    if search.enabled(session.get_bind()):
+        statement = statement.where(Event.seq.in_(select(search.event_fts.c.rowid).where(search.event_match(expression))))
+    else:
+        for word in search.words(query):
+            pattern = f"%{word}%"
+            devices = select(Device.id).where(Device.name.ilike(pattern) | Device.location.ilike(pattern) | Device.type.ilike(pattern))
+            types = [event_type for event_type in EventType if word in event_type.value]
+            statement = statement.where(Event.note.ilike(pattern) | DeviceRef.device_id.in_(devices) | Event.type.in_(types))
+
+    if event_type is not None:
+        statement = statement.where(Event.type == event_type)
+    if start is not None:
+        statement = statement.where(Event.timestamp >= start)
+    if end is not None:
+        statement = statement.where(Event.timestamp < end)
+
+    rows = session.exec(statement.order_by(Event.timestamp.desc()).limit(limit)).all()
+
+    return [_event_row(*row) for row in rows]
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def backfill_search_index(*, session: Session, batch_size: int = 1000) -> int:
+    """
+        Index existing devices and events when the search index is empty
+        (first start with search). Returns the number of rows indexed.
+    """
+    if not search.enabled(session.get_bind()) or not search.is_empty(session.connection()):
+        return 0
+
+    devices = session.exec(select(Device)).all()
+    labels = {}
+    for device in devices:
+        labels[device.id] = (device.name, device.location, device.type)
+    search.index_devices(session.connection(), [
+        _device_search_row(get_device_key(session=session, device_id=device.id), device) for device in devices
+    ])
+
+    indexed = len(devices)
+    events = session.exec(
+        select(Event.seq, Event.type, Event.new_status, Event.battery, Event.note, DeviceRef.device_id)
+        .join(DeviceRef)
+        .execution_options(yield_per=batch_size)
+    )
+    for partition in events.partitions():
+        search.index_events(session.connection(), [
+            _event_search_row(seq, event_type, render_event_details(event_type, new_status, battery, note), labels.get(device_id))
+            for seq, event_type, new_status, battery, note, device_id in partition
+        ])
+        indexed += len(partition)
+
+    _commit(session, "backfill_search_index")
+    return indexed
+
+# Device keys per engine, only keys read back from the database are cached
+_device_keys: "weakref.WeakKeyDictionary[Any, dict[uuid.UUID, int]]" = weakref.WeakKeyDictionary()
+
+def get_device_key(*, session: Session, device_id: uuid.UUID) -> int:
+    """
+        Integer key events use to reference a device, created on first use
+    """
+    keys = _device_keys.setdefault(session.get_bind(), {})
+
+    key = keys.get(device_id)
+    if key is not None:
+        return key
+
+    ref = session.exec(select(DeviceRef).where(DeviceRef.device_id == device_id)).first()
+    if ref is not None:
+        keys[device_id] = ref.key
+        return ref.key
+
+    ref = DeviceRef(device_id=device_id, site_id=sites.site_of(session))
+    session.add(ref)
+    session.flush()
+
+    return ref.key
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
 def create_event(*, session: Session, event: EventCreate) -> Event:
-    db_obj = Event.model_validate(event)
+    db_obj = Event(
+        device_key=get_device_key(session=session, device_id=event.device_id),
+        type=event.type,
+        old_status=event.old_status,
+        new_status=event.new_status,
+        battery=event.battery,
+    )
+    if event.timestamp is not None:
+        db_obj.timestamp = event.timestamp
+
+    # Only keep the text when it says more than the structured fields
+    if event.details is not None and event.details != db_obj.details_from_fields():
+        db_obj.note = event.details
+
+    session.add(db_obj)
+
+    # Counted in the same transaction as the event row
+    _increment_rollups(session=session, device_id=event.device_id, event_type=event.type, timestamp=db_obj.timestamp)
+
+    if search.enabled(session.get_bind()):
+        session.flush()
+        labels = sites.state_of(session).summary.labels_of(event.device_id)
+        if labels is None:
+            device = session.get(Device, event.device_id)
+            labels = (device.name, device.location, device.type) if device is not None else None
+        search.index_events(session.connection(), [_event_search_row(db_obj.seq, db_obj.type, db_obj.details, labels)])
+
+    _commit(session, "create_event")
+    session.refresh(db_obj)
+
+    EVENTS_WRITTEN.labels(db_obj.type.value).inc()
+    sites.state_of(session).event_changes.record()
+    notifier.notify_event(db_obj)
+
+    return db_obj
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def create_events(*, session: Session, events: List[EventCreate]) -> int:
+    """
+        Insert many events with one bulk insert (COPY on PostgreSQL) and one commit.
+        Rollups are counted once per device, type and minute instead of once per event.
+        The events are not read back, returns how many were written.
+    """
+    if not events:
+        return 0
+
+    now = datetime.now()
+    db_objs = []
+    device_ids = []
+    minutes: Counter = Counter()
+
+    for event in events:
+        db_obj = Event(
+            device_key=get_device_key(session=session, device_id=event.device_id),
+            type=event.type,
+            timestamp=event.timestamp or now,
+            old_status=event.old_status,
+            new_status=event.new_status,
+            battery=event.battery,
+        )
+        if event.details is not None and event.details != db_obj.details_from_fields():
+            db_obj.note = event.details
+
+        db_objs.append(db_obj)
+        device_ids.append(event.device_id)
+        minutes[(event.device_id, db_obj.type, rollup_bucket(db_obj.timestamp, RollupResolution.MINUTE))] += 1
+
+    rows = [db_obj.model_dump(exclude={"seq"}) for db_obj in db_objs]
+
+    if search.enabled(session.get_bind()):
+        # Keys are needed for the index, SQLite returns them from the same executemany
+        seqs = session.connection().execute(insert(Event).returning(Event.seq, sort_by_parameter_order=True), rows).scalars().all()
+
+        summary = sites.state_of(session).summary
+        search.index_events(session.connection(), [
+            _event_search_row(seq, db_obj.type, db_obj.details, summary.labels_of(device_id))
+            for seq, db_obj, device_id in zip(seqs, db_objs, device_ids)
+        ])
+    else:
+        backend_of(session.get_bind()).bulk_insert(session.connection(), Event.__table__, rows)
+
+    for (device_id, event_type, minute), amount in minutes.items():
+        _increment_rollups(session=session, device_id=device_id, event_type=event_type, timestamp=minute, amount=amount)
+
+    _commit(session, "create_events")
+
+    for event_type, amount in Counter(db_obj.type for db_obj in db_objs).items():
+        EVENTS_WRITTEN.labels(EventType(event_type).value).inc(amount)
+    sites.state_of(session).event_changes.record()
+    for db_obj, device_id in zip(db_objs, device_ids):
+        notifier.notify_event(db_obj, device_id=device_id)
+
+    return len(db_objs)
+
+
+#==========================================
+def rollup_bucket(timestamp: datetime, resolution: RollupResolution) -> datetime:
+    """
+        Truncate a timestamp to the start of its bucket
+    """
+    if resolution == RollupResolution.MINUTE:
+        return timestamp.replace(second=0, microsecond=0)
+    if resolution == RollupResolution.HOUR:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _increment_rollups(
+    *,
+    session: Session,
+    device_id: uuid.UUID,
+    event_type: EventType,
+    timestamp: datetime,
+    amount: int = 1,
+) -> None:
+    device = session.get(Device, device_id)
+    location = device.location if device else "unknown"
+
+    rows = [
+        {
+            "resolution": resolution,
+            "bucket": rollup_bucket(timestamp, resolution),
+            "device_id": device_id,
+            "type": EventType(event_type),
+            "location": location,
+            "count": amount,
+        }
+        for resolution in RollupResolution
+    ]
+
+    statement = backend_of(session.get_bind()).upsert(EventRollup).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=["resolution", "bucket", "device_id", "type"],
+        set_={"count": EventRollup.count + statement.excluded.count},
+    )
+    session.exec(statement)
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def get_event_rollups(
+    *,
+    session: Session,
+    resolution: RollupResolution,
+    group_by: RollupGroup,
+    start: datetime,
+    end: datetime,
+    device_id: uuid.UUID | None = None,
+    event_type: EventType | None = None,
+    location: str | None = None,
+) -> list[tuple[datetime, Any, int]]:
+    """
+        Event counts per bucket in [start, end) grouped by device, type or location
+    """
+    key = {
+        RollupGroup.DEVICE: EventRollup.device_id,
+        RollupGroup.TYPE: EventRollup.type,
+        RollupGroup.LOCATION: EventRollup.location,
+    }[group_by]
+
+    statement = (
+        select(EventRollup.bucket, key, func.sum(EventRollup.count))
+        .where(
+            EventRollup.resolution == resolution,
+            EventRollup.bucket >= rollup_bucket(start, resolution),
+            EventRollup.bucket < end,
+        )
+        .group_by(EventRollup.bucket, key)
+        .order_by(EventRollup.bucket)
+    )
+
+    if device_id is not None:
+        statement = statement.where(EventRollup.device_id == device_id)
+    if event_type is not None:
+        statement = statement.where(EventRollup.type == event_type)
+    if location is not None:
+        statement = statement.where(EventRollup.location == location)
+
+    return session.exec(statement).all()
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def prune_event_rollups(*, session: Session, resolution: RollupResolution, older_than: datetime) -> int:
+    """
+        Delete fine grained rollups that charts no longer ask for
+    """
+    result = session.exec(
+        delete(EventRollup).where(
+            EventRollup.resolution == resolution,
+            EventRollup.bucket < rollup_bucket(older_than, resolution),
+        )
+    )
+    _commit(session, "prune_event_rollups")
+
+    return result.rowcount
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def backfill_event_rollups(*, session: Session, batch_size: int = 1000) -> int:
+    """
+        Build rollups from raw events when the rollup table is empty
+        (first start after upgrading). Returns the number of events counted.
+    """
+    if session.exec(select(EventRollup).limit(1)).first() is not None:
+        return 0
+
+    backend = backend_of(session.get_bind())
+    counted = 0
+
+    # One aggregate per resolution, the table is empty so the rows are plain inserts
+    for resolution in RollupResolution:
+        bucket = backend.time_bucket(Event.timestamp, resolution.value)
+        statement = (
+            select(bucket, DeviceRef.device_id, Event.type, Device.location, func.count())
+            .join(DeviceRef, DeviceRef.key == Event.device_key)
+            .outerjoin(Device, Device.id == DeviceRef.device_id)
+            .group_by(bucket, DeviceRef.device_id, Event.type, Device.location)
+        )
+        rows = [
+            {
+                "resolution": resolution,
+                "bucket": bucket,
+                "device_id": device_id,
+                "type": event_type,
+                "location": location if location is not None else "unknown",
+                "count": count,
+            }
+            for bucket, device_id, event_type, location, count in session.exec(statement)
+        ]
+
+        for start in range(0, len(rows), batch_size):
+            session.exec(insert(EventRollup), params=rows[start:start + batch_size])
+
+        if resolution == RollupResolution.MINUTE:
+            counted = sum(row["count"] for row in rows)
+
+    if counted:
+        _commit(session, "backfill_event_rollups")
+
+    return counted
+
+
+#==========================================
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def write_rule_events(*, session: Session, events: List[EventCreate]) -> List[Event]:
+    """
+        Store events emitted by the rule engine and queue them for broadcasting
+    """
+    outbox = sites.state_of(session).rules.outbox
+
+    written = []
+    for event in events:
+        db_event = create_event(session=session, event=event)
+        outbox.append(EventPublic.model_validate(db_event).model_dump(mode="json"))
+        written.append(db_event)
+
+    return written
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def get_rules(*, session: Session) -> List[AlarmRule]:
+    return session.exec(select(AlarmRule)).all()
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def create_rule(*, session: Session, rule: AlarmRuleCreate) -> AlarmRule:
+    """
+        Store a rule and start evaluating it.
+        Raises ValueError if the rule is missing the fields its kind needs.
+    """
+    db_obj = AlarmRule.model_validate(rule)
+    # Compiling validates the rule before anything is written
+    CompiledRule(db_obj)
+
+    session.add(db_obj)
+    _commit(session, "create_rule")
+    session.refresh(db_obj)
+
+    sites.state_of(session).rules.add(db_obj)
+
+    return db_obj
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def delete_rule(*, session: Session, rule_id: uuid.UUID) -> bool:
+    rule = session.get(AlarmRule, rule_id)
+
+    if rule is None:
+        return False
+
+    session.delete(rule)
+    _commit(session, "delete_rule")
+    sites.state_of(session).rules.remove(rule_id)
+
+    return True
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def get_armed_locations(*, session: Session) -> List[str]:
+    return session.exec(select(ArmedLocation.location)).all()
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def arm_location(*, session: Session, location: str | None = None) -> List[str]:
+    """
+        Arm one location or everything, returns the armed locations
+    """
+    location = location or ALL_LOCATIONS
+
+    if session.get(ArmedLocation, location) is None:
+        session.add(ArmedLocation(location=location))
+        _commit(session, "arm_location")
+
+    rule_engine = sites.state_of(session).rules
+    rule_engine.arm(location)
+
+    return sorted(rule_engine.armed)
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def disarm_location(*, session: Session, location: str | None = None) -> List[str]:
+    """
+        Disarm one location or everything, returns the armed locations
+    """
+    statement = delete(ArmedLocation)
+    if location is not None:
+        statement = statement.where(ArmedLocation.location == location)
+
+    session.exec(statement)
+    _commit(session, "disarm_location")
+
+    rule_engine = sites.state_of(session).rules
+    rule_engine.disarm(location)
+
+    return sorted(rule_engine.armed)
+
+#==========================================
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def create_user(*, session: Session, user: UserCreate) -> User:
+    db_obj = User.model_validate(user, update={"hashed_password": hash_password(user.password)})
+
     session.add(db_obj)
-    session.commit()
+    _commit(session, "create_user")
     session.refresh(db_obj)
 
     return db_obj
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def get_user_by_id(*, session: Session, user_id: uuid.UUID) -> User | None:
+    return session.get(User, user_id)
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def get_user_by_email(*, session: Session, email: str) -> User | None:
+    return session.exec(select(User).where(User.email == email)).first()
+
+def count_users(*, session: Session) -> int:
+    return session.exec(select(func.count()).select_from(User)).one()
+
+def authenticate_user(*, session: Session, email: str, password: str) -> User | None:
+    user = get_user_by_email(session=session, email=email)
+
+    if user is None or not verify_password(password, user.hashed_password):
+        return None
+
+    return user
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def revoke_token(*, session: Session, token_id: str, expires_at: datetime) -> None:
+    session.merge(RevokedToken(jti=token_id, expires_at=expires_at))
+    _commit(session, "revoke_token")
+
+    authenticator.revoke_token(token_id, expires_at.timestamp())
+
+def get_revoked_tokens(*, session: Session) -> List[tuple[str, float]]:
+    """
+        Revoked token ids that have not expired yet, expired ones are deleted
+    """
+    now = datetime.now()
+    session.exec(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+    _commit(session, "prune_revoked_tokens")
+
+    rows = session.exec(select(RevokedToken.jti, RevokedToken.expires_at)).all()
+    return [(jti, expires_at.timestamp()) for jti, expires_at in rows]
+
+#==========================================
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def create_device_key(*, session: Session, device_id: uuid.UUID) -> tuple[DeviceKey, str]:
+    """
+        New API key for a device. The key itself is only returned here, the database keeps its digest.
+    """
+    key, digest = authenticator.new_device_key()
+    db_obj = DeviceKey(digest=digest, device_id=device_id)
+
+    session.add(db_obj)
+    _commit(session, "create_device_key")
+    session.refresh(db_obj)
+
+    authenticator.add_device_key(digest, device_id)
+
+    return db_obj, key
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def delete_device_keys(*, session: Session, device_id: uuid.UUID) -> int:
+    result = session.exec(delete(DeviceKey).where(DeviceKey.device_id == device_id))
+    _commit(session, "delete_device_keys")
+
+    authenticator.remove_device_keys(device_id)
+
+    return result.rowcount
+
+def get_device_keys(*, session: Session) -> List[tuple[str, uuid.UUID]]:
+    return session.exec(select(DeviceKey.digest, DeviceKey.device_id)).all()
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def create_gateway_key(*, session: Session) -> tuple[GatewayKey, str]:
+    """
+        New API key for the edge gateways of the session's site, only its digest is stored
+    """
+    key, digest = authenticator.new_gateway_key()
+    db_obj = GatewayKey(digest=digest)
+
+    session.add(db_obj)
+    _commit(session, "create_gateway_key")
+    session.refresh(db_obj)
+
+    authenticator.add_gateway_key(digest, sites.site_of(session))
+
+    return db_obj, key
+
+@timed(DB_QUERY_SECONDS, phase_name="db")
+def delete_gateway_keys(*, session: Session) -> int:
+    result = session.exec(delete(GatewayKey))
+    _commit(session, "delete_gateway_keys")
+
+    authenticator.remove_gateway_keys(sites.site_of(session))
+
+    return result.rowcount
+
+def get_gateway_keys(*, session: Session) -> List[str]:
+    return session.exec(select(GatewayKey.digest)).all()
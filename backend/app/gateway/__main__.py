@@ -0,0 +1,7 @@
+from backend.app.core.config import configure_logging, settings
+
+import uvicorn
+
+# python -m backend.app.gateway
+configure_logging(settings.GATEWAY_LOG_FILENAME)
+uvicorn.run("backend.app.gateway.main:app", host=settings.GATEWAY_HOST, port=settings.GATEWAY_PORT)
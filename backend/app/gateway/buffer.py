@@ -0,0 +1,147 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+from backend.app.core.metrics import GATEWAY_DROPPED
+
+import os
+import sqlite3
+import threading
+import uuid
+
+@dataclass
+class QueuedReading:
+    seq: int
+    device_id: uuid.UUID
+    status: str
+    battery: int | None
+    timestamp: datetime
+    last_seen: datetime
+
+    def as_dict(self) -> dict:
+        return {
+            "device_id": self.device_id,
+            "status": self.status,
+            "battery": self.battery,
+            "timestamp": self.timestamp,
+            "last_seen": self.last_seen,
+        }
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reading (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    battery INTEGER,
+    timestamp TEXT NOT NULL,
+    last_seen TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_reading_device_id_seq ON reading (device_id, seq);
+"""
+
+class ReadingQueue:
+    """
+        Readings waiting to be forwarded, in a SQLite file so they survive restarts
+        and outages. A reading equal to the device's newest queued one only moves
+        that one's last_seen, so a device repeating its state costs one row. Past
+        `size` rows the oldest reading that a newer one of the same device
+        supersedes is dropped (the oldest reading when there is none), so the
+        latest state of every device is kept.
+    """
+    def __init__(self, path: str, size: int):
+        self.size = size
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Survives a crash of the gateway, a power loss may lose the last writes
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+        self._count = self._db.execute("SELECT count(*) FROM reading").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def put(self, device_id: uuid.UUID, status: str, battery: int | None, timestamp: datetime) -> bool:
+        """
+            Queue a reading, returns True when it was coalesced into the previous one
+        """
+        key = str(device_id)
+        at = timestamp.isoformat()
+
+        with self._lock:
+            last = self._db.execute(
+                "SELECT seq, status, battery FROM reading WHERE device_id = ? ORDER BY seq DESC LIMIT 1", (key,)
+            ).fetchone()
+
+            if last is not None and last[1] == status and (battery is None or last[2] == battery):
+                self._db.execute("UPDATE reading SET last_seen = ? WHERE seq = ?", (at, last[0]))
+                return True
+
+            self._db.execute(
+                "INSERT INTO reading (device_id, status, battery, timestamp, last_seen) VALUES (?, ?, ?, ?, ?)",
+                (key, status, battery, at, at),
+            )
+            self._count += 1
+
+            while self._count > self.size:
+                self._evict()
+
+        return False
+
+    def _evict(self):
+        superseded = self._db.execute(
+            "SELECT r.seq FROM reading r WHERE EXISTS "
+            "(SELECT 1 FROM reading n WHERE n.device_id = r.device_id AND n.seq > r.seq) "
+            "ORDER BY r.seq LIMIT 1"
+        ).fetchone()
+
+        if superseded is not None:
+            self._db.execute("DELETE FROM reading WHERE seq = ?", superseded)
+            GATEWAY_DROPPED.labels("superseded").inc()
+        else:
+            self._db.execute("DELETE FROM reading WHERE seq = (SELECT min(seq) FROM reading)")
+            GATEWAY_DROPPED.labels("queue_full").inc()
+
+        self._count -= 1
+
+    def peek(self, limit: int) -> list[QueuedReading]:
+        """
+            Oldest readings first, they stay queued until acknowledged
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, device_id, status, battery, timestamp, last_seen FROM reading ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+
+        return [
+            QueuedReading(seq, uuid.UUID(device_id), status, battery, datetime.fromisoformat(timestamp), datetime.fromisoformat(last_seen))
+            for seq, device_id, status, battery, timestamp, last_seen in rows
+        ]
+
+    def ack(self, readings: list[QueuedReading]) -> int:
+        """
+            Remove forwarded readings. A reading whose last_seen moved while it was
+            being sent stays queued, the server gets the newer last_seen next time.
+        """
+        with self._lock:
+            before = self._db.total_changes
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "DELETE FROM reading WHERE seq = ? AND last_seen = ?",
+                [(reading.seq, reading.last_seen.isoformat()) for reading in readings],
+            )
+            self._db.execute("COMMIT")
+
+            removed = self._db.total_changes - before
+            self._count -= removed
+
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,147 @@
+from backend.app.core.admission import ALARM_BATCH_HEADER, ALARM_STATUSES
+from backend.app.core.config import logger, settings
+from backend.app.core.formats import dumps
+from backend.app.core.metrics import GATEWAY_DROPPED, GATEWAY_FORWARDED, GATEWAY_FORWARD_FAILURES
+from backend.app.gateway.buffer import ReadingQueue
+
+import asyncio
+import gzip
+import random
+import time
+import urllib.error
+import urllib.request
+
+class Forwarder:
+    """
+        Sends the queued readings to the server in gzipped batches
+        (POST /api/devices/readings) and removes them once the server has them.
+        While the server cannot be reached the readings stay queued and sending
+        is retried with an exponential backoff (or the server's Retry-After).
+    """
+    def __init__(
+        self,
+        queue: ReadingQueue,
+        server_url: str,
+        site: str | None = None,
+        api_key: str | None = None,
+        batch_size: int = 500,
+        interval: float = 2.0,
+        timeout: float = 10.0,
+        max_delay: float = 300.0,
+    ):
+        self.queue = queue
+        self.server_url = server_url.rstrip("/")
+        self.site = site
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.max_delay = max_delay
+
+        self.failures = 0
+        self.last_forwarded: float | None = None
+        self._wake = asyncio.Event()
+
+    @property
+    def endpoint(self) -> str:
+        prefix = f"/api/sites/{self.site}" if self.site else "/api"
+        return f"{self.server_url}{prefix}/devices/readings"
+
+    def wake(self):
+        """
+            Send now instead of at the next interval (a full batch is waiting)
+        """
+        self._wake.set()
+
+    #==========================================
+    def _post(self, body: bytes, alarm: bool = False) -> None:
+        headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        if self.api_key:
+            headers["X-API-Key"] = self.api_key
+        if alarm:
+            # Admitted ahead of other traffic while the server is overloaded
+            headers[ALARM_BATCH_HEADER] = "1"
+
+        request = urllib.request.Request(self.endpoint, data=body, headers=headers, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def _backoff(self, retry_after: str | None = None) -> float:
+        self.failures += 1
+        GATEWAY_FORWARD_FAILURES.inc()
+
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), self.max_delay)
+
+        # Full jitter, gateways coming back online do not retry in step
+        return random.uniform(0.5, 1.0) * min(self.max_delay, self.interval * 2 ** self.failures)
+
+    def forward(self) -> float | None:
+        """
+            Send one batch. Returns how long to wait before the next attempt,
+            None when the batch was delivered (or nothing was queued).
+        """
+        readings = self.queue.peek(self.batch_size)
+        if not readings:
+            return None
+
+        body = gzip.compress(dumps({"readings": [reading.as_dict() for reading in readings]}), compresslevel=6)
+
+        try:
+            self._post(body, alarm=any(reading.status in ALARM_STATUSES for reading in readings))
+
+        except urllib.error.HTTPError as e:
+            if e.code in (401, 403):
+                # Revoked or missing key, keep the readings until the key is fixed
+                logger.warning("Server rejected the gateway's API key")
+                return self._backoff()
+
+            if e.code == 413 and self.batch_size > 1:
+                self.batch_size = max(1, self.batch_size // 2)
+                logger.warning("Batch too large for the server, sending %d readings per batch", self.batch_size)
+                return 0.0
+
+            if e.code in (400, 413, 422):
+                # The server will never take these, do not block the queue on them
+                logger.error("Server refused %d readings (%d), dropping them", len(readings), e.code)
+                GATEWAY_DROPPED.labels("refused").inc(self.queue.ack(readings))
+                return 0.0
+
+            logger.warning("Forwarding %d readings failed with %d", len(readings), e.code)
+            return self._backoff(e.headers.get("Retry-After"))
+
+        except (urllib.error.URLError, OSError) as e:
+            logger.warning("Server unreachable, %d readings queued: %s", len(self.queue), e)
+            return self._backoff()
+
+        self.queue.ack(readings)
+        GATEWAY_FORWARDED.inc(len(readings))
+        self.failures = 0
+        self.last_forwarded = time.time()
+
+        logger.debug("Forwarded %d readings (%d bytes)", len(readings), len(body))
+        return None
+
+    async def run(self):
+        """
+            Forward until cancelled: whenever a batch is delivered and more is
+            queued right away, otherwise every `interval` seconds or when woken
+        """
+        while True:
+            delay = await asyncio.to_thread(self.forward)
+
+            if delay is None:
+                if len(self.queue) >= self.batch_size:
+                    continue
+                delay = self.interval
+
+            self._wake.clear()
+            if self.failures:
+                # Backing off, a full batch does not make the server reachable
+                await asyncio.sleep(delay)
+                continue
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
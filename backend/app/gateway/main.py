@@ -0,0 +1,89 @@
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from datetime import datetime
+
+from backend.app.core.config import configure_logging, logger, settings, SAMPLED
+from backend.app.core.lifecycle import TaskSupervisor
+from backend.app.core.metrics import REGISTRY, CONTENT_TYPE_LATEST, GATEWAY_QUEUED
+from backend.app.gateway.buffer import ReadingQueue
+from backend.app.gateway.forwarder import Forwarder
+from backend.app.models import DeviceStatus
+
+import uuid
+
+#==========================================
+# Edge gateway: devices on the local network send their readings here instead of
+# to the server, the same trigger URL. Readings are queued on disk and forwarded
+# in batches, so they survive WAN outages and keep the time they were taken.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging(settings.GATEWAY_LOG_FILENAME)
+    logger.info("Starting gateway, forwarding to %s", settings.GATEWAY_SERVER_URL)
+
+    queue = ReadingQueue(settings.GATEWAY_QUEUE_FILE, settings.GATEWAY_QUEUE_SIZE)
+    forwarder = Forwarder(
+        queue,
+        settings.GATEWAY_SERVER_URL,
+        site=settings.GATEWAY_SITE,
+        api_key=settings.GATEWAY_API_KEY,
+        batch_size=settings.GATEWAY_BATCH_SIZE,
+        interval=settings.GATEWAY_FLUSH_INTERVAL,
+        timeout=settings.GATEWAY_REQUEST_TIMEOUT,
+        max_delay=settings.GATEWAY_RETRY_MAX_SECONDS,
+    )
+    app.state.queue = queue
+    app.state.forwarder = forwarder
+    GATEWAY_QUEUED.set_function(lambda: len(queue))
+
+    if len(queue):
+        logger.info("%d readings left from the last run", len(queue))
+
+    supervisor = TaskSupervisor()
+    supervisor.begin()
+    supervisor.start("forwarder", forwarder.run)
+    supervisor.install_signal_handlers()
+    supervisor.mark_ready()
+    yield
+
+    logger.info("Shutting down gateway, %d readings queued", len(queue))
+    await supervisor.shutdown()
+    queue.close()
+
+app = FastAPI(title="Secury gateway", lifespan=lifespan)
+
+@app.get("/api/devices/{device_id}/trigger", status_code=202, response_model=dict)
+async def trigger_device(device_id: uuid.UUID, new_status: str, request: Request, battery: int | None = None):
+    """
+        Same call as the server's trigger_device. The reading is queued, not applied:
+        the response does not say what the server will do with it.
+    """
+    if new_status not in DeviceStatus:
+        raise HTTPException(status_code=400, detail="Status is invalid")
+
+    if battery is not None and not 0 <= battery <= 100:
+        raise HTTPException(status_code=400, detail="Battery must be 0-100")
+
+    queue: ReadingQueue = request.app.state.queue
+    coalesced = queue.put(device_id, new_status, battery, datetime.now())
+
+    logger.debug("Reading of device %s queued (coalesced: %s)", device_id, coalesced, extra=SAMPLED)
+
+    if len(queue) >= settings.GATEWAY_BATCH_SIZE:
+        request.app.state.forwarder.wake()
+
+    return {"success": True, "queued": True, "coalesced": coalesced}
+
+@app.get("/health")
+async def health(request: Request):
+    forwarder: Forwarder = request.app.state.forwarder
+
+    return {
+        "queued": len(request.app.state.queue),
+        "failures": forwarder.failures,
+        "last_forwarded": datetime.fromtimestamp(forwarder.last_forwarded) if forwarder.last_forwarded else None,
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
@@ -1,17 +1,28 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from datetime import datetime
+from fastapi.responses import JSONResponse, PlainTextResponse
+from datetime import datetime, timedelta
 from sqlmodel import Session, select
 
 from backend.app import crud
 from backend.app.api.main import api_router
-from backend.app.core.database import engine, init_db
-from backend.app.core.websocket import manager, websocket_router
-from backend.app.core.config import logger
+from backend.app.core.database import init_db, checkpoint
+from backend.app.core.websocket import manager, websocket_router, stream_router
+from backend.app.core.config import configure_logging, logger, settings, SAMPLED
+from backend.app.core.metrics import (
+    REGISTRY, CONTENT_TYPE_LATEST,
+    HEALTHCHECK_SECONDS, HEALTHCHECK_OFFLINE
+)
+from backend.app.core.profiling import ProfilingMiddleware
+from backend.app.core.admission import AdmissionMiddleware, admission
+from backend.app.core.sites import sites
+from backend.app.core.notifications import notifier
+from backend.app.core.security import authenticator
+from backend.app.core.lifecycle import reconnect_after, supervisor
 
 from backend.app.models import (
-    Device, DevicePublic, DeviceUpdate, DeviceStatus,
-    EventPublic, EventCreate, EventType
+    DEFAULT_SITE, Device, DeviceCreate, DevicePublic, DeviceUpdate, DeviceStatus,
+    EventPublic, EventCreate, EventType, RollupResolution, UserCreate
 )
 
 # TODO: remove when you remove sensor_simulator()
@@ -25,31 +36,194 @@ async def lifespan(app: FastAPI):
     """
         Runs when server starts
     """
+    configure_logging()
     logger.info("Starting server...")
-    
+    supervisor.begin()
+    startup = supervisor.startup
+
     logger.info("Initializing database...")
 
-    with Session(engine) as session:
-        init_db(session)
+    for site in sites.ids():
+        with startup.measure("schema"), Session(sites.engine(site)) as session:
+            init_db(session)
 
-        # If db is empty (TODO: Remove after)
-        if not session.exec(select(Device)).first():
-            session.add_all([
-                Device(name="Room Window", type="window", location="Room 1"),
-                Device(name="Front door", type="door", location="Main Entrance"),
-                Device(name="Back door", type="door", location="Back Entrance"),
-            ])
-            session.commit()
+        with startup.measure("state"), Session(sites.engine(site)) as session:
+            load_site_state(site, session)
+
+    logger.info("Loading credentials...")
+    with startup.measure("credentials"):
+        authenticator.configure(settings.SECRET_KEY)
+        load_credentials()
+
+    if not settings.FAST_STARTUP:
+        with startup.measure("seeding"):
+            await seed_and_backfill()
+
+    admission.configure_from_settings()
+
+    logger.info("Starting notifications...")
+    with startup.measure("notifications"):
+        notifier.configure_from_settings()
+        await notifier.start()
+
+    if settings.FAST_STARTUP:
+        logger.info("Deferring seeding and backfills...")
+        supervisor.start("seed_and_backfill", seed_and_backfill, restart=False)
 
     logger.info("Starting sensor simulation...")
-    asyncio.create_task(sensor_simulator())
+    supervisor.start("sensor_simulator", sensor_simulator)
 
     logger.info("Starting healthchecking...")
-    asyncio.create_task(monitor_device_health())
+    supervisor.start("monitor_device_health", monitor_device_health)
+
+    logger.info("Starting summary publishing...")
+    supervisor.start("publish_device_summary", publish_device_summary)
+
+    logger.info("Starting rule evaluation...")
+    supervisor.start("evaluate_rules", evaluate_rules)
+
+    logger.info("Starting credential refresh...")
+    supervisor.start("refresh_credentials", refresh_credentials)
+
+    supervisor.start("monitor_event_loop_lag", lambda: admission.monitor_lag(settings.ADMISSION_LAG_INTERVAL))
+
+    supervisor.on_drain(manager.close_all)
+    supervisor.install_signal_handlers()
+    supervisor.mark_ready()
     yield
 
     logger.info("Shutting down server...")
 
+    # Close sockets and stop the loops, then write what they left behind
+    await supervisor.shutdown()
+    await flush_pending()
+
+    await notifier.stop()
+
+    for site in sites.ids():
+        checkpoint(sites.engine(site))
+
+#==========================================
+async def flush_pending():
+    """
+        Write rule timers that expired since the last tick, so they are not lost on restart.
+        Alarms are stored and notified when written, the broadcast outbox has no clients left.
+    """
+    for site in sites.ids():
+        rule_engine = sites.state(site).rules
+
+        try:
+            expired = rule_engine.expire()
+            if expired:
+                with Session(sites.engine(site)) as session:
+                    crud.write_rule_events(session=session, events=expired)
+
+                logger.info("Wrote %d expired rule timers of site %s", len(expired), site)
+
+            rule_engine.outbox.clear()
+        except Exception as e:
+            logger.error("Error flushing pending work of site %s: %s", site, e)
+
+#==========================================
+async def seed_and_backfill():
+    """
+        Work the server can serve without: demo devices and the first admin on an
+        empty database, event rollup backfill and the event row gauge.
+        Runs after the server is ready with FAST_STARTUP, before it otherwise.
+    """
+    with Session(sites.engine(DEFAULT_SITE)) as session:
+        # If db is empty (TODO: Remove after)
+        if not session.exec(select(Device)).first():
+            crud.create_devices(session=session, devices=[
+                DeviceCreate(name="Room Window", type="window", location="Room 1"),
+                DeviceCreate(name="Front door", type="door", location="Main Entrance"),
+                DeviceCreate(name="Back door", type="door", location="Back Entrance"),
+            ])
+
+    # Password hashing and full table scans stay off the event loop
+    await asyncio.to_thread(seed_admin)
+
+    for site in sites.ids():
+        await asyncio.to_thread(backfill_site, site)
+
+def backfill_site(site: str):
+    """
+        Backfill the event rollups, device state history and search index of a site
+    """
+    with Session(sites.engine(site)) as session:
+        started = crud.backfill_device_states(session=session)
+        if started:
+            logger.info("Started the state history of %d devices of site %s", started, site)
+
+        # Older readings weigh less than 1/16 in the drain rates
+        since = datetime.now() - timedelta(days=4 * settings.BATTERY_TREND_HALF_LIFE_DAYS)
+        loaded = crud.load_battery_trends(session=session, since=since)
+        if loaded:
+            logger.info("Loaded %d battery readings of site %s", loaded, site)
+
+        backfilled = crud.backfill_event_rollups(session=session)
+        if backfilled:
+            logger.info("Backfilled event rollups of site %s from %d events", site, backfilled)
+
+        indexed = crud.backfill_search_index(session=session)
+        if indexed:
+            logger.info("Indexed %d devices and events of site %s for search", indexed, site)
+
+def load_site_state(site: str, session: Session):
+    """
+        Rebuild the in-memory state of a site from its database: the device summary,
+        the rules with the armed locations and the pending duration timers
+    """
+    state = sites.state(site)
+    devices = crud.get_devices(session=session)
+
+    state.summary.rebuild(devices)
+    state.rules.load(crud.get_rules(session=session), armed=crud.get_armed_locations(session=session))
+    state.rules.resume(devices)
+
+def seed_admin():
+    """
+        Create the first user from ADMIN_EMAIL/ADMIN_PASSWORD when there are no users
+    """
+    with Session(sites.engine(DEFAULT_SITE)) as session:
+        if crud.count_users(session=session):
+            return
+
+        if settings.ADMIN_EMAIL and settings.ADMIN_PASSWORD:
+            crud.create_user(session=session, user=UserCreate(email=settings.ADMIN_EMAIL, password=settings.ADMIN_PASSWORD))
+            logger.info("Created admin user %s", settings.ADMIN_EMAIL)
+        elif settings.AUTH_ENABLED:
+            logger.warning("Authentication is enabled but there are no users, set ADMIN_EMAIL and ADMIN_PASSWORD")
+
+def load_credentials():
+    """
+        Load API key digests of every site and revoked token ids into the authenticator
+    """
+    device_keys, gateway_keys = [], []
+    for site in sites.ids():
+        with Session(sites.engine(site)) as session:
+            device_keys.extend(crud.get_device_keys(session=session))
+            gateway_keys.extend((digest, site) for digest in crud.get_gateway_keys(session=session))
+
+    with Session(sites.engine(DEFAULT_SITE)) as session:
+        revoked = crud.get_revoked_tokens(session=session)
+
+    authenticator.load_device_keys(device_keys)
+    authenticator.load_gateway_keys(gateway_keys)
+    authenticator.load_revoked(revoked)
+
+async def refresh_credentials():
+    """
+        Pick up keys and revocations written by other processes
+    """
+    while True:
+        await asyncio.sleep(settings.AUTH_REFRESH_INTERVAL)
+
+        try:
+            await asyncio.to_thread(load_credentials)
+        except Exception as e:
+            logger.error("Error refreshing credentials: %s", e)
+
 #==========================================
 async def monitor_device_health():
     """
@@ -60,20 +234,91 @@ async def monitor_device_health():
     while True:
         await asyncio.sleep(120)
 
-        try:
-            with Session(engine) as session:
-                offline_devices = crud.check_offline_devices(session=session, timeout_minutes=20)
+        with HEALTHCHECK_SECONDS.time():
+            for site in sites.ids():
+                try:
+                    with Session(sites.engine(site)) as session:
+                        offline_devices = crud.check_offline_devices(session=session, timeout_minutes=20)
+                        HEALTHCHECK_OFFLINE.inc(len(offline_devices))
 
-                for device in offline_devices:
-                    logger.info(f"Device {device.name} is offline")
+                        for device in offline_devices:
+                            logger.info("Device %s is offline", device.name)
+
+                            await manager.broadcast({
+                                "type": "device_offline",
+                                "device": DevicePublic.model_validate(device).model_dump(mode="json"),
+                                "timestamp": datetime.now().isoformat(),
+                            }, site=site)
+                except Exception as e:
+                    logger.error("Erorr in healthcheck of site %s: %s", site, e)
+
+                try:
+                    with Session(sites.engine(site)) as session:
+                        crud.prune_event_rollups(
+                            session=session,
+                            resolution=RollupResolution.MINUTE,
+                            older_than=datetime.now() - timedelta(hours=settings.ROLLUP_MINUTE_RETENTION_HOURS),
+                        )
+                except Exception as e:
+                    logger.error("Error pruning event rollups of site %s: %s", site, e)
+
+#==========================================
+async def publish_device_summary():
+    """
+        Push the device summary to websocket clients when it changes.
+        Changes within one interval are coalesced into a single message.
+    """
+    published_versions = {site: sites.state(site).summary.version for site in sites.ids()}
+
+    while True:
+        await asyncio.sleep(settings.SUMMARY_PUSH_INTERVAL)
+
+        if not manager.has_subscribers:
+            continue
+
+        for site in sites.ids():
+            device_summary = sites.state(site).summary
+            if device_summary.version == published_versions.get(site):
+                continue
+
+            try:
+                summary = device_summary.snapshot()
+                published_versions[site] = summary["version"]
+
+                await manager.broadcast({
+                    "type": "device_summary",
+                    "summary": summary,
+                }, site=site)
+            except Exception as e:
+                logger.error("Error publishing device summary of site %s: %s", site, e)
+
+#==========================================
+async def evaluate_rules():
+    """
+        Fire duration rules that expired and broadcast the alarms written by the rule engine
+    """
+    while True:
+        await asyncio.sleep(settings.RULES_TICK_INTERVAL)
+
+        for site in sites.ids():
+            rule_engine = sites.state(site).rules
+
+            try:
+                expired = rule_engine.expire()
+                if expired:
+                    with Session(sites.engine(site)) as session:
+                        crud.write_rule_events(session=session, events=expired)
+
+                while rule_engine.outbox:
+                    event = rule_engine.outbox.popleft()
+                    logger.warning("Alarm in site %s: device %s %s", site, event["device_id"], event["details"])
 
                     await manager.broadcast({
-                        "type": "device_offline",
-                        "device": DevicePublic.model_validate(device).model_dump(mode="json"),
-                        "timestamp": datetime.now().isoformat(),
-                    })
-        except Exception as e:
-            logger.error(f"Erorr in healthcheck: {e}")
+                        "type": "alarm",
+                        "event": event,
+                    }, site=site)
+            except Exception as e:
+                logger.error("Error evaluating rules of site %s: %s", site, e)
 
 #==========================================
 # Simulate sensors (TODO: remove when real sensors are added)
@@ -84,7 +329,9 @@ async def sensor_simulator():
     while True:
         await asyncio.sleep(5)
 
-        with Session(engine) as session:
+        site = random.choice(sites.ids())
+
+        with Session(sites.engine(site)) as session:
             devices = crud.get_devices(session=session)
             if not devices:
                 continue
@@ -94,16 +341,19 @@ async def sensor_simulator():
             new_status = random.choice([DeviceStatus.OPEN.value, DeviceStatus.CLOSED.value])
 
             if device.status != new_status:
+                previous_status = device.status
                 update_data = DeviceUpdate(status=new_status, last_updated=datetime.now())
                 updated_device = crud.update_device(session=session, db_device=device, device_in=update_data)
                 
-                logger.info(f"Sim: {device.name} changed to: {new_status}")
+                logger.info("Sim: %s changed to: %s", device.name, new_status)
                 
                 event = crud.create_event(
                     session=session, 
                     event=EventCreate(
                         device_id=device.id,
                         type= EventType.STATUS_CHANGE,
+                        old_status=previous_status,
+                        new_status=new_status,
                         details=f"{device.name} changed to: {new_status}",
                     )
                 )
@@ -112,7 +362,7 @@ async def sensor_simulator():
                     "type": "device_update",
                     "device": DevicePublic.model_validate(updated_device).model_dump(mode="json"),
                     "event": EventPublic.model_validate(event).model_dump(mode="json"),
-                })
+                }, site=site)
 
 app = FastAPI(
     lifespan=lifespan,
@@ -120,13 +370,18 @@ app = FastAPI(
     description="Real-time home security monitoring system"
 )
 
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+app.add_middleware(AdmissionMiddleware)
+
 @app.get("/")
 async def root():
     """
         Check the health of the API
     """
     
-    logger.info("Root requested")
+    logger.info("Root requested", extra=SAMPLED)
 
     return {
         "message": "IoT Security Monitor API",
@@ -137,8 +392,47 @@ async def root():
             "devices": "/api/devices",
             "events": "/api/events",
             "websocket": "/ws",
+            "stream": "/stream",
+            "metrics": "/metrics",
+            "health": "/health",
+            "ready": "/ready",
         }
     }
 
+@app.get("/health")
+async def health():
+    """
+        Liveness: the process is up, with its lifecycle state, background loops and startup times
+    """
+    return {
+        "status": supervisor.state.value,
+        "tasks": supervisor.task_states(),
+        "in_flight": admission.in_flight(),
+        "event_loop_lag_ms": round(admission.lag * 1000, 1),
+        "startup": supervisor.startup.as_dict() if supervisor.startup is not None else None,
+    }
+
+@app.get("/ready")
+async def ready():
+    """
+        Readiness: 503 while starting and draining, so load balancers stop routing here
+    """
+    if not supervisor.ready:
+        return JSONResponse(
+            {"status": supervisor.state.value},
+            status_code=503,
+            headers={"Retry-After": str(reconnect_after())},
+        )
+
+    return {"status": supervisor.state.value}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+        Prometheus scrape endpoint
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
+
 app.include_router(api_router, prefix="/api")
-app.include_router(websocket_router)
\ No newline at end of file
+app.include_router(websocket_router)
+app.include_router(stream_router)
\ No newline at end of file
@@ -1,10 +1,15 @@
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, Relationship, Index, LargeBinary, SmallInteger
 from datetime import datetime
 from enum import Enum
 from pydantic import EmailStr
 
+from backend.app.core.sqltypes import CodedEnum, CompactUuid, EpochMicroseconds
+
 import uuid
 
+# Site every device belongs to when no site is given (single building deployments)
+DEFAULT_SITE = "default"
+
 class DeviceStatus(str, Enum):
     OPEN = "open"
     CLOSED = "closed"
@@ -14,6 +19,31 @@ class EventType(str, Enum):
     STATUS_CHANGE = "status_change"
     DEVICE_OFFLINE = "device_offline"
     BATTERY_LOW = "battery_low"
+    # Emitted by the rule engine
+    RULE_ALARM = "rule_alarm"
+    STATE_TIMEOUT = "state_timeout"
+    LOCATION_THRESHOLD = "location_threshold"
+
+# Stored codes of the compact event table, append only
+STATUS_CODES = {
+    DeviceStatus.OPEN: 1,
+    DeviceStatus.CLOSED: 2,
+    DeviceStatus.OFFLINE: 3,
+}
+
+EVENT_TYPE_CODES = {
+    EventType.STATUS_CHANGE: 1,
+    EventType.DEVICE_OFFLINE: 2,
+    EventType.BATTERY_LOW: 3,
+    EventType.RULE_ALARM: 4,
+    EventType.STATE_TIMEOUT: 5,
+    EventType.LOCATION_THRESHOLD: 6,
+}
+
+class RuleKind(str, Enum):
+    STATE = "state"         # device enters a status
+    DURATION = "duration"   # device stays in a status longer than duration_seconds
+    COUNT = "count"         # threshold devices of one location enter a status within window_seconds
 
 class DeviceBase(SQLModel):
     name: str = Field(index=True)
@@ -23,12 +53,14 @@ class DeviceBase(SQLModel):
 
 class Device(DeviceBase, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    site_id: str = Field(default=DEFAULT_SITE, index=True)
     status: DeviceStatus = Field(default=DeviceStatus.CLOSED)
     last_updated: datetime = Field(default_factory= lambda: datetime.now())
     last_seen: datetime = Field(default_factory= lambda: datetime.now())
 
 class DevicePublic(DeviceBase):
     id: uuid.UUID
+    site_id: str = DEFAULT_SITE
     status: DeviceStatus
     last_updated: datetime
     last_seen: datetime
@@ -36,6 +68,21 @@ class DevicePublic(DeviceBase):
 class DeviceCreate(DeviceBase):
     status: DeviceStatus | None = None
 
+class DeviceBatteryPublic(SQLModel):
+    id: uuid.UUID
+    name: str
+    location: str
+    battery: int
+
+class DeviceSummaryPublic(SQLModel):
+    version: int
+    total: int
+    by_status: dict[DeviceStatus, int]
+    by_location: dict[str, int]
+    by_type: dict[str, int]
+    battery_distribution: dict[str, int]
+    lowest_battery: list[DeviceBatteryPublic]
+
 # TODO: Add the last updated here with a datetime?
 class DeviceUpdate(SQLModel):
     name: str | None = None
@@ -46,21 +93,260 @@ class DeviceUpdate(SQLModel):
     last_updated: datetime | None = None
     
 #==========================================
+class DeviceRef(SQLModel, table=True):
+    """
+        Integer surrogate of a device UUID, referenced by events.
+        Never deleted so events keep resolving after their device is removed.
+    """
+    __tablename__ = "device_ref"
+
+    key: int | None = Field(default=None, primary_key=True)
+    device_id: uuid.UUID = Field(unique=True)
+    site_id: str = Field(default=DEFAULT_SITE)
+
+class DeviceState(SQLModel, table=True):
+    """
+        State history: one row each time the status or battery of a device changes,
+        valid until the next row of the same device. A row without status marks
+        the device as deleted. Written by crud next to the device update.
+    """
+    __tablename__ = "device_state"
+    __table_args__ = (Index("ix_device_state_device_key_valid_from", "device_key", "valid_from"),)
+
+    seq: int | None = Field(default=None, primary_key=True)
+    device_key: int = Field(foreign_key="device_ref.key")
+    valid_from: datetime = Field(sa_type=EpochMicroseconds, index=True)
+    status: DeviceStatus | None = Field(default=None, sa_type=CodedEnum(DeviceStatus, STATUS_CODES))
+    battery: int | None = Field(default=None, sa_type=SmallInteger)
+
+class DeviceStatePublic(SQLModel):
+    device_id: uuid.UUID
+    status: DeviceStatus
+    battery: int | None
+    since: datetime
+
+class DeviceStatusTime(SQLModel):
+    device_id: uuid.UUID
+    status: DeviceStatus
+    seconds: float
+    # Times the device entered the status within the range
+    entered: int
+
+class BatteryChunk(SQLModel, table=True):
+    """
+        Up to BATTERY_CHUNK_SIZE battery readings of one device. The first reading is
+        stored as is, the rest as varint encoded deltas (seconds and percent since the
+        previous one), see core/telemetry.py. Only the newest chunk of a device grows.
+    """
+    __tablename__ = "battery_chunk"
+    __table_args__ = (Index("ix_battery_chunk_device_key_start", "device_key", "start"),)
+
+    seq: int | None = Field(default=None, primary_key=True)
+    device_key: int = Field(foreign_key="device_ref.key")
+    start: datetime = Field(sa_type=EpochMicroseconds)
+    end: datetime = Field(sa_type=EpochMicroseconds, index=True)
+    first_value: int = Field(sa_type=SmallInteger)
+    last_value: int = Field(sa_type=SmallInteger)
+    count: int = Field(default=1)
+    time_deltas: bytes = Field(default=b"", sa_type=LargeBinary)
+    value_deltas: bytes = Field(default=b"", sa_type=LargeBinary)
+
+class BatteryReading(SQLModel):
+    timestamp: datetime
+    battery: int
+
+class BatteryForecast(SQLModel):
+    device_id: uuid.UUID
+    battery: int
+    drain_per_day: float
+    days_left: float
+    predicted_at: datetime
+
 class EventBase(SQLModel):
-    device_id: uuid.UUID = Field(foreign_key="device.id")
+    device_id: uuid.UUID
     type: EventType
     details: str
 
-class Event(EventBase, table=True):
-    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
-    timestamp: datetime = Field(default_factory=lambda: datetime.now())
+class Event(SQLModel, table=True):
+    """
+        Compact event row: integer key and device reference, coded enums,
+        integer timestamp and structured fields instead of formatted text.
+        `device_id`, `site_id` and `details` are derived from it and its device_ref.
+    """
+    __table_args__ = (Index("ix_event_device_key_timestamp", "device_key", "timestamp"),)
+
+    seq: int | None = Field(default=None, primary_key=True)
+    # Public id, random so ids cannot be guessed from one another. Events migrated
+    # from the old layout keep their id, rows written before the column existed
+    # have none and use the id derived from seq they were published with.
+    uid: uuid.UUID | None = Field(default_factory=uuid.uuid4, sa_type=CompactUuid)
+    device_key: int = Field(foreign_key="device_ref.key")
+    type: EventType = Field(sa_type=CodedEnum(EventType, EVENT_TYPE_CODES))
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(), sa_type=EpochMicroseconds, index=True)
+    old_status: DeviceStatus | None = Field(default=None, sa_type=CodedEnum(DeviceStatus, STATUS_CODES))
+    new_status: DeviceStatus | None = Field(default=None, sa_type=CodedEnum(DeviceStatus, STATUS_CODES))
+    battery: int | None = Field(default=None, sa_type=SmallInteger)
+    # Free text that has no structured form
+    note: str | None = None
+
+    ref: DeviceRef = Relationship(sa_relationship_kwargs={"lazy": "joined", "innerjoin": True})
+
+    @property
+    def id(self) -> uuid.UUID:
+        return event_id(self.seq, self.uid)
+
+    @property
+    def device_id(self) -> uuid.UUID:
+        return self.ref.device_id
+
+    @property
+    def site_id(self) -> str:
+        return self.ref.site_id
+
+    @property
+    def details(self) -> str:
+        return render_event_details(self.type, self.new_status, self.battery, self.note)
+
+    def details_from_fields(self) -> str:
+        return render_event_details(self.type, self.new_status, self.battery, None)
+
+def event_id(seq: int, uid: uuid.UUID | None) -> uuid.UUID:
+    return uid if uid is not None else uuid.UUID(int=seq)
+
+# Text of the event types whose details are only the status they are about
+STATUS_EVENT_DETAILS = {
+    EventType.DEVICE_OFFLINE: "went offline",
+    EventType.RULE_ALARM: "alarm: {status}",
+    EventType.STATE_TIMEOUT: "alarm: {status} for too long",
+    EventType.LOCATION_THRESHOLD: "alarm: several devices of the location {status}",
+}
+
+def render_event_details(
+    event_type: EventType,
+    new_status: DeviceStatus | None,
+    battery: int | None,
+    note: str | None,
+) -> str:
+    """
+        Text shown as `details`, built from the structured fields of an event
+    """
+    if note is not None:
+        return note
+
+    if event_type == EventType.STATUS_CHANGE and new_status is not None:
+        details = f"status changed to {DeviceStatus(new_status).value}"
+        if battery is not None:
+            details += f" (battery: {battery}%)"
+        return details
+
+    if event_type == EventType.BATTERY_LOW and battery is not None:
+        return f"battery low: {battery}%"
+
+    template = STATUS_EVENT_DETAILS.get(EventType(event_type))
+    if template is not None and new_status is not None:
+        return template.format(status=DeviceStatus(new_status).value)
+
+    return EventType(event_type).value
 
 class EventPublic(EventBase):
     id: uuid.UUID
+    site_id: str = DEFAULT_SITE
     timestamp: datetime
 
-class EventCreate(EventBase):
-    pass
+class EventCreate(SQLModel):
+    device_id: uuid.UUID
+    type: EventType
+    # Either give structured fields or free text details
+    details: str | None = None
+    old_status: DeviceStatus | None = None
+    new_status: DeviceStatus | None = None
+    battery: int | None = None
+    # When it happened, if not now (readings forwarded late)
+    timestamp: datetime | None = None
+
+class DeviceReading(SQLModel):
+    """
+        Reading forwarded by an edge gateway. `timestamp` is when it was taken,
+        `last_seen` when the gateway last got it again unchanged.
+    """
+    device_id: uuid.UUID
+    status: DeviceStatus
+    battery: int | None = Field(default=None, ge=0, le=100)
+    timestamp: datetime
+    last_seen: datetime | None = None
+
+class DeviceReadingBatch(SQLModel):
+    readings: list[DeviceReading]
+
+#==========================================
+class RollupResolution(str, Enum):
+    MINUTE = "minute"
+    HOUR = "hour"
+    DAY = "day"
+
+class RollupGroup(str, Enum):
+    DEVICE = "device"
+    TYPE = "type"
+    LOCATION = "location"
+
+class EventRollup(SQLModel, table=True):
+    """
+        Event counts per time bucket, maintained by crud.create_event.
+        Location is copied from the device when the event is written.
+    """
+    resolution: RollupResolution = Field(primary_key=True)
+    bucket: datetime = Field(primary_key=True)
+    device_id: uuid.UUID = Field(primary_key=True)
+    type: EventType = Field(primary_key=True)
+    location: str
+    count: int = Field(default=0)
+
+class EventRollupPoint(SQLModel):
+    bucket: datetime
+    key: str
+    count: int
+
+class EventRollupSeries(SQLModel):
+    resolution: RollupResolution
+    group_by: RollupGroup
+    start: datetime
+    end: datetime
+    points: list[EventRollupPoint]
+
+#==========================================
+class AlarmRuleBase(SQLModel):
+    name: str
+    kind: RuleKind
+    status: DeviceStatus
+    # Selectors, a rule without any applies to every device
+    device_id: uuid.UUID | None = None
+    device_type: str | None = None
+    location: str | None = None
+    armed_only: bool = False
+    duration_seconds: int | None = Field(default=None, gt=0)
+    threshold: int | None = Field(default=None, gt=0)
+    window_seconds: int | None = Field(default=None, gt=0)
+
+class AlarmRule(AlarmRuleBase, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    enabled: bool = Field(default=True)
+
+class AlarmRuleCreate(AlarmRuleBase):
+    enabled: bool = True
+
+class AlarmRulePublic(AlarmRuleBase):
+    id: uuid.UUID
+    enabled: bool
+
+class ArmedLocation(SQLModel, table=True):
+    """
+        Location armed for armed_only rules ("*" for everywhere).
+        Stored so a restart does not disarm the site.
+    """
+    __tablename__ = "armed_location"
+
+    location: str = Field(primary_key=True)
+    armed_at: datetime = Field(default_factory=lambda: datetime.now())
 
 #==========================================
 class UserBase(SQLModel):
@@ -69,6 +355,7 @@ class UserBase(SQLModel):
 
 class User(UserBase, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    hashed_password: str = ""
 
 class UserCreate(UserBase):
     password: str = Field(min_length=8, max_length=40)
@@ -79,4 +366,48 @@ class UserUpdate(UserBase):
     full_name: str | None = Field(default=None, max_length=255)
 
 class UserPublic(UserBase):
-    id: uuid.UUID
\ No newline at end of file
+    id: uuid.UUID
+
+class Token(SQLModel):
+    access_token: str
+    token_type: str = "bearer"
+    expires_at: datetime
+
+class RevokedToken(SQLModel, table=True):
+    """
+        Token ids revoked before they expired, kept until they would have expired anyway
+    """
+    __tablename__ = "revoked_token"
+
+    jti: str = Field(primary_key=True)
+    expires_at: datetime
+
+#==========================================
+class DeviceKey(SQLModel, table=True):
+    """
+        API key a device authenticates with. Only the SHA-256 digest is stored.
+    """
+    __tablename__ = "device_key"
+
+    digest: str = Field(primary_key=True)
+    device_id: uuid.UUID = Field(index=True)
+    created_at: datetime = Field(default_factory=lambda: datetime.now())
+
+class DeviceKeyPublic(SQLModel):
+    device_id: uuid.UUID
+    api_key: str
+    created_at: datetime
+
+class GatewayKey(SQLModel, table=True):
+    """
+        API key an edge gateway forwards the readings of its site with.
+        Only the SHA-256 digest is stored.
+    """
+    __tablename__ = "gateway_key"
+
+    digest: str = Field(primary_key=True)
+    created_at: datetime = Field(default_factory=lambda: datetime.now())
+
+class GatewayKeyPublic(SQLModel):
+    api_key: str
+    created_at: datetime
@@ -0,0 +1,150 @@
+from starlette.websockets import WebSocketDisconnect
+from sqlmodel import Session
+
+from backend.app import crud
+from backend.app.core.config import settings
+from backend.app.core.security import authenticator, login_limiter
+from backend.app.models import UserCreate
+
+import pytest
+
+@pytest.fixture(name="token")
+def token_fixture(client, session: Session, monkeypatch):
+    monkeypatch.setattr(settings, "AUTH_ENABLED", True)
+    crud.create_user(session=session, user=UserCreate(email="admin@example.com", password="password123"))
+
+    response = client.post(
+        "/api/token",
+        data={"username": "admin@example.com", "password": "password123"},
+    )
+    assert response.status_code == 200
+
+    yield response.json()["access_token"]
+    authenticator.cache.clear()
+    login_limiter.clear()
+
+
+def test_login_rejects_wrong_password(client, token):
+    response = client.post("/api/token", data={"username": "admin@example.com", "password": "wrong"})
+    assert response.status_code == 401
+
+    response = client.post("/api/token", json={"username": "admin@example.com"})
+    assert response.status_code == 422
+
+
+def test_routes_need_a_token(client, token):
+    assert client.get("/api/devices").status_code == 401
+    assert client.get("/api/devices", headers={"Authorization": "Bearer nope"}).status_code == 401
+
+    response = client.get("/api/devices", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+
+    response = client.get("/api/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.json()["email"] == "admin@example.com"
+
+
+def test_revoked_token_is_rejected(client, token):
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.post("/api/token/revoke", headers=headers).status_code == 200
+    assert client.get("/api/devices", headers=headers).status_code == 401
+
+
+def test_device_key_triggers_only_its_device(client, token, uuids):
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.post(f"/api/devices/{uuids['window']}/keys", headers=headers)
+    assert response.status_code == 200
+    key = response.json()["api_key"]
+
+    response = client.get(f"/api/devices/{uuids['window']}/trigger?new_status=open", headers={"X-API-Key": key})
+    assert response.status_code == 200
+
+    response = client.get(f"/api/devices/{uuids['front_door']}/trigger?new_status=open", headers={"X-API-Key": key})
+    assert response.status_code == 403
+
+    # Device keys do not open user routes
+    assert client.get("/api/devices", headers={"X-API-Key": key}).status_code == 401
+
+    client.delete(f"/api/devices/{uuids['window']}/keys", headers=headers)
+    response = client.get(f"/api/devices/{uuids['window']}/trigger?new_status=open", headers={"X-API-Key": key})
+    assert response.status_code == 401
+
+
+def test_websocket_needs_a_token(client, token):
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+
+    # Tokens are not accepted in the URL, only single-use tickets
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(f"/ws?token={token}") as websocket:
+            websocket.receive_json()
+
+    ticket = client.post("/api/stream-ticket", headers={"Authorization": f"Bearer {token}"}).json()["ticket"]
+
+    with client.websocket_connect(f"/ws?ticket={ticket}") as websocket:
+        assert websocket.receive_json()["type"] == "initial_state"
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(f"/ws?ticket={ticket}") as websocket:
+            websocket.receive_json()
+
+    with client.websocket_connect("/ws", headers={"Authorization": f"Bearer {token}"}) as websocket:
+        assert websocket.receive_json()["type"] == "initial_state"
+
+
+def test_repeated_login_failures_are_throttled(client, token, monkeypatch):
+    monkeypatch.setattr(settings, "LOGIN_MAX_FAILURES", 3)
+
+    for _ in range(3):
+        response = client.post("/api/token", data={"username": "admin@example.com", "password": "wrong"})
+        assert response.status_code == 401
+
+    # Even the right password is refused until the failures leave the window
+    response = client.post("/api/token", data={"username": "admin@example.com", "password": "password123"})
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+
+    login_limiter.clear()
+    response = client.post("/api/token", data={"username": "admin@example.com", "password": "password123"})
+    assert response.status_code == 200
+
+
+def test_gateway_key_forwards_readings_of_its_site(client, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    batch = {"readings": []}
+
+    key = client.post("/api/devices/gateway-keys", headers=headers).json()["api_key"]
+
+    assert client.post("/api/devices/readings", json=batch).status_code == 401
+    assert client.post("/api/devices/readings", json=batch, headers={"X-API-Key": key}).status_code == 200
+
+    # Gateway keys open nothing else
+    assert client.get("/api/devices", headers={"X-API-Key": key}).status_code == 401
+
+    client.delete("/api/devices/gateway-keys", headers=headers)
+    assert client.post("/api/devices/readings", json=batch, headers={"X-API-Key": key}).status_code == 401
+
+
+def test_api_keys_are_not_bearer_tokens(client, token, uuids):
+    headers = {"Authorization": f"Bearer {token}"}
+
+    gateway_key = client.post("/api/devices/gateway-keys", headers=headers).json()["api_key"]
+    device_key = client.post(f"/api/devices/{uuids['window']}/keys", headers=headers).json()["api_key"]
+
+    # Verified once as API keys, so they are in the cache
+    assert client.post("/api/devices/readings", json={"readings": []}, headers={"X-API-Key": gateway_key}).status_code == 200
+    assert client.get(f"/api/devices/{uuids['window']}/trigger?new_status=open", headers={"X-API-Key": device_key}).status_code == 200
+
+    for key in (gateway_key, device_key):
+        response = client.post(
+            "/api/users",
+            json={"email": "intruder@example.com", "password": "password123"},
+            headers={"Authorization": f"Bearer {key}"},
+        )
+        assert response.status_code == 401
+
+        with pytest.raises(WebSocketDisconnect):
+            with client.websocket_connect("/ws", headers={"Authorization": f"Bearer {key}"}) as websocket:
+                websocket.receive_json()
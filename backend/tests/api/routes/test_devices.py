@@ -1,5 +1,13 @@
+from datetime import datetime, timedelta
+
+from backend.app.core.config import settings
+from backend.app.core.ingest import ingest_guard
 from backend.app.models import DeviceStatus, EventType
 
+import gzip
+import json
+import uuid
+
 def test_get_all_devices(client):
     response = client.get("/api/devices")
     assert response.status_code == 200
@@ -17,6 +25,66 @@ def test_get_all_devices(client):
         assert "battery" in device
 
 
+def test_get_all_devices_matches_device_public(client, uuids):
+    listed = {device["id"]: device for device in client.get("/api/devices").json()}
+    single = client.get(f"/api/devices/{uuids["window"]}").json()
+
+    assert listed[str(uuids["window"])] == single
+
+    schema = client.get("/openapi.json").json()
+    response_schema = schema["paths"]["/api/devices"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert response_schema["items"]["$ref"].endswith("/DevicePublic")
+
+
+def test_get_all_devices_not_modified(client, uuids):
+    response = client.get("/api/devices")
+    etag = response.headers["etag"]
+    assert "last-modified" in response.headers
+
+    response = client.get("/api/devices", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # Same version issued by another worker or an earlier run
+    other = f'"00000000-{response.headers["x-change-version"]}"'
+    assert client.get("/api/devices", headers={"If-None-Match": other}).status_code == 200
+
+    client.get(f"/api/devices/{uuids["front_door"]}/trigger?new_status=open")
+
+    response = client.get("/api/devices", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_get_all_devices_since_version(client, uuids):
+    version = int(client.get("/api/devices").headers["x-change-version"])
+
+    response = client.get(f"/api/devices?since_version={version}")
+    assert response.json() == []
+
+    client.get(f"/api/devices/{uuids["window"]}/trigger?new_status=open")
+    client.delete(f"/api/devices/{uuids["front_door"]}")
+
+    response = client.get(f"/api/devices?since_version={version}")
+    assert [device["id"] for device in response.json()] == [str(uuids["window"])]
+    assert response.headers["x-deleted-devices"] == str(uuids["front_door"])
+
+    response = client.get("/api/devices?since_version=0")
+    assert response.headers["x-full-snapshot"] == "1"
+    assert len(response.json()) == 2
+
+
+def test_get_device_not_modified(client, uuids):
+    etag = client.get(f"/api/devices/{uuids["window"]}").headers["etag"]
+
+    client.get(f"/api/devices/{uuids["front_door"]}/trigger?new_status=open")
+    response = client.get(f"/api/devices/{uuids["window"]}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    client.get(f"/api/devices/{uuids["window"]}/trigger?new_status=open")
+    response = client.get(f"/api/devices/{uuids["window"]}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
 def test_get_device_valid(client, uuids):
     response = client.get(f"/api/devices/{uuids["window"]}")
     assert response.status_code == 200
@@ -58,10 +126,258 @@ def test_trigger_valid_device(client, uuids):
     assert data["event"]["device_id"] == str(uuids["window"])
 
 
+def test_trigger_repeated_reading_is_coalesced(client, uuids):
+    url = f"/api/devices/{uuids["window"]}/trigger?new_status=open&battery=80"
+
+    first = client.get(url).json()
+    repeated = client.get(url).json()
+
+    assert first.get("coalesced") is None
+    assert repeated["coalesced"] is True
+    assert repeated["event"] is None
+    assert repeated["device"]["last_seen"] >= first["device"]["last_seen"]
+
+    events = client.get("/api/events").json()
+    assert len([e for e in events if e["device_id"] == str(uuids["window"])]) == 1
+
+    # A different reading is written again
+    assert client.get(f"/api/devices/{uuids["window"]}/trigger?new_status=closed").json()["event"] is not None
+
+
+def test_trigger_rate_limit(client, uuids, monkeypatch):
+    monkeypatch.setattr(ingest_guard, "capacity", 2.0)
+
+    statuses = ["open", "closed", "open"]
+    responses = [client.get(f"/api/devices/{uuids["window"]}/trigger?new_status={s}") for s in statuses]
+
+    assert [r.status_code for r in responses] == [200, 200, 429]
+    assert int(responses[-1].headers["Retry-After"]) >= 1
+    # Other devices have their own budget
+    assert client.get(f"/api/devices/{uuids["front_door"]}/trigger?new_status=open").status_code == 200
+
+
 def  test_trigger_invalid_device(client, uuids):
     response = client.get(f"/api/devices/{uuids["invalid"]}/trigger?new_status=open")
     assert response.status_code == 404
 
     data = response.json()
     
-    assert data["detail"] == "Device not found"
\ No newline at end of file
+    assert data["detail"] == "Device not found"
+
+    # Unknown ids never take up rate limit state
+    for _ in range(3):
+        client.get(f"/api/devices/{uuid.uuid4()}/trigger?new_status=open")
+    assert len(ingest_guard._devices) == 0
+
+
+def test_device_summary(client):
+    response = client.get("/api/devices/summary?lowest=2")
+    assert response.status_code == 200
+
+    data = response.json()
+
+    assert data["total"] == 3
+    assert data["by_status"] == {"open": 1, "closed": 2, "offline": 0}
+    assert data["by_type"] == {"Window": 1, "Door": 2}
+    assert data["by_location"]["Room 1"] == 1
+    assert sum(data["battery_distribution"].values()) == 3
+
+    assert [d["battery"] for d in data["lowest_battery"]] == [50, 75]
+
+
+def test_device_summary_follows_writes(client, uuids):
+    version = client.get("/api/devices/summary").json()["version"]
+
+    client.get(f"/api/devices/{uuids["window"]}/trigger?new_status=open&battery=5")
+
+    data = client.get("/api/devices/summary").json()
+
+    assert data["version"] > version
+    assert data["by_status"]["open"] == 2
+    assert data["battery_distribution"]["0-9"] == 1
+    assert data["lowest_battery"][0]["id"] == str(uuids["window"])
+
+
+def test_import_devices_csv(client):
+    body = (
+        "name,type,location,battery\n"
+        "Garage door,Door,Garage,90\n"
+        "Attic window,Window,Attic,\n"
+        "Broken,Door,Garage,not-a-number\n"
+    )
+
+    response = client.post("/api/devices/import", content=body, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["imported"] == 2
+    assert data["rejected"] == 1
+    assert data["errors"][0]["line"] == 4
+
+    devices = {device["name"]: device for device in client.get("/api/devices").json()}
+    assert devices["Garage door"]["battery"] == 90
+    assert devices["Attic window"]["battery"] == 100
+    assert devices["Attic window"]["status"] == DeviceStatus.CLOSED.value
+
+
+def test_import_devices_ndjson_broadcasts_once(client):
+    body = "\n".join(
+        f'{{"name": "Sensor {i}", "type": "Window", "location": "Hall", "status": "open"}}' for i in range(5)
+    )
+
+    with client.websocket_connect("/ws") as websocket:
+        websocket.receive_json()
+
+        response = client.post("/api/devices/import?format=ndjson", content=body)
+        assert response.json()["imported"] == 5
+
+        message = websocket.receive_json()
+        assert message["type"] == "devices_imported"
+        assert message["count"] == 5
+        assert message["summary"]["by_location"]["Hall"] == 5
+
+
+def test_export_devices(client):
+    response = client.get("/api/devices/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 3
+    assert {row["name"] for row in rows} == {"Room Window", "Front door", "Back door"}
+
+    response = client.get("/api/devices/export?format=csv")
+    lines = response.text.splitlines()
+
+    assert lines[0] == "id,name,type,location,status,battery,last_updated,last_seen,site_id"
+    assert len(lines) == 4
+
+
+def test_device_states_and_time_in_status(client, uuids):
+    client.get(f"/api/devices/{uuids["window"]}/trigger?new_status=open")
+
+    states = {state["device_id"]: state for state in client.get("/api/devices/states").json()}
+    assert states[str(uuids["window"])]["status"] == DeviceStatus.OPEN.value
+
+    response = client.get("/api/devices/time-in-status?status=open")
+    assert response.status_code == 200
+    assert [row["device_id"] for row in response.json()] == [str(uuids["window"])]
+    assert response.json()[0]["entered"] == 1
+
+    assert client.get("/api/devices/time-in-status?start=2026-01-02T00:00:00&end=2026-01-01T00:00:00").status_code == 400
+
+
+def test_battery_readings_and_forecast(client, uuids):
+    for battery in (60, 50, 40):
+        client.get(f"/api/devices/{uuids["front_door"]}/trigger?new_status=open&battery={battery}")
+
+    readings = client.get(f"/api/devices/{uuids["front_door"]}/battery").json()
+    assert [reading["battery"] for reading in readings] == [60, 50, 40]
+
+    # Drained 20% within a fraction of a second
+    forecast = client.get("/api/devices/battery-forecast?threshold=10&days=1").json()
+    assert [row["device_id"] for row in forecast] == [str(uuids["front_door"])]
+    assert forecast[0]["battery"] == 40
+    assert forecast[0]["drain_per_day"] > 0
+
+    assert client.get("/api/devices/battery-forecast?days=0").status_code == 422
+
+
+def test_search_devices(client):
+    created = client.post("/api/devices", json={"name": "Garage Door", "type": "Door", "location": "Garage", "battery": 90}).json()
+
+    response = client.get("/api/devices/search?q=gar")
+    assert response.status_code == 200
+    assert [device["id"] for device in response.json()] == [created["id"]]
+
+    assert client.get("/api/devices/search?q=gar&type=Window").json() == []
+    assert client.get("/api/devices/search?q=").status_code == 422
+
+
+def test_ingest_reading_batches(client, uuids):
+    # After the devices' current state, so the readings are applied
+    taken = datetime.now()
+    readings = [
+        {"device_id": str(uuids["front_door"]), "status": "open", "battery": 5, "timestamp": (taken + timedelta(seconds=1)).isoformat()},
+        {"device_id": str(uuids["front_door"]), "status": "closed", "timestamp": taken.isoformat()},
+        # Same as the stored state, only last_seen moves
+        {"device_id": str(uuids["window"]), "status": "closed", "timestamp": taken.isoformat(), "last_seen": (taken + timedelta(seconds=30)).isoformat()},
+        {"device_id": str(uuid.uuid4()), "status": "open", "timestamp": taken.isoformat()},
+    ]
+    body = gzip.compress(json.dumps({"readings": readings}).encode())
+
+    response = client.post("/api/devices/readings", content=body, headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 200
+    # Taken in order: closed matches the stored state, then open
+    assert response.json() == {"applied": 1, "coalesced": 2, "stale": 0, "unknown": 1, "dropped": 0}
+
+    door = client.get(f"/api/devices/{uuids['front_door']}").json()
+    assert door["status"] == "open"
+    assert door["battery"] == 5
+    assert datetime.fromisoformat(door["last_updated"]) == taken + timedelta(seconds=1)
+
+    events = [event for event in client.get("/api/events?limit=10").json() if event["device_id"] == str(uuids["front_door"])]
+    assert {event["type"] for event in events} == {EventType.STATUS_CHANGE, EventType.BATTERY_LOW}
+    assert all(datetime.fromisoformat(event["timestamp"]) == taken + timedelta(seconds=1) for event in events)
+
+    window = client.get(f"/api/devices/{uuids['window']}").json()
+    assert datetime.fromisoformat(window["last_seen"]) == taken + timedelta(seconds=30)
+
+
+def test_stale_readings_only_fill_in_history(client, uuids):
+    door = uuids["front_door"]
+
+    client.get(f"/api/devices/{door}/trigger?new_status=open")
+    opened = datetime.now()
+    client.get(f"/api/devices/{door}/trigger?new_status=closed")
+    closed = datetime.now()
+    client.get(f"/api/devices/{door}/trigger?new_status=open")
+    current = client.get(f"/api/devices/{door}").json()
+
+    readings = [
+        # The door was already open then
+        {"device_id": str(door), "status": "open", "timestamp": opened.isoformat()},
+        # The gateway saw it open before it reached the server again
+        {"device_id": str(door), "status": "open", "battery": 30, "timestamp": closed.isoformat()},
+    ]
+    response = client.post("/api/devices/readings", json={"readings": readings})
+    assert response.json() == {"applied": 0, "coalesced": 1, "stale": 1, "unknown": 0, "dropped": 0}
+
+    device = client.get(f"/api/devices/{door}").json()
+    assert device["last_updated"] == current["last_updated"]
+    assert device["battery"] == current["battery"]
+
+    events = [event for event in client.get("/api/events?limit=10").json() if datetime.fromisoformat(event["timestamp"]) == closed]
+    assert [event["details"] for event in events] == ["status changed to open (battery: 30%)"]
+
+    states = client.get(f"/api/devices/states?at={(closed + timedelta(microseconds=1)).isoformat()}").json()
+    assert [state["battery"] for state in states if state["device_id"] == str(door)] == [30]
+    assert (closed.isoformat(), 30) in [(reading["timestamp"], reading["battery"]) for reading in client.get(f"/api/devices/{door}/battery").json()]
+
+
+def test_ingest_reading_batches_drops_devices_over_their_rate(client, uuids, monkeypatch):
+    monkeypatch.setattr(ingest_guard, "capacity", 1.0)
+    monkeypatch.setattr(ingest_guard, "rate", 0.0)
+    taken = datetime.now()
+
+    client.get(f"/api/devices/{uuids["window"]}/trigger?new_status=open")
+
+    readings = [
+        {"device_id": str(uuids["window"]), "status": "closed", "timestamp": (taken + timedelta(seconds=1)).isoformat()},
+        {"device_id": str(uuids["front_door"]), "status": "open", "timestamp": (taken + timedelta(seconds=1)).isoformat()},
+        {"device_id": str(uuids["front_door"]), "status": "closed", "timestamp": (taken + timedelta(seconds=2)).isoformat()},
+    ]
+    response = client.post("/api/devices/readings", json={"readings": readings})
+    assert response.json() == {"applied": 2, "coalesced": 0, "stale": 0, "unknown": 0, "dropped": 1}
+
+    assert client.get(f"/api/devices/{uuids["window"]}").json()["status"] == "open"
+
+
+def test_ingest_reading_batches_rejects_bad_bodies(client, monkeypatch):
+    assert client.post("/api/devices/readings", content=b"not gzip", headers={"Content-Encoding": "gzip"}).status_code == 400
+    assert client.post("/api/devices/readings", content=b"{}", headers={"Content-Encoding": "br"}).status_code == 400
+    assert client.post("/api/devices/readings", content=b'{"readings": [{"status": "open"}]}').status_code == 422
+
+    monkeypatch.setattr(settings, "INGEST_BATCH_MAX_BYTES", 1024)
+    body = gzip.compress(b" " * 100000)
+    assert client.post("/api/devices/readings", content=body, headers={"Content-Encoding": "gzip"}).status_code == 413
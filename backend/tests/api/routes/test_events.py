@@ -1,3 +1,5 @@
+import json
+
 def test_get_events_default(client):
     response = client.get("/api/events")
     assert response.status_code == 200
@@ -9,6 +11,7 @@ def test_get_events_default(client):
     # default limit = 10
     assert len(data) <= 10
 
+
 def test_get_events_limit(client):
     response = client.get("/api/events?limit=5")
     assert response.status_code == 200
@@ -16,4 +19,77 @@ def test_get_events_limit(client):
     data = response.json()
 
     assert isinstance(data, list)
-    assert len(data) <= 5
\ No newline at end of file
+    assert len(data) <= 5
+
+
+def test_get_events_matches_trigger_event(client, uuids):
+    response = client.get(f"/api/devices/{uuids["window"]}/trigger?new_status=open&battery=42")
+    event = response.json()["event"]
+
+    listed = client.get("/api/events?limit=1000").json()
+    assert event in listed
+
+
+def test_event_rollups(client, uuids):
+    client.get(f"/api/devices/{uuids["window"]}/trigger?new_status=open")
+    client.get(f"/api/devices/{uuids["window"]}/trigger?new_status=closed&battery=5")
+    client.get(f"/api/devices/{uuids["front_door"]}/trigger?new_status=open")
+
+    response = client.get("/api/events/rollups?group_by=type")
+    assert response.status_code == 200
+
+    data = response.json()
+    assert data["resolution"] == "hour"
+    assert data["group_by"] == "type"
+
+    counts = {}
+    for point in data["points"]:
+        counts[point["key"]] = counts.get(point["key"], 0) + point["count"]
+
+    assert counts == {"status_change": 3, "battery_low": 1}
+
+    by_location = client.get("/api/events/rollups?group_by=location&resolution=day").json()
+    locations = {point["key"]: point["count"] for point in by_location["points"]}
+
+    assert locations == {"Room 1": 3, "Main Entrance": 1}
+
+
+def test_event_rollups_invalid_range(client):
+    response = client.get("/api/events/rollups?start=2025-01-02T00:00:00&end=2025-01-01T00:00:00")
+    assert response.status_code == 400
+
+
+def test_export_events(client, uuids):
+    for status in ["open", "closed", "open"]:
+        client.get(f"/api/devices/{uuids["window"]}/trigger?new_status={status}")
+    client.get(f"/api/devices/{uuids["front_door"]}/trigger?new_status=open")
+
+    response = client.get("/api/events/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 4
+    assert rows == sorted(rows, key=lambda row: row["timestamp"])
+
+    response = client.get(f"/api/events/export?format=csv&device_id={uuids["window"]}")
+    lines = response.text.splitlines()
+
+    assert lines[0] == "id,timestamp,device_id,type,details,site_id"
+    assert len(lines) == 4
+    assert all(str(uuids["window"]) in line for line in lines[1:])
+
+    response = client.get("/api/events/export?start=2000-01-01T00:00:00&end=2000-01-02T00:00:00")
+    assert response.text == ""
+
+
+def test_search_events(client, uuids):
+    client.get(f"/api/devices/{uuids["window"]}/trigger?new_status=open")
+    client.get(f"/api/devices/{uuids["front_door"]}/trigger?new_status=open")
+
+    response = client.get("/api/events/search?q=room win")
+    assert response.status_code == 200
+    assert [event["device_id"] for event in response.json()] == [str(uuids["window"])]
+
+    assert client.get("/api/events/search?q=room&type=battery_low").json() == []
+    assert client.get("/api/events/search?q=room&start=2025-01-02T00:00:00&end=2025-01-01T00:00:00").status_code == 400
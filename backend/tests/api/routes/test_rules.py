@@ -0,0 +1,72 @@
+from backend.app.core.rules import rule_engine
+from backend.app.main import load_site_state
+from backend.app.models import DEFAULT_SITE, EventType
+
+def test_state_rule_only_fires_while_armed(client, uuids):
+    response = client.post("/api/rules", json={
+        "name": "Front door open",
+        "kind": "state",
+        "status": "open",
+        "device_id": str(uuids["front_door"]),
+        "armed_only": True,
+    })
+    assert response.status_code == 200
+    assert response.json()["enabled"] is True
+
+    client.get(f"/api/devices/{uuids["front_door"]}/trigger?new_status=open")
+    client.get(f"/api/devices/{uuids["front_door"]}/trigger?new_status=closed")
+
+    events = client.get("/api/events?limit=100").json()
+    assert EventType.RULE_ALARM.value not in [event["type"] for event in events]
+
+    assert client.post("/api/rules/arm").json() == {"armed": ["*"]}
+
+    client.get(f"/api/devices/{uuids["front_door"]}/trigger?new_status=open")
+
+    events = client.get("/api/events?limit=100").json()
+    alarms = [event for event in events if event["type"] == EventType.RULE_ALARM.value]
+
+    assert len(alarms) == 1
+    assert alarms[0]["device_id"] == str(uuids["front_door"])
+
+
+def test_invalid_rule(client):
+    response = client.post("/api/rules", json={"name": "Too long", "kind": "duration", "status": "open"})
+    assert response.status_code == 400
+
+    assert client.get("/api/rules").json() == []
+
+
+def test_delete_rule(client, uuids):
+    rule = client.post("/api/rules", json={"name": "Any offline", "kind": "state", "status": "offline"}).json()
+
+    assert client.delete(f"/api/rules/{rule["id"]}").status_code == 200
+    assert client.delete(f"/api/rules/{rule["id"]}").status_code == 404
+    assert client.get("/api/rules").json() == []
+
+
+def test_armed_state_survives_restart(client, session, uuids):
+    client.post("/api/rules", json={
+        "name": "Front door open",
+        "kind": "state",
+        "status": "open",
+        "location": "Main Entrance",
+        "armed_only": True,
+    })
+    assert client.post("/api/rules/arm?location=Main Entrance").json() == {"armed": ["Main Entrance"]}
+
+    # A restart loses everything in memory, the lifespan loads it back from the database
+    rule_engine.load([])
+    assert rule_engine.armed == set()
+    load_site_state(DEFAULT_SITE, session)
+
+    assert client.get("/api/rules/armed").json() == {"armed": ["Main Entrance"]}
+
+    client.get(f"/api/devices/{uuids["front_door"]}/trigger?new_status=open")
+
+    events = client.get("/api/events?limit=100").json()
+    assert [event["type"] for event in events].count(EventType.RULE_ALARM.value) == 1
+
+    assert client.post("/api/rules/disarm").json() == {"armed": []}
+    load_site_state(DEFAULT_SITE, session)
+    assert rule_engine.armed == set()
@@ -2,13 +2,36 @@ from fastapi.testclient import TestClient
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.pool import StaticPool
 
-from backend.app.main import app
-from backend.app.api.deps import get_session
-from backend.app.models import Device, DeviceStatus
+from backend.app.main import app, load_site_state
+from backend.app.api.deps import get_session, get_read_session
+from backend.app.core.config import settings
+from backend.app.core.ingest import ingest_guard
+from backend.app.core.search import create_search_tables
+from backend.app.core.database import create_primary_engine
+from backend.app.models import DEFAULT_SITE, Device, DeviceStatus
 
+import os
 import pytest
 import uuid 
 
+@pytest.fixture(autouse=True)
+def no_auth(monkeypatch):
+    """
+        Tests run without authentication unless they turn it back on
+    """
+    monkeypatch.setattr(settings, "AUTH_ENABLED", False)
+
+
+@pytest.fixture(autouse=True)
+def reset_ingest_guard():
+    """
+        Rate limits and repeated readings do not carry over between tests
+    """
+    ingest_guard.clear()
+    yield
+    ingest_guard.clear()
+
+
 @pytest.fixture(name="uuids", scope="module")
 def test_uuids():
     
@@ -24,15 +47,23 @@ def test_uuids():
 @pytest.fixture(name="session", scope="function")
 def session_fixture(uuids):
     """
-        Create a new database for each test.
+        Create a new database for each test. In memory SQLite unless
+        TEST_DATABASE_URL points at a database to run the suite against
+        (e.g. postgresql+psycopg://localhost/secury_test, it is wiped).
     """
-    engine = create_engine(
-        "sqlite:///:memory:",
-        connect_args = {"check_same_thread": False},
-        poolclass = StaticPool,
-    )
+    url = os.environ.get("TEST_DATABASE_URL")
+    if url:
+        engine = create_primary_engine(url)
+        SQLModel.metadata.drop_all(engine)
+    else:
+        engine = create_engine(
+            "sqlite:///:memory:",
+            connect_args = {"check_same_thread": False},
+            poolclass = StaticPool,
+        )
     
     SQLModel.metadata.create_all(engine)
+    create_search_tables(engine)
 
     with Session(engine) as session:
         session.add_all([
@@ -65,17 +96,25 @@ def session_fixture(uuids):
 
         yield session
 
+    engine.dispose()
+
 @pytest.fixture(name="client", scope="function")
-def client_fixture(session: Session):
+def client_fixture(session: Session, monkeypatch):
     """
         Provide a TestClient instance which
         simulates HTTP and websocket requestsfor FastAPI app
     """
+    # Seed before the test state is loaded below, not in the background after it
+    monkeypatch.setattr(settings, "FAST_STARTUP", False)
+
     def get_session_override():
         yield session
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
     
     with TestClient(app) as c:
+        # lifespan loads in-memory state from the real database, point it at the test one
+        load_site_state(DEFAULT_SITE, session)
         yield c
 
     app.dependency_overrides.clear()
\ No newline at end of file
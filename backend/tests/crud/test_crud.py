@@ -1,7 +1,14 @@
 from datetime import datetime, timedelta
 
+from sqlmodel import select
+
 from backend.app import crud
-from backend.app.models import Device, DeviceCreate, DeviceUpdate, DeviceStatus, EventCreate, EventType
+from backend.app.core.config import settings
+from backend.app.core.summary import device_summary
+from backend.app.models import (
+    BatteryChunk, Device, DeviceCreate, DeviceReading, DeviceState, DeviceUpdate, DeviceStatus, Event, EventCreate, EventRollup, EventType,
+    RollupResolution, RollupGroup
+)
 
 def test_get_devices(session):
     devices = crud.get_devices(session=session)
@@ -102,6 +109,9 @@ def test_check_offline_devices(session, uuids):
     device = crud.get_device_by_id(session=session, device_id=uuids["window"])
     assert device.status == DeviceStatus.OFFLINE
 
+    events = [event for event in crud.get_event_rows(session=session, limit=10) if event["device_id"] == uuids["window"]]
+    assert [event["details"] for event in events] == [f"{device.name} has gone offline"]
+
 
 def test_check_offline_devices_no_change(session):
     """
@@ -153,3 +163,250 @@ def test_get_events_with_limit(session, uuids):
     events = crud.get_events(session=session, limit=5)
 
     assert len(events) == 5
+
+
+def test_summary_tracks_device_writes(session, uuids):
+    device_summary.rebuild(crud.get_devices(session=session))
+
+    created = crud.create_device(session=session, device=DeviceCreate(name="Garage", type="Door", location="Garage", battery=3))
+    assert device_summary.snapshot()["total"] == 4
+    assert device_summary.snapshot()["lowest_battery"][0]["id"] == str(created.id)
+
+    crud.delete_device(session=session, device_id=created.id)
+    summary = device_summary.snapshot()
+
+    assert summary["total"] == 3
+    assert summary["by_type"] == {"Window": 1, "Door": 2}
+    assert "Garage" not in summary["by_location"]
+
+
+def test_event_rollups_per_resolution(session, uuids):
+    for _ in range(3):
+        crud.create_event(
+            session=session,
+            event=EventCreate(device_id=uuids["front_door"], type=EventType.STATUS_CHANGE, details="Rollup"),
+        )
+
+    now = datetime.now()
+    for resolution in RollupResolution:
+        rows = crud.get_event_rollups(
+            session=session,
+            resolution=resolution,
+            group_by=RollupGroup.DEVICE,
+            start=now - timedelta(minutes=5),
+            end=now + timedelta(minutes=1),
+        )
+
+        assert sum(count for _, _, count in rows) == 3
+        assert {device_id for _, device_id, _ in rows} == {uuids["front_door"]}
+        assert all(bucket == crud.rollup_bucket(bucket, resolution) for bucket, _, _ in rows)
+
+
+def test_backfill_event_rollups(session, uuids):
+    device_key = crud.get_device_key(session=session, device_id=uuids["window"])
+    start = datetime(2026, 1, 1, 10, 15, 30)
+    session.add_all([
+        Event(device_key=device_key, type=EventType.STATUS_CHANGE, note="Before rollups", timestamp=start),
+        Event(device_key=device_key, type=EventType.STATUS_CHANGE, timestamp=start + timedelta(seconds=20)),
+        Event(device_key=device_key, type=EventType.STATUS_CHANGE, timestamp=start + timedelta(minutes=50)),
+    ])
+    session.commit()
+
+    assert crud.backfill_event_rollups(session=session) == 3
+    # Only runs while the rollup table is empty
+    assert crud.backfill_event_rollups(session=session) == 0
+
+    counts = {
+        (rollup.resolution, rollup.bucket): rollup.count
+        for rollup in session.exec(select(EventRollup).where(EventRollup.device_id == uuids["window"]))
+    }
+    assert counts == {
+        (RollupResolution.MINUTE, datetime(2026, 1, 1, 10, 15)): 2,
+        (RollupResolution.MINUTE, datetime(2026, 1, 1, 11, 5)): 1,
+        (RollupResolution.HOUR, datetime(2026, 1, 1, 10)): 2,
+        (RollupResolution.HOUR, datetime(2026, 1, 1, 11)): 1,
+        (RollupResolution.DAY, datetime(2026, 1, 1)): 3,
+    }
+    assert {rollup.location for rollup in session.exec(select(EventRollup))} == {"Room 1"}
+
+
+def test_compact_event_fields(session, uuids):
+    event = crud.create_event(
+        session=session,
+        event=EventCreate(
+            device_id=uuids["back_door"],
+            type=EventType.STATUS_CHANGE,
+            old_status=DeviceStatus.OPEN,
+            new_status=DeviceStatus.CLOSED,
+            battery=55,
+        ),
+    )
+
+    assert isinstance(event.seq, int)
+    assert event.device_id == uuids["back_door"]
+    assert event.details == "status changed to closed (battery: 55%)"
+    # Text that the structured fields already express is not stored
+    assert event.note is None
+
+    second = crud.create_event(
+        session=session,
+        event=EventCreate(device_id=uuids["back_door"], type=EventType.BATTERY_LOW, battery=4),
+    )
+
+    assert second.device_key == event.device_key
+    assert second.details == "battery low: 4%"
+
+    exported = [row for batch in crud.iter_events(session=session, device_id=uuids["back_door"]) for row in batch]
+
+    assert [row["id"] for row in exported] == [event.id, second.id]
+    assert [row["details"] for row in exported] == [event.details, second.details]
+
+
+def test_device_state_history(session, uuids):
+    assert crud.backfill_device_states(session=session) == 3
+    assert crud.backfill_device_states(session=session) == 0
+
+    before = datetime.now()
+    window = crud.get_device_by_id(session=session, device_id=uuids["window"])
+    crud.update_device(session=session, db_device=window, device_in=DeviceUpdate(status=DeviceStatus.OPEN))
+    # Only last_seen changes, no history row
+    crud.update_device(session=session, db_device=window, device_in=DeviceUpdate(status=DeviceStatus.OPEN))
+    crud.delete_device(session=session, device_id=uuids["back_door"])
+
+    then = {state["device_id"]: state for state in crud.get_device_states_at(session=session, at=before)}
+    now = {state["device_id"]: state for state in crud.get_device_states_at(session=session, at=datetime.now())}
+
+    assert then[uuids["window"]]["status"] == DeviceStatus.CLOSED
+    assert then[uuids["back_door"]]["status"] == DeviceStatus.OPEN
+    assert now[uuids["window"]]["status"] == DeviceStatus.OPEN
+    assert uuids["back_door"] not in now
+    assert crud.get_device_states_at(session=session, at=before - timedelta(days=1)) == []
+
+
+def test_time_in_status(session, uuids):
+    start = datetime(2026, 1, 1)
+    device = crud.create_device(session=session, device=DeviceCreate(name="Gate", type="Door", location="Yard"))
+    key = crud.get_device_key(session=session, device_id=device.id)
+
+    # Closed before the range, open 10 minutes, closed, open for the last 5 minutes
+    session.add_all([
+        DeviceState(device_key=key, valid_from=start - timedelta(hours=1), status=DeviceStatus.CLOSED),
+        DeviceState(device_key=key, valid_from=start + timedelta(minutes=10), status=DeviceStatus.OPEN),
+        DeviceState(device_key=key, valid_from=start + timedelta(minutes=20), status=DeviceStatus.CLOSED),
+        DeviceState(device_key=key, valid_from=start + timedelta(minutes=55), status=DeviceStatus.OPEN, battery=50),
+    ])
+    session.commit()
+
+    times = {
+        row["device_id"]: row
+        for row in crud.get_time_in_status(session=session, status=DeviceStatus.OPEN, start=start, end=start + timedelta(hours=1))
+    }
+
+    assert times[device.id]["seconds"] == 15 * 60
+    assert times[device.id]["entered"] == 2
+    # Devices created after the range are not part of it
+    assert all(row["seconds"] == 0 for device_id, row in times.items() if device_id != device.id)
+
+
+def test_battery_readings_are_chunked(session, uuids, monkeypatch):
+    monkeypatch.setattr(settings, "BATTERY_CHUNK_SIZE", 3)
+    device = crud.get_device_by_id(session=session, device_id=uuids["window"])
+
+    for battery in (90, 89, 89, 88, 87):
+        crud.update_device(session=session, db_device=device, device_in=DeviceUpdate(battery=battery))
+    # Readings without battery are not part of the series
+    crud.update_device(session=session, db_device=device, device_in=DeviceUpdate(status=DeviceStatus.OPEN))
+
+    chunks = session.exec(select(BatteryChunk).order_by(BatteryChunk.start)).all()
+    assert [chunk.count for chunk in chunks] == [3, 2]
+    assert [(chunk.first_value, chunk.last_value) for chunk in chunks] == [(90, 89), (88, 87)]
+
+    readings = crud.get_battery_readings(session=session, device_id=uuids["window"])
+    assert [battery for _, battery in readings] == [90, 89, 89, 88, 87]
+    assert crud.get_battery_readings(session=session, device_id=uuids["window"], start=readings[3][0]) == readings[3:]
+
+    assert crud.load_battery_trends(session=session, since=datetime.now() - timedelta(days=1)) == 5
+
+
+def test_search_devices(session, uuids):
+    assert crud.backfill_search_index(session=session) == 3
+    # Only once, the index is no longer empty
+    assert crud.backfill_search_index(session=session) == 0
+
+    assert {d["id"] for d in crud.search_devices(session=session, query="door")} == {uuids["front_door"], uuids["back_door"]}
+    # Every word has to match, as a prefix
+    assert [d["id"] for d in crud.search_devices(session=session, query="ba do")] == [uuids["back_door"]]
+    assert len(crud.search_devices(session=session, query="entr", device_type="Door", limit=1)) == 1
+    assert crud.search_devices(session=session, query="garage") == []
+    assert crud.search_devices(session=session, query="*)(\"") == []
+
+    # Kept in sync by the write paths
+    device = crud.get_device_by_id(session=session, device_id=uuids["window"])
+    crud.update_device(session=session, db_device=device, device_in=DeviceUpdate(name="Garage Window"))
+    assert [d["id"] for d in crud.search_devices(session=session, query="garage")] == [uuids["window"]]
+
+    crud.delete_device(session=session, device_id=uuids["window"])
+    assert crud.search_devices(session=session, query="garage") == []
+
+
+def test_search_events(session, uuids):
+    crud.backfill_search_index(session=session)
+
+    first = crud.create_event(session=session, event=EventCreate(
+        device_id=uuids["back_door"], type=EventType.STATUS_CHANGE, new_status=DeviceStatus.OPEN,
+    ))
+    crud.create_event(session=session, event=EventCreate(
+        device_id=uuids["window"], type=EventType.BATTERY_LOW, battery=5,
+    ))
+
+    # Device labels and event type words are searchable
+    assert [e["device_id"] for e in crud.search_events(session=session, query="back entrance")] == [uuids["back_door"]]
+    assert [e["device_id"] for e in crud.search_events(session=session, query="low")] == [uuids["window"]]
+    assert len(crud.search_events(session=session, query="room")) == 1
+
+    assert crud.search_events(session=session, query="back", event_type=EventType.BATTERY_LOW) == []
+    assert crud.search_events(session=session, query="back", start=first.timestamp + timedelta(seconds=1)) == []
+    assert len(crud.search_events(session=session, query="back", end=first.timestamp + timedelta(seconds=1))) == 1
+
+
+def test_search_without_full_text_index(session, uuids, monkeypatch):
+    monkeypatch.setattr(crud.search, "enabled", lambda engine: False)
+
+    crud.create_event(session=session, event=EventCreate(
+        device_id=uuids["back_door"], type=EventType.BATTERY_LOW, battery=5,
+    ))
+
+    assert {d["id"] for d in crud.search_devices(session=session, query="door")} == {uuids["front_door"], uuids["back_door"]}
+    assert [d["id"] for d in crud.search_devices(session=session, query="back door")] == [uuids["back_door"]]
+    assert [e["device_id"] for e in crud.search_events(session=session, query="back")] == [uuids["back_door"]]
+    assert [e["device_id"] for e in crud.search_events(session=session, query="battery")] == [uuids["back_door"]]
+
+
+def test_apply_readings_older_than_the_device_state(session, uuids):
+    device = crud.get_device_by_id(session=session, device_id=uuids["back_door"])
+    taken = device.last_updated - timedelta(minutes=5)
+
+    # Before the device has any history, nothing to compare with
+    counts = crud.apply_readings(session=session, readings=[
+        DeviceReading(device_id=uuids["back_door"], status=DeviceStatus.CLOSED, timestamp=taken),
+    ])
+    assert counts == {"applied": 0, "coalesced": 1, "stale": 0, "unknown": 0}
+
+    key = crud.get_device_key(session=session, device_id=uuids["back_door"])
+    session.add(DeviceState(device_key=key, valid_from=taken - timedelta(minutes=5), status=DeviceStatus.OPEN, battery=80))
+    session.commit()
+
+    counts = crud.apply_readings(session=session, readings=[
+        DeviceReading(device_id=uuids["back_door"], status=DeviceStatus.CLOSED, timestamp=taken),
+    ])
+    assert counts == {"applied": 0, "coalesced": 0, "stale": 1, "unknown": 0}
+
+    # History only, the current state is newer
+    device = crud.get_device_by_id(session=session, device_id=uuids["back_door"])
+    assert device.status == DeviceStatus.OPEN
+
+    [event] = session.exec(select(Event)).all()
+    assert (event.timestamp, event.old_status, event.new_status) == (taken, DeviceStatus.OPEN, DeviceStatus.CLOSED)
+
+    states = {state["device_id"]: state for state in crud.get_device_states_at(session=session, at=taken)}
+    assert (states[uuids["back_door"]]["status"], states[uuids["back_door"]]["battery"]) == (DeviceStatus.CLOSED, 80)
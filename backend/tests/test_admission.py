@@ -0,0 +1,147 @@
+from starlette.websockets import WebSocketDisconnect
+
+from backend.app.core.admission import AdmissionController, Overloaded, RouteClass, admission, classify
+
+import asyncio
+import pytest
+
+def test_classify():
+    assert classify("GET", "/api/devices/abc/trigger", b"new_status=open&battery=80") == RouteClass.ALARM
+    assert classify("GET", "/api/sites/north/devices/abc/trigger", b"new_status=offline") == RouteClass.ALARM
+    assert classify("GET", "/api/devices/abc/trigger", b"new_status=closed") == RouteClass.INGEST
+    assert classify("POST", "/api/devices/readings") == RouteClass.INGEST
+    assert classify("POST", "/api/devices/readings", headers=[(b"x-alarm-readings", b"1")]) == RouteClass.ALARM_BATCH
+    assert classify("GET", "/api/events/export") == RouteClass.EXPORT
+    assert classify("GET", "/api/events/rollups") == RouteClass.HISTORY
+    assert classify("GET", "/api/devices/abc/battery") == RouteClass.HISTORY
+    assert classify("GET", "/api/devices") == RouteClass.INTERACTIVE
+    assert classify("GET", "/stream") is None
+    assert classify("GET", "/health") is None
+
+
+def test_limits_queue_and_shed():
+    async def scenario():
+        controller = AdmissionController({"ingest": 1, "history": 1}, queue_size=1, queue_timeout=1.0, shed_lag=1.0, shed_in_flight=100)
+        order = []
+
+        async def reading(name, hold):
+            async with controller.admit(RouteClass.INGEST):
+                order.append(name)
+                await hold.wait()
+
+        first_done, second_done = asyncio.Event(), asyncio.Event()
+        first = asyncio.create_task(reading("first", first_done))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(reading("second", second_done))
+        await asyncio.sleep(0)
+
+        # Limit reached and the queue is full
+        with pytest.raises(Overloaded):
+            async with controller.admit(RouteClass.INGEST):
+                pass
+
+        # A reading is waiting, history queries are shed
+        with pytest.raises(Overloaded):
+            async with controller.admit(RouteClass.HISTORY):
+                pass
+
+        # Alarms are never limited
+        async with controller.admit(RouteClass.ALARM):
+            assert controller.in_flight()["alarm"] == 1
+
+        first_done.set()
+        await first
+        await asyncio.sleep(0)
+        assert order == ["first", "second"]
+
+        second_done.set()
+        await second
+        assert controller.in_flight()["ingest"] == 0
+
+        async with controller.admit(RouteClass.HISTORY):
+            # Low priority requests do not queue
+            with pytest.raises(Overloaded):
+                async with controller.admit(RouteClass.HISTORY):
+                    pass
+
+        controller.lag = 2.0
+        with pytest.raises(Overloaded):
+            async with controller.admit(RouteClass.SNAPSHOT):
+                pass
+
+    asyncio.run(scenario())
+
+
+def test_queued_request_times_out():
+    async def scenario():
+        controller = AdmissionController({"ingest": 1}, queue_size=10, queue_timeout=0.01)
+
+        async with controller.admit(RouteClass.INGEST):
+            with pytest.raises(Overloaded):
+                async with controller.admit(RouteClass.INGEST):
+                    pass
+
+        # The slot went back, not to the waiter that gave up
+        assert controller.in_flight()["ingest"] == 0
+        async with controller.admit(RouteClass.INGEST):
+            pass
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_passes_its_slot_on():
+    async def scenario():
+        controller = AdmissionController({"ingest": 1}, queue_size=2, queue_timeout=1.0)
+        limiter = controller._limiters[RouteClass.INGEST]
+
+        assert await limiter.acquire(1.0)
+        waiting = asyncio.create_task(limiter.acquire(1.0))
+        await asyncio.sleep(0)
+
+        # The slot is handed over, then the request goes away before it runs
+        limiter.release()
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_alarm_header_does_not_skip_the_limits(client, uuids, monkeypatch):
+    limiter = admission._limiters[RouteClass.ALARM_BATCH]
+    monkeypatch.setattr(limiter, "limit", 1)
+    monkeypatch.setattr(limiter, "queue_size", 0)
+    monkeypatch.setattr(limiter, "in_flight", 1)
+
+    batch = {"readings": [{"device_id": str(uuids["window"]), "status": "closed", "timestamp": "2026-01-01T00:00:00"}]}
+    response = client.post("/api/devices/readings", json=batch, headers={"X-Alarm-Readings": "1"})
+    assert response.status_code == 503
+
+    monkeypatch.setattr(limiter, "in_flight", 0)
+    response = client.post("/api/devices/readings", json=batch, headers={"X-Alarm-Readings": "1"})
+    assert response.status_code == 200
+
+
+def test_overloaded_server_sheds_dashboard_traffic(client, uuids, monkeypatch):
+    # Any event loop lag counts as overload
+    monkeypatch.setattr(admission, "shed_lag", 0.0)
+
+    response = client.get("/api/events/export")
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+    assert client.get("/api/events/rollups").status_code == 503
+    assert client.get("/stream").status_code == 503
+
+    with pytest.raises(WebSocketDisconnect) as disconnect:
+        with client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+    assert disconnect.value.code == 1013
+
+    # Alarms, readings, the dashboard itself and probes still get through
+    assert client.get(f"/api/devices/{uuids['window']}/trigger?new_status=open").status_code == 200
+    assert client.get(f"/api/devices/{uuids['window']}/trigger?new_status=closed").status_code == 200
+    assert client.get("/api/devices").status_code == 200
+    assert client.get("/health").json()["in_flight"]["history"] == 0
@@ -0,0 +1,93 @@
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, select
+
+from backend.app.core import database
+from backend.app.core.config import settings
+from backend.app.core.database import create_primary_engine, create_read_engine, init_db
+from backend.app.models import Device, DeviceStatus, Event, EventType
+
+import pytest
+import uuid
+
+def test_read_engine_is_read_only_and_sees_writes(tmp_path):
+    primary = create_primary_engine(f"sqlite:///{tmp_path}/data/site.db")
+    with Session(primary) as session:
+        init_db(session)
+
+    read = create_read_engine(primary)
+    assert read is not primary
+
+    with Session(primary) as session:
+        session.add(Device(name="Gate", type="Door", location="Yard"))
+        session.commit()
+
+    with Session(read) as session:
+        assert [device.name for device in session.exec(select(Device))] == ["Gate"]
+
+        session.add(Device(name="Hall", type="Window", location="Hall"))
+        with pytest.raises(OperationalError):
+            session.commit()
+
+    primary.dispose()
+
+    # Still readable once the writer is gone
+    with Session(read) as session:
+        assert len(session.exec(select(Device)).all()) == 1
+
+
+def test_in_memory_database_shares_the_primary():
+    primary = create_primary_engine("sqlite://")
+    assert create_read_engine(primary) is primary
+
+
+def test_init_db_skips_checks_when_schema_matches(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "FAST_STARTUP", True)
+    primary = create_primary_engine(f"sqlite:///{tmp_path}/site.db")
+
+    assert database.stored_schema_fingerprint(primary) is None
+
+    with Session(primary) as session:
+        init_db(session)
+    assert database.stored_schema_fingerprint(primary) == database.schema_fingerprint()
+
+    def fail(engine):
+        raise AssertionError("schema checks should be skipped")
+
+    monkeypatch.setattr(database, "add_missing_columns", fail)
+    with Session(primary) as session:
+        init_db(session)
+
+    # A different schema (or FAST_STARTUP off) runs them again
+    monkeypatch.setattr(database, "schema_fingerprint", lambda: "changed")
+    with Session(primary) as session, pytest.raises(AssertionError):
+        init_db(session)
+
+    primary.dispose()
+
+
+def test_migrated_events_keep_their_ids(tmp_path):
+    primary = create_primary_engine(f"sqlite:///{tmp_path}/site.db")
+    device_id, kept_id = uuid.uuid4(), uuid.uuid4()
+
+    with primary.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE event (id CHAR(32) PRIMARY KEY, device_id CHAR(32), type VARCHAR, details VARCHAR, timestamp DATETIME)")
+        connection.exec_driver_sql(
+            "INSERT INTO event VALUES (?, ?, 'DEVICE_OFFLINE', 'Gate has gone offline', '2025-01-01 00:00:00.000000')",
+            (kept_id.hex, device_id.hex),
+        )
+
+    with Session(primary) as session:
+        init_db(session)
+
+        event = session.exec(select(Event)).one()
+        assert event.id == kept_id
+        assert event.new_status == DeviceStatus.OFFLINE
+        assert event.details == "Gate has gone offline"
+
+        # New events get random ids, not the next number
+        session.add(Event(device_key=event.device_key, type=EventType.STATUS_CHANGE, new_status=DeviceStatus.OPEN))
+        session.commit()
+        ids = [event.id for event in session.exec(select(Event).order_by(Event.seq))]
+        assert ids[1].int != ids[0].int + 1 and ids[1].version == 4
+
+    primary.dispose()
@@ -0,0 +1,194 @@
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+
+from backend.app.core.config import settings
+from backend.app.core.admission import ALARM_BATCH_HEADER
+from backend.app.gateway.buffer import ReadingQueue
+from backend.app.gateway.forwarder import Forwarder
+from backend.app.models import DeviceStatus
+
+import gzip
+import io
+import json
+import urllib.error
+import uuid
+
+def test_queue_coalesces_repeated_readings(tmp_path):
+    queue = ReadingQueue(str(tmp_path / "queue.db"), size=100)
+    device_id = uuid.uuid4()
+    start = datetime(2025, 3, 1, 12, 0)
+
+    assert queue.put(device_id, "open", 80, start) is False
+    assert queue.put(device_id, "open", None, start + timedelta(seconds=10)) is True
+    assert queue.put(device_id, "open", 80, start + timedelta(seconds=20)) is True
+    assert queue.put(device_id, "closed", 80, start + timedelta(seconds=30)) is False
+
+    readings = queue.peek(10)
+    assert [(reading.status, reading.timestamp, reading.last_seen) for reading in readings] == [
+        ("open", start, start + timedelta(seconds=20)),
+        ("closed", start + timedelta(seconds=30), start + timedelta(seconds=30)),
+    ]
+
+    queue.close()
+
+    # Still there after a restart
+    queue = ReadingQueue(str(tmp_path / "queue.db"), size=100)
+    assert len(queue) == 2
+    assert queue.peek(10) == readings
+
+
+def test_queue_keeps_the_latest_state_of_every_device(tmp_path):
+    queue = ReadingQueue(str(tmp_path / "queue.db"), size=3)
+    door, window = uuid.uuid4(), uuid.uuid4()
+    start = datetime(2025, 3, 1, 12, 0)
+
+    queue.put(door, "open", None, start)
+    queue.put(window, "open", None, start + timedelta(seconds=1))
+    queue.put(door, "closed", None, start + timedelta(seconds=2))
+    queue.put(window, "closed", None, start + timedelta(seconds=3))
+
+    # The door's first reading was superseded, the window's older one is kept
+    assert [(reading.device_id, reading.status) for reading in queue.peek(10)] == [
+        (window, "open"), (door, "closed"), (window, "closed"),
+    ]
+
+
+def test_ack_keeps_readings_seen_again_while_sending(tmp_path):
+    queue = ReadingQueue(str(tmp_path / "queue.db"), size=100)
+    door, window = uuid.uuid4(), uuid.uuid4()
+    start = datetime(2025, 3, 1, 12, 0)
+
+    queue.put(door, "open", None, start)
+    queue.put(window, "open", None, start)
+    sent = queue.peek(10)
+
+    queue.put(door, "open", None, start + timedelta(minutes=1))
+
+    assert queue.ack(sent) == 1
+    [left] = queue.peek(10)
+    assert left.device_id == door
+    assert left.last_seen == start + timedelta(minutes=1)
+
+
+#==========================================
+def _forwarder(tmp_path, **kwargs) -> Forwarder:
+    queue = ReadingQueue(str(tmp_path / "queue.db"), size=100)
+    return Forwarder(queue, "http://server.invalid", **kwargs)
+
+def _http_error(code: int, retry_after: str | None = None) -> urllib.error.HTTPError:
+    headers = {"Retry-After": retry_after} if retry_after else {}
+    return urllib.error.HTTPError("http://server.invalid", code, "error", headers, io.BytesIO())
+
+
+def test_forwarder_sends_gzipped_batches(tmp_path):
+    forwarder = _forwarder(tmp_path, batch_size=2)
+    start = datetime(2025, 3, 1, 12, 0, 0, 250000)
+    device_ids = [uuid.uuid4() for _ in range(3)]
+    for i, device_id in enumerate(device_ids):
+        forwarder.queue.put(device_id, "open", 50 + i, start + timedelta(seconds=i))
+
+    sent = []
+    forwarder._post = lambda body, alarm=False: sent.append(json.loads(gzip.decompress(body)))
+
+    assert forwarder.forward() is None
+    assert forwarder.forward() is None
+    assert forwarder.forward() is None
+
+    assert [len(batch["readings"]) for batch in sent] == [2, 1]
+    first = sent[0]["readings"][0]
+    assert first["device_id"] == str(device_ids[0])
+    assert datetime.fromisoformat(first["timestamp"]) == start
+    assert len(forwarder.queue) == 0
+
+
+def test_forwarder_keeps_readings_while_the_server_is_down(tmp_path):
+    forwarder = _forwarder(tmp_path, interval=1.0, max_delay=30.0)
+    forwarder.queue.put(uuid.uuid4(), "open", None, datetime.now())
+
+    def unreachable(body, alarm=False):
+        raise urllib.error.URLError("connection refused")
+
+    forwarder._post = unreachable
+    delays = [forwarder.forward() for _ in range(8)]
+
+    assert all(0 < delay <= 30.0 for delay in delays)
+    assert delays[-1] > delays[0]
+    assert len(forwarder.queue) == 1
+
+    def busy(body, alarm=False):
+        raise _http_error(503, retry_after="7")
+
+    forwarder._post = busy
+    assert forwarder.forward() == 7.0
+
+    forwarder._post = lambda body, alarm=False: None
+    assert forwarder.forward() is None
+    assert forwarder.failures == 0
+    assert len(forwarder.queue) == 0
+
+
+def test_forwarder_splits_and_drops_refused_batches(tmp_path):
+    forwarder = _forwarder(tmp_path, batch_size=4)
+    for _ in range(4):
+        forwarder.queue.put(uuid.uuid4(), "open", None, datetime.now())
+
+    def too_large(body, alarm=False):
+        raise _http_error(413)
+
+    forwarder._post = too_large
+    assert forwarder.forward() == 0.0
+    assert forwarder.batch_size == 2
+
+    def invalid(body, alarm=False):
+        raise _http_error(422)
+
+    forwarder._post = invalid
+    assert forwarder.forward() == 0.0
+    assert len(forwarder.queue) == 2
+
+
+def test_forwarded_readings_reach_the_server(client, tmp_path, uuids):
+    forwarder = _forwarder(tmp_path)
+    taken = datetime.now()
+    forwarder.queue.put(uuids["window"], "open", 60, taken)
+    forwarder.queue.put(uuids["window"], "open", 60, taken + timedelta(seconds=5))
+
+    def post(body, alarm=False):
+        # An open window goes ahead of other traffic
+        assert alarm
+        response = client.post(
+            "/api/devices/readings",
+            content=body,
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip", ALARM_BATCH_HEADER: "1"},
+        )
+        assert response.status_code == 200
+        assert response.json() == {"applied": 1, "coalesced": 0, "stale": 0, "unknown": 0, "dropped": 0}
+
+    forwarder._post = post
+    assert forwarder.forward() is None
+
+    device = client.get(f"/api/devices/{uuids['window']}").json()
+    assert device["status"] == DeviceStatus.OPEN
+    assert datetime.fromisoformat(device["last_updated"]) == taken
+    assert datetime.fromisoformat(device["last_seen"]) == taken + timedelta(seconds=5)
+
+
+#==========================================
+def test_gateway_queues_device_readings(tmp_path, monkeypatch):
+    from backend.app.gateway.main import app
+
+    monkeypatch.setattr(settings, "GATEWAY_QUEUE_FILE", str(tmp_path / "queue.db"))
+    # Nothing listens there, forwarding fails and the readings stay queued
+    monkeypatch.setattr(settings, "GATEWAY_SERVER_URL", "http://127.0.0.1:9")
+    device_id = uuid.uuid4()
+
+    with TestClient(app) as client:
+        response = client.get(f"/api/devices/{device_id}/trigger?new_status=open&battery=80")
+        assert response.status_code == 202
+        assert response.json() == {"success": True, "queued": True, "coalesced": False}
+
+        assert client.get(f"/api/devices/{device_id}/trigger?new_status=open").json()["coalesced"] is True
+        assert client.get(f"/api/devices/{device_id}/trigger?new_status=ajar").status_code == 400
+        assert client.get(f"/api/devices/{device_id}/trigger?new_status=open&battery=101").status_code == 400
+
+        assert client.get("/health").json()["queued"] == 1
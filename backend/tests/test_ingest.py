@@ -0,0 +1,42 @@
+from backend.app.core.ingest import Admission, IngestGuard
+from backend.app.core.metrics import INGEST_COALESCED, INGEST_DROPPED
+
+import uuid
+
+def test_token_bucket_refills():
+    guard = IngestGuard(rate=1, burst=2, window=0, size=10)
+    device_id = uuid.uuid4()
+    dropped = INGEST_DROPPED._unlabelled().get()
+
+    assert guard.admit(device_id, ("open",), now=0) == Admission.ACCEPT
+    assert guard.admit(device_id, ("closed",), now=0) == Admission.ACCEPT
+    assert guard.admit(device_id, ("open",), now=0) == Admission.DROP
+    assert guard.retry_after(device_id) > 0
+    assert INGEST_DROPPED._unlabelled().get() == dropped + 1
+
+    assert guard.admit(device_id, ("open",), now=1) == Admission.ACCEPT
+
+
+def test_identical_readings_within_window():
+    guard = IngestGuard(rate=100, burst=100, window=10, size=10)
+    device_id = uuid.uuid4()
+    coalesced = INGEST_COALESCED._unlabelled().get()
+
+    assert guard.admit(device_id, ("open", 50), now=0) == Admission.ACCEPT
+    assert guard.admit(device_id, ("open", 50), now=5) == Admission.COALESCE
+    # The window counts from the last written reading
+    assert guard.admit(device_id, ("open", 50), now=11) == Admission.ACCEPT
+    assert guard.admit(device_id, ("open", 40), now=12) == Admission.ACCEPT
+    assert INGEST_COALESCED._unlabelled().get() == coalesced + 1
+
+
+def test_least_recent_devices_are_forgotten():
+    guard = IngestGuard(rate=0, burst=1, window=10, size=2)
+    first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+
+    for device_id in (first, second, third):
+        assert guard.admit(device_id, ("open",), now=0) == Admission.ACCEPT
+
+    # first was evicted and starts with a full bucket again
+    assert guard.admit(first, ("closed",), now=0) == Admission.ACCEPT
+    assert guard.admit(third, ("closed",), now=0) == Admission.DROP
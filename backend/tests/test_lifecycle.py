@@ -0,0 +1,112 @@
+from starlette.websockets import WebSocketDisconnect
+
+from backend.app.core.config import settings
+from backend.app.core.lifecycle import LifecycleState, StartupReport, TaskSupervisor, supervisor
+from backend.app.core.websocket import Subscription, manager, sse_frames
+
+import asyncio
+import pytest
+
+def test_supervisor_restarts_and_cancels(monkeypatch):
+    monkeypatch.setattr(settings, "TASK_RESTART_BACKOFF_SECONDS", 0.01)
+    runs = []
+
+    async def flaky():
+        runs.append(1)
+        if len(runs) < 3:
+            raise RuntimeError("boom")
+        await asyncio.sleep(3600)
+
+    async def scenario():
+        tasks = TaskSupervisor()
+        drained = []
+
+        async def hook():
+            drained.append(True)
+
+        tasks.on_drain(hook)
+        tasks.start("flaky", flaky)
+        tasks.mark_ready()
+
+        await asyncio.sleep(0.1)
+        assert tasks.task_states() == {"flaky": "running"}
+
+        await tasks.shutdown(timeout=1)
+        return tasks, drained
+
+    tasks, drained = asyncio.run(scenario())
+
+    assert len(runs) == 3
+    assert drained == [True]
+    assert tasks.state == LifecycleState.STOPPED
+    assert tasks.task_states() == {"flaky": "cancelled"}
+
+
+def test_startup_report():
+    report = StartupReport()
+
+    with report.measure("schema"):
+        pass
+    with report.measure("schema"):
+        pass
+    report.record("seeding", 0.25)
+
+    assert report.finish() > 0
+    assert report.as_dict()["total_ms"] is not None
+    assert report.as_dict()["phases_ms"]["seeding"] == 250.0
+    assert set(report.as_dict()["phases_ms"]) >= {"schema", "seeding"}
+
+
+def test_health_and_readiness(client):
+    assert client.get("/ready").status_code == 200
+
+    data = client.get("/health").json()
+    assert data["status"] == "ready"
+    assert data["tasks"]["monitor_device_health"] == "running"
+    assert data["startup"]["total_ms"] > 0
+    assert {"schema", "state", "credentials"} <= data["startup"]["phases_ms"].keys()
+
+
+def test_drain_closes_clients_and_fails_readiness(client):
+    with client.websocket_connect("/ws") as websocket:
+        assert websocket.receive_json()["type"] == "initial_state"
+
+        client.portal.call(_drain)
+
+        message = websocket.receive_json()
+        assert message["type"] == "reconnect"
+        assert settings.RECONNECT_AFTER_MIN_SECONDS <= message["reconnect_after"] <= settings.RECONNECT_AFTER_MAX_SECONDS
+
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == 1012
+
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "draining"
+    assert "Retry-After" in response.headers
+
+    assert client.get("/stream").status_code == 503
+    assert client.get("/stream/poll?timeout=0").status_code == 503
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+
+
+async def _drain():
+    supervisor.drain()
+    await asyncio.sleep(0.05)
+
+
+def test_stream_ends_with_reconnect_hint():
+    async def scenario():
+        subscriber = manager.subscribe_stream(Subscription())
+        await manager.close_all()
+        return [frame async for frame in sse_frames(subscriber, last_event_id=manager.seq)]
+
+    frames = asyncio.run(scenario())
+
+    assert frames[-1].startswith(b"retry: ")
+    assert b"event: reconnect" in frames[-1]
+    assert manager.streams == []
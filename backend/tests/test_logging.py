@@ -0,0 +1,73 @@
+from backend.app.core.config import JsonFormatter, SamplingFilter, _NonBlockingQueueHandler
+
+import json
+import logging
+import os
+import queue
+import subprocess
+import sys
+
+def make_record(msg, *args, **extra):
+    record = logging.LogRecord("app", logging.INFO, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+def test_sampling_filter_keeps_one_in_rate():
+    sampling = SamplingFilter(rate=10)
+
+    passed = [sampling.filter(make_record("Hot path %s", i, sampled=True)) for i in range(100)]
+
+    assert sum(passed) == 10
+
+
+def test_sampling_filter_ignores_unsampled_records():
+    sampling = SamplingFilter(rate=10)
+
+    assert all(sampling.filter(make_record("Important %s", i)) for i in range(20))
+
+
+def test_json_formatter_output():
+    formatter = JsonFormatter()
+    record = make_record("Device %s changed", "door", sample_rate=10)
+
+    data = json.loads(formatter.format(record))
+
+    assert data["message"] == "Device door changed"
+    assert data["level"] == "INFO"
+    assert data["logger"] == "app"
+    assert data["sample_rate"] == 10
+
+    # Second handler reuses the serialized record
+    assert formatter.format(record) is formatter.format(record)
+
+
+def test_queue_handler_counts_and_reports_dropped_records():
+    log_queue = queue.Queue(maxsize=2)
+    handler = _NonBlockingQueueHandler(log_queue, report_interval=0)
+
+    for i in range(3):
+        handler.emit(make_record("Reading %s", i))
+
+    assert handler.dropped == 1
+
+    log_queue.get_nowait()
+    log_queue.get_nowait()
+    handler.emit(make_record("Reading %s", 3))
+
+    messages = [log_queue.get_nowait().msg for _ in range(2)]
+    assert messages == ["Reading 3", "Dropped 1 log records, the log queue was full"]
+    assert handler.dropped == 1
+
+
+def test_importing_opens_no_log_file(tmp_path):
+    # Only the server's lifespan and the gateway configure logging
+    code = (
+        "import logging, threading, backend.app.gateway.main, backend.app.main;"
+        "assert not logging.getLogger('app').handlers;"
+        "assert threading.active_count() == 1"
+    )
+    env = {**os.environ, "PYTHONPATH": os.getcwd(), "LOG_FILENAME": str(tmp_path / "secury.log")}
+
+    subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True)
+
+    assert not (tmp_path / "secury.log").exists()
@@ -0,0 +1,32 @@
+from backend.app.core.metrics import Histogram
+
+def test_metrics_endpoint(client, uuids):
+    client.get("/api/devices")
+    client.get(f"/api/devices/{uuids["window"]}/trigger?new_status=open")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    body = response.text
+
+    assert 'secury_http_request_duration_seconds_count{method="GET",route="/api/devices",status="200"}' in body
+    assert 'route="/api/devices/{device_id}/trigger"' in body
+    assert 'secury_db_query_duration_seconds_count{operation="update_device"}' in body
+    assert 'secury_db_commit_duration_seconds_count{operation="create_event"}' in body
+    assert 'secury_events_written_total{type="status_change"}' in body
+    assert "secury_websocket_clients 0" in body
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_histogram_seconds", "Test histogram", buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    lines = histogram.collect()
+
+    assert 'test_histogram_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_histogram_seconds_bucket{le="1.0"} 2' in lines
+    assert 'test_histogram_seconds_bucket{le="+Inf"} 3' in lines
+    assert "test_histogram_seconds_count 3" in lines
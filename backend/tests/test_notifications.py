@@ -0,0 +1,75 @@
+from backend.app.core.config import settings
+from backend.app.core.notifications import (
+    NotificationDispatcher, NotificationSink, FileSink, Notification
+)
+
+import asyncio
+import json
+
+class FlakySink(NotificationSink):
+    name = "flaky"
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.batches = []
+
+    async def send(self, batch):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("unreachable")
+
+        self.batches.append(batch)
+
+
+def fast_settings(monkeypatch):
+    monkeypatch.setattr(settings, "NOTIFY_BATCH_WINDOW", 0.05)
+    monkeypatch.setattr(settings, "NOTIFY_BACKOFF_SECONDS", 0.01)
+    monkeypatch.setattr(settings, "NOTIFY_RATE_PER_MINUTE", 6000)
+
+
+def test_file_sink_batches_and_deduplicates(tmp_path, monkeypatch):
+    fast_settings(monkeypatch)
+    path = tmp_path / "notifications.ndjson"
+
+    async def run():
+        dispatcher = NotificationDispatcher()
+        dispatcher.register(FileSink(str(path)))
+        await dispatcher.start()
+
+        assert dispatcher.notify(Notification("rule_alarm", "door", "Front door is open"))
+        assert not dispatcher.notify(Notification("rule_alarm", "door", "Front door is open"))
+        assert dispatcher.notify(Notification("device_offline", "window", "Room Window has gone offline"))
+
+        await dispatcher.stop()
+
+    asyncio.run(run())
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["event_type"] for line in lines] == ["rule_alarm", "device_offline"]
+
+
+def test_failed_batches_are_retried(monkeypatch):
+    fast_settings(monkeypatch)
+    sink = FlakySink(failures=2)
+
+    async def run():
+        dispatcher = NotificationDispatcher()
+        dispatcher.register(sink)
+        await dispatcher.start()
+
+        for i in range(3):
+            dispatcher.notify(Notification("battery_low", f"device {i}", "battery low: 5%"))
+
+        await dispatcher.stop()
+
+    asyncio.run(run())
+
+    assert len(sink.batches) == 1
+    assert len(sink.batches[0]) == 3
+
+
+def test_notify_without_running_dispatcher_is_dropped():
+    dispatcher = NotificationDispatcher()
+    dispatcher.register(FlakySink(failures=0))
+
+    assert not dispatcher.notify(Notification("rule_alarm", "door", "ignored"))
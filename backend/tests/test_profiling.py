@@ -0,0 +1,76 @@
+from backend.app.core.config import settings
+from backend.app.core.profiling import profiler, phase
+
+import asyncio
+import json
+import time
+
+def test_phase_is_noop_without_profile():
+    with phase("db"):
+        pass
+
+    with profiler.profile("not sampled", {}) as profile:
+        assert profile is None
+
+
+def test_tagged_request_writes_bounded_dumps(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(settings, "PROFILING_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(settings, "PROFILING_SLOW_MS", 0)
+    monkeypatch.setattr(settings, "PROFILING_INTERVAL_MS", 1)
+    monkeypatch.setattr(settings, "PROFILING_MAX_DUMPS", 2)
+    monkeypatch.setattr(settings, "PROFILING_DIR", str(tmp_path))
+
+    for _ in range(3):
+        with profiler.profile("GET /api/devices", {"x-profile": "1"}) as profile:
+            assert profile is not None
+
+            with phase("db"):
+                with phase("db"):
+                    time.sleep(0.01)
+
+    deadline = time.time() + 5
+    while len(list(tmp_path.glob("*.folded"))) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+
+    dumps = list(tmp_path.glob("*.json"))
+    assert len(dumps) <= 2
+
+    summary = json.loads(dumps[0].read_text())
+    assert summary["name"] == "GET /api/devices"
+    assert summary["phases_ms"]["db"] >= 10
+    assert summary["phases_ms"]["db"] <= summary["duration_ms"]
+
+
+def test_samples_only_the_profiled_task(monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(settings, "PROFILING_SLOW_MS", 10_000)
+    monkeypatch.setattr(settings, "PROFILING_INTERVAL_MS", 1)
+
+    def spin(seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    async def profiled_request():
+        with profiler.profile("GET /api/devices", {"x-profile": "1"}) as profile:
+            # The other request blocks the loop while this one waits
+            await asyncio.sleep(0)
+            spin(0.05)
+
+        return profile
+
+    async def other_request():
+        spin(0.05)
+
+    async def main():
+        profile, _ = await asyncio.gather(profiled_request(), other_request())
+        return profile
+
+    profile = asyncio.run(main())
+    profile.sampler.join()
+
+    stacks = profile.sampler.stacks
+    assert any("profiled_request" in stack for stack in stacks)
+    assert not any("other_request" in stack for stack in stacks)
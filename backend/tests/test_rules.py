@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+from backend.app.core.rules import RuleEngine
+from backend.app.models import AlarmRule, Device, DeviceStatus, EventType, RuleKind
+
+def make_device(name, location, status=DeviceStatus.OPEN, device_type="Window"):
+    return Device(name=name, type=device_type, location=location, status=status)
+
+def test_duration_rule_fires_when_state_is_held():
+    engine = RuleEngine()
+    engine.load([AlarmRule(name="Window left open", kind=RuleKind.DURATION, status=DeviceStatus.OPEN, device_type="Window", duration_seconds=600)])
+
+    now = datetime.now()
+    held = make_device("Kitchen window", "Kitchen")
+    closed_again = make_device("Bedroom window", "Bedroom")
+
+    assert engine.on_reading(held, DeviceStatus.CLOSED, now) == []
+    assert engine.on_reading(closed_again, DeviceStatus.CLOSED, now) == []
+
+    closed_again.status = DeviceStatus.CLOSED
+    engine.on_reading(closed_again, DeviceStatus.OPEN, now + timedelta(minutes=5))
+
+    assert engine.expire(now + timedelta(minutes=9)) == []
+
+    events = engine.expire(now + timedelta(minutes=11))
+    assert [event.device_id for event in events] == [held.id]
+    assert events[0].type == EventType.STATE_TIMEOUT
+
+
+def test_count_rule_needs_distinct_devices_in_window():
+    engine = RuleEngine()
+    engine.load([AlarmRule(name="Mass offline", kind=RuleKind.COUNT, status=DeviceStatus.OFFLINE, threshold=3, window_seconds=60)])
+
+    now = datetime.now()
+    devices = [make_device(f"Sensor {i}", "Garage", DeviceStatus.OFFLINE) for i in range(4)]
+
+    assert engine.on_reading(devices[0], DeviceStatus.CLOSED, now) == []
+    assert engine.on_reading(devices[1], DeviceStatus.CLOSED, now + timedelta(seconds=10)) == []
+    # Too late for the first one to count
+    assert engine.on_reading(devices[2], DeviceStatus.CLOSED, now + timedelta(seconds=65)) == []
+
+    events = engine.on_reading(devices[3], DeviceStatus.CLOSED, now + timedelta(seconds=66))
+    assert len(events) == 1
+    assert events[0].type == EventType.LOCATION_THRESHOLD
+
+
+def test_reading_only_checks_indexed_rules():
+    engine = RuleEngine()
+    engine.load(
+        AlarmRule(name=f"Room {i}", kind=RuleKind.STATE, status=DeviceStatus.OPEN, location=f"Room {i}")
+        for i in range(5000)
+    )
+
+    events = engine.on_reading(make_device("Door", "Room 42"), DeviceStatus.CLOSED)
+
+    assert [event.details for event in events] == ["Room 42: Door is open"]
+    assert [(event.type, event.new_status) for event in events] == [(EventType.RULE_ALARM, DeviceStatus.OPEN)]
+
+
+def test_duration_timers_resume_after_restart():
+    rule = AlarmRule(name="Window left open", kind=RuleKind.DURATION, status=DeviceStatus.OPEN, duration_seconds=600)
+    now = datetime.now()
+
+    held = make_device("Kitchen window", "Kitchen")
+    held.last_updated = now - timedelta(minutes=8)
+
+    # A fresh engine after a restart, the window was opened before it
+    engine = RuleEngine()
+    engine.load([rule])
+    engine.resume([held, make_device("Bedroom window", "Bedroom", DeviceStatus.CLOSED)])
+
+    assert engine.expire(now + timedelta(minutes=1)) == []
+    assert [event.device_id for event in engine.expire(now + timedelta(minutes=3))] == [held.id]
+
+    # Reloading the rules keeps pending timers
+    engine.on_reading(held, DeviceStatus.CLOSED, now)
+    engine.load([rule])
+    assert len(engine.expire(now + timedelta(minutes=11))) == 1
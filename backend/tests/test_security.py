@@ -0,0 +1,99 @@
+from backend.app.core.security import (
+    Authenticator, LoginLimiter, Principal, VerificationCache, bearer_token, hash_password, verify_password,
+)
+
+import uuid
+
+def test_password_hash_roundtrip():
+    hashed = hash_password("correct horse")
+
+    assert hashed.startswith("pbkdf2_sha256$")
+    assert verify_password("correct horse", hashed)
+    assert not verify_password("wrong horse", hashed)
+    assert not verify_password("correct horse", "")
+
+
+def test_bearer_token():
+    assert bearer_token("Bearer abc") == "abc"
+    assert bearer_token("bearer abc") == "abc"
+    assert bearer_token("Basic abc") is None
+    assert bearer_token(None) is None
+
+
+def test_token_issue_verify_and_revoke():
+    auth = Authenticator()
+    auth.configure("secret")
+    user_id = uuid.uuid4()
+
+    token, expires = auth.issue_token(user_id)
+    principal = auth.verify_token(token)
+
+    assert principal.subject == user_id
+    assert principal.expires == expires
+    # Served from the cache the second time
+    assert auth.cache.get(token) is principal
+
+    tampered = token[:-2] + ("AA" if not token.endswith("AA") else "BB")
+    assert auth.verify_token(tampered) is None
+
+    auth.revoke_token(principal.token_id, expires)
+    assert auth.cache.get(token) is None
+    assert auth.verify_token(token) is None
+
+    # A token signed with another secret is rejected
+    other = Authenticator()
+    other.configure("other secret")
+    assert other.verify_token(auth.issue_token(user_id)[0]) is None
+
+
+def test_expired_token_is_rejected():
+    auth = Authenticator()
+    auth.configure("secret")
+
+    token, _ = auth.issue_token(uuid.uuid4(), expires_in=-1)
+    assert auth.verify_token(token) is None
+
+
+def test_device_keys():
+    auth = Authenticator()
+    device_id = uuid.uuid4()
+
+    key, digest = auth.new_device_key()
+    assert digest not in key
+    assert auth.verify_device_key(key) is None
+
+    auth.add_device_key(digest, device_id)
+    principal = auth.verify_device_key(key)
+    assert principal.is_device and principal.subject == device_id
+
+    # Reloading without the key drops it, cached or not
+    auth.load_device_keys([])
+    assert auth.verify_device_key(key) is None
+
+
+def test_cache_expiry_and_eviction():
+    cache = VerificationCache(ttl=10, size=2)
+    principal = Principal(kind="user", subject=uuid.uuid4(), expires=105)
+
+    cache.put("a", principal, now=100)
+    assert cache.get("a", now=104) is principal
+    # Never outlives the credential
+    assert cache.get("a", now=106) is None
+
+    cache.put("a", principal, now=100)
+    cache.put("b", principal, now=100)
+    cache.put("c", principal, now=100)
+    assert cache.get("a", now=101) is None
+    assert cache.get("c", now=101) is principal
+
+
+def test_login_limiter_is_bounded():
+    limiter = LoginLimiter(size=4)
+
+    # Spraying emails from one address
+    for i in range(10):
+        limiter.failed(f"user{i}@example.com", "10.0.0.1", now=100)
+
+    assert len(limiter._failures) == 4
+    # The address is the most recent key of every failure, it is kept
+    assert len(limiter._failures["ip:10.0.0.1"]) == 10
@@ -0,0 +1,46 @@
+from sqlmodel import Session
+
+from backend.app import crud
+from backend.app.core.config import settings
+from backend.app.core.sites import sites
+from backend.app.core.websocket import Subscription
+from backend.app.models import DEFAULT_SITE, DeviceCreate, DeviceUpdate, EventCreate, EventType
+
+def test_sites_have_separate_databases_and_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SITES", ["north", "south"])
+    monkeypatch.setattr(settings, "SITE_DATABASE_URL", f"sqlite:///{tmp_path}/sites/{{site}}.db")
+
+    assert sites.ids() == [DEFAULT_SITE, "north", "south"]
+    assert (tmp_path / "sites").exists() is False
+
+    with Session(sites.engine("north")) as north, Session(sites.engine("south")) as south:
+        device = crud.create_device(session=north, device=DeviceCreate(name="Gate", type="Door", location="Yard"))
+        crud.create_device(session=south, device=DeviceCreate(name="Hall", type="Window", location="Hall"))
+        crud.update_device(session=north, db_device=device, device_in=DeviceUpdate(battery=40))
+        event = crud.create_event(session=north, event=EventCreate(device_id=device.id, type=EventType.BATTERY_LOW, battery=40))
+
+        assert device.site_id == "north"
+        assert event.site_id == "north"
+        assert [row["name"] for row in crud.get_device_rows(session=north)] == ["Gate"]
+        assert [row["name"] for row in crud.get_device_rows(session=south)] == ["Hall"]
+        assert crud.get_event_rows(session=south, limit=10) == []
+
+    assert (tmp_path / "sites" / "north.db").exists()
+    assert sites.state("north").summary.snapshot()["by_location"] == {"Yard": 1}
+    assert sites.state("south").summary.snapshot()["by_location"] == {"Hall": 1}
+    assert sites.state("north").device_changes is not sites.state(DEFAULT_SITE).device_changes
+
+
+def test_unknown_site_is_rejected(client):
+    assert client.get("/api/sites/nowhere/devices").status_code == 404
+    assert client.get("/api/sites/bad%20id/devices").status_code == 422
+    assert client.get(f"/api/sites/{DEFAULT_SITE}/devices").status_code == 200
+
+
+def test_subscriptions_are_scoped_to_a_site():
+    north = Subscription(site="north")
+
+    assert north.matches({"type": "device_updated", "site": "north"})
+    assert not north.matches({"type": "device_updated", "site": "south"})
+    assert not north.matches({"type": "device_updated"})
+    assert Subscription().matches({"type": "device_updated"})
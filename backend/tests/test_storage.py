@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import BigInteger, DateTime
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.dialects.postgresql import psycopg
+from sqlalchemy.schema import CreateTable
+from sqlmodel import Session, SQLModel
+
+from backend.app import crud
+from backend.app.core.config import settings
+from backend.app.core.database import create_primary_engine, init_db
+from backend.app.core.sqltypes import EpochMicroseconds
+from backend.app.core.storage import PostgresBackend, SQLiteBackend, backend_for
+from backend.app.models import (
+    Device, DeviceState, DeviceStatus, Event, EventCreate, EventType, RollupGroup, RollupResolution
+)
+
+import os
+import pytest
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def storage_engine(request, tmp_path):
+    """
+        A file database of each backend. PostgreSQL runs when TEST_POSTGRES_URL
+        is set (the database is wiped).
+    """
+    if request.param == "sqlite":
+        engine = create_primary_engine(f"sqlite:///{tmp_path}/site.db")
+    else:
+        url = os.environ.get("TEST_POSTGRES_URL")
+        if not url:
+            pytest.skip("TEST_POSTGRES_URL is not set")
+        engine = create_primary_engine(url)
+        SQLModel.metadata.drop_all(engine)
+
+    with Session(engine) as session:
+        init_db(session)
+
+    yield engine
+
+    engine.dispose()
+
+
+def test_bulk_events_keep_their_fields(storage_engine):
+    with Session(storage_engine) as session:
+        device = Device(name="Gate", type="Door", location="Yard")
+        session.add(device)
+        session.commit()
+
+        start = datetime(2025, 3, 1, 12, 0, 0, 123456)
+        written = crud.create_events(session=session, events=[
+            EventCreate(device_id=device.id, type=EventType.STATUS_CHANGE, new_status=DeviceStatus.OPEN, timestamp=start),
+            EventCreate(device_id=device.id, type=EventType.BATTERY_LOW, battery=4, timestamp=start + timedelta(seconds=30)),
+            EventCreate(device_id=device.id, type=EventType.RULE_ALARM, details="gate open at night", timestamp=start + timedelta(hours=1)),
+        ])
+        assert written == 3
+
+        rows = [row for batch in crud.iter_events(session=session) for row in batch]
+        assert [row["timestamp"] for row in rows] == [start, start + timedelta(seconds=30), start + timedelta(hours=1)]
+        assert [row["type"] for row in rows] == [EventType.STATUS_CHANGE, EventType.BATTERY_LOW, EventType.RULE_ALARM]
+        assert [row["details"] for row in rows] == ["status changed to open", "battery low: 4%", "gate open at night"]
+        assert all(row["device_id"] == device.id for row in rows)
+
+        # Counted per minute, upserted into the hourly buckets
+        rollups = crud.get_event_rollups(
+            session=session,
+            resolution=RollupResolution.HOUR,
+            group_by=RollupGroup.DEVICE,
+            start=start - timedelta(hours=1),
+            end=start + timedelta(hours=2),
+        )
+        assert [count for _, _, count in rollups] == [2, 1]
+
+
+def test_native_types_on_postgresql():
+    dialect = psycopg.dialect()
+
+    assert isinstance(EpochMicroseconds().load_dialect_impl(dialect), DateTime)
+    assert isinstance(EpochMicroseconds().load_dialect_impl(sqlite.dialect()), BigInteger)
+
+    ddl = str(CreateTable(DeviceState.__table__).compile(dialect=dialect))
+    assert "valid_from TIMESTAMP WITHOUT TIME ZONE" in ddl
+    assert "UUID" in str(CreateTable(Device.__table__).compile(dialect=dialect))
+
+
+def test_postgresql_engine_options(monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_STATEMENT_TIMEOUT_MS", 5000)
+    options = PostgresBackend().engine_options(pool_size=7)
+
+    assert options["pool_size"] == 7
+    assert options["pool_pre_ping"] is True
+    assert options["connect_args"]["options"] == "-c statement_timeout=5000"
+
+    assert isinstance(backend_for("postgresql+psycopg://secury@localhost/secury"), PostgresBackend)
+    assert isinstance(backend_for("sqlite:///database.db"), SQLiteBackend)
+    with pytest.raises(ValueError):
+        backend_for("mysql://localhost/secury")
+
+
+class _Copy:
+    def __init__(self, statements, sql):
+        self.rows = statements.setdefault(sql, [])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write_row(self, row):
+        self.rows.append(row)
+
+class _Cursor:
+    def __init__(self, statements):
+        self.statements = statements
+
+    def copy(self, sql):
+        return _Copy(self.statements, sql)
+
+    def close(self):
+        pass
+
+class _Connection:
+    """
+        Stands in for a psycopg connection behind a SQLAlchemy connection
+    """
+    def __init__(self):
+        self.dialect = psycopg.dialect()
+        self.statements = {}
+        self.connection = self
+        self.driver_connection = self
+
+    def cursor(self):
+        return _Cursor(self.statements)
+
+
+def test_postgresql_bulk_insert_uses_copy():
+    connection = _Connection()
+    timestamp = datetime(2025, 3, 1, 12, 0)
+    rows = [
+        Event(device_key=1, type=EventType.BATTERY_LOW, timestamp=timestamp, battery=4).model_dump(exclude={"seq"}),
+        Event(device_key=2, type=EventType.STATUS_CHANGE, timestamp=timestamp, new_status=DeviceStatus.OPEN).model_dump(exclude={"seq"}),
+    ]
+
+    assert PostgresBackend().bulk_insert(connection, Event.__table__, rows) == 2
+
+    [(sql, written)] = connection.statements.items()
+    assert sql == "COPY event (uid, device_key, type, timestamp, old_status, new_status, battery, note) FROM STDIN"
+    # Native UUIDs and timestamps, enum codes
+    assert written[0][0] == rows[0]["uid"]
+    assert written[0][1:4] == [1, 3, timestamp]
+    assert written[1][5] == 1
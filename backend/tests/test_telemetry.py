@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+from backend.app.core.telemetry import BatteryTrend, BatteryTrends, decode_chunk, decode_varints, encode_varints
+
+import pytest
+import uuid
+
+def test_varints_roundtrip():
+    values = [0, 1, 127, 128, 300, 86400]
+    assert decode_varints(encode_varints(values)) == values
+
+    changes = [0, -1, 1, -64, 63, -100]
+    assert decode_varints(encode_varints(changes, signed=True), signed=True) == changes
+    # Small changes take one byte each
+    assert len(encode_varints([0, -1, 1, -2], signed=True)) == 4
+
+
+def test_decode_chunk():
+    start = datetime(2026, 1, 1)
+    readings = decode_chunk(start, 80, encode_varints([60, 60]), encode_varints([-1, 0], signed=True))
+
+    assert readings == [(start, 80), (start + timedelta(minutes=1), 79), (start + timedelta(minutes=2), 79)]
+
+
+def test_trend_follows_drain_and_resets_on_replacement():
+    trend = BatteryTrend()
+    start = datetime(2026, 1, 1)
+
+    for day in range(10):
+        trend.add(start + timedelta(days=day), 90 - 2 * day, half_life_days=7, replaced_jump=20)
+
+    assert trend.slope == pytest.approx(-2.0)
+
+    trend.add(start + timedelta(days=10), 100, half_life_days=7, replaced_jump=20)
+    assert trend.readings == 1
+    assert trend.slope is None
+
+
+def test_predict():
+    trends = BatteryTrends()
+    start = datetime(2026, 1, 1)
+    draining, slow, empty, steady = (uuid.uuid4() for _ in range(4))
+
+    for day in range(5):
+        at = start + timedelta(days=day)
+        trends.add(draining, at, 50 - 5 * day)   # 30% on day 4, 10% on day 8
+        trends.add(slow, at, 90 - day)           # 10% on day 84
+        trends.add(empty, at, 8)
+        trends.add(steady, at, 70)
+
+    forecast = trends.predict(threshold=10, days=7, now=start + timedelta(days=4))
+
+    assert [row["device_id"] for row in forecast] == [empty, draining]
+    assert forecast[1]["drain_per_day"] == pytest.approx(5.0)
+    assert forecast[1]["days_left"] == pytest.approx(4.0)
+    assert forecast[0]["days_left"] == 0
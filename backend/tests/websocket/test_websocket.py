@@ -1,3 +1,12 @@
+from collections import deque
+
+from backend.app.core import websocket as websocket_module
+from backend.app.core.config import settings
+from backend.app.core.websocket import ConnectionManager, manager, Subscription, sse_frames
+
+import asyncio
+import pytest
+
 def test_websocket_connection(client):
     with client.websocket_connect("/ws") as websocket:
         data = websocket.receive_json()
@@ -17,4 +26,116 @@ def test_websocket_connection(client):
         
         ack = websocket.receive_json()
         assert ack["type"] == "ack"
-        assert ack["message"] == "Message received"
\ No newline at end of file
+        assert ack["message"] == "Message received"
+
+def test_websocket_filters(client, uuids):
+    with client.websocket_connect(f"/ws?types=device_updated&device_id={uuids["window"]}") as websocket:
+        assert websocket.receive_json()["type"] == "initial_state"
+
+        client.patch(f"/api/devices/{uuids["front_door"]}", json={"battery": 50})
+        client.patch(f"/api/devices/{uuids["window"]}", json={"battery": 60})
+
+        data = websocket.receive_json()
+        assert data["type"] == "device_updated"
+        assert data["device"]["id"] == str(uuids["window"])
+        assert data["device"]["battery"] == 60
+
+
+def test_long_poll(client, uuids):
+    cursor = client.get("/stream/poll?timeout=0").json()["cursor"]
+
+    client.patch(f"/api/devices/{uuids["window"]}", json={"battery": 70})
+
+    data = client.get(f"/stream/poll?cursor={cursor}&types=device_updated").json()
+    assert data["cursor"] > cursor
+    assert [message["device"]["battery"] for message in data["messages"]] == [70]
+
+    data = client.get(f"/stream/poll?cursor={data["cursor"]}&timeout=0").json()
+    assert data["messages"] == []
+
+
+def test_sse_frames_filter_and_resume():
+    async def scenario():
+        subscriber = manager.subscribe_stream(Subscription(types="device_updated"))
+        frames = sse_frames(subscriber, last_event_id=manager.seq)
+
+        await manager.broadcast({"type": "device_summary", "summary": {}})
+        await manager.broadcast({"type": "device_updated", "device": {"id": "abc", "location": "Hall"}})
+
+        # Replayed from the buffer, the queued copy is skipped
+        frame = await anext(frames)
+        await manager.broadcast({"type": "device_updated", "device": {"id": "def", "location": "Hall"}})
+        next_frame = await anext(frames)
+
+        await frames.aclose()
+        return subscriber, frame, next_frame
+
+    subscriber, frame, next_frame = asyncio.run(scenario())
+
+    assert b"event: device_updated" in frame
+    assert b'"id":"abc"' in frame
+    assert b'"id":"def"' in next_frame
+    assert subscriber not in manager.streams
+
+
+def test_broadcast_does_not_change_the_message():
+    message = {"type": "device_summary", "summary": {}}
+
+    asyncio.run(manager.broadcast(message, site="north"))
+
+    assert message == {"type": "device_summary", "summary": {}}
+    assert manager.recent[-1][1]["site"] == "north"
+
+
+def test_resume_needs_every_missed_message(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_REPLAY_SIZE", 2)
+    connections = ConnectionManager()
+
+    assert connections.can_resume(0)
+
+    for _ in range(3):
+        asyncio.run(connections.broadcast({"type": "device_summary"}))
+
+    # Message 1 fell out of the buffer
+    assert not connections.can_resume(0)
+    assert connections.can_resume(1)
+    assert connections.can_resume(3)
+    # From before a restart
+    assert not connections.can_resume(10)
+
+
+def test_stream_resumed_too_late_gets_initial_state(client, monkeypatch):
+    monkeypatch.setattr(manager, "recent", deque(maxlen=1))
+    cursor = manager.seq
+    for _ in range(2):
+        client.portal.call(manager.broadcast, {"type": "device_summary"})
+
+    captured = {}
+
+    def fake_frames(subscriber, last_event_id=None, initial_state=None):
+        captured.update(last_event_id=last_event_id, initial_state=initial_state)
+        manager.unsubscribe_stream(subscriber)
+
+        async def frames():
+            yield b""
+        return frames()
+
+    monkeypatch.setattr(websocket_module, "sse_frames", fake_frames)
+
+    assert client.get("/stream", headers={"Last-Event-ID": str(cursor)}).status_code == 200
+    assert captured["last_event_id"] is None
+    assert captured["initial_state"]["type"] == "initial_state"
+
+
+def test_failed_initial_state_leaves_no_connection_behind(client, monkeypatch):
+    def broken(site):
+        raise RuntimeError("database is gone")
+
+    monkeypatch.setattr(websocket_module, "build_initial_state", broken)
+
+    with pytest.raises(Exception):
+        with client.websocket_connect("/ws") as websocket:
+            websocket.receive_json()
+
+    assert manager.active_connections == []
+    assert manager.subscriptions == {}